@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Compare the lexer against the original character-by-character lexer.
+
+Usage: python benchmarks/bench_lexer.py [--sizes 1 10 100]
+"""
+
+import argparse
+import time
+
+from stercus import lex, tokenize
+from stercus.constants import BRACKETS
+from stercus.text2stercus import parse as text2stercus
+
+
+def lex_concat(src):
+    """The original lexer, kept here as a reference point."""
+    lexed_src = ""
+    for char in src:
+        if char in BRACKETS["ALL"]:
+            lexed_src += " " + char + " "
+        else:
+            lexed_src += char
+    return lexed_src.split()
+
+
+def generate_source(size):
+    """Generate roughly ``size`` bytes of text2stercus-style source."""
+    line = text2stercus("The quick brown fox jumps over the lazy dog.") + "\n"
+    return line * (size // len(line) + 1)
+
+
+def timed(func, src):
+    start = time.perf_counter()
+    result = func(src)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Input sizes to benchmark, in MB.",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'size':>8} {'concat':>10} {'lex':>10} {'tokenize':>10}"
+        f" {'lex speedup':>12} {'tokenize speedup':>17}"
+    )
+    for size in args.sizes:
+        src = generate_source(size * 1_000_000)
+        t_concat, expected = timed(lex_concat, src)
+        t_lex, tokens = timed(lex, src)
+        t_tokenize, _ = timed(lambda s: sum(1 for _ in tokenize(s)), src)
+        assert tokens == expected
+        print(
+            f"{size:>6}MB {t_concat:>9.2f}s {t_lex:>9.2f}s {t_tokenize:>9.2f}s"
+            f" {t_concat / t_lex:>11.1f}x {t_concat / t_tokenize:>16.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""Time each stage of the compiler and the binaries it produces.
+
+The preprocessor, lexer, parser and compiler are timed separately on large
+synthetic programs, and the example math programs and a loop-heavy program
+are compiled with a C compiler and timed on their largest inputs. Results can
+be saved as JSON and compared with an earlier run to catch regressions.
+
+Usage: python benchmarks/bench_pipeline.py [--scale 1] [--output new.json]
+           [--compare old.json]
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import stercus
+from generators import GENERATORS, nested_loops
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+# Number of top-level units generated for each program at scale 1.
+BASE_COUNTS = {
+    "deep_nesting": 100,
+    "many_applications": 2000,
+    "literal_runs": 200,
+    "text": 2000,
+}
+
+# Example programs with the inputs that make them run longest.
+BINARIES = {
+    "math/add.cus": b"\xff\xff",
+    "math/divide.cus": b"",
+    "math/double.cus": b"\xff",
+    "math/multiply.cus": b"\xff\xff",
+    "math/subtract.cus": b"\xff\xfe",
+}
+
+MEMORY_SIZE = 10000
+
+# Timings shorter than this are too noisy to be reported as regressions.
+MIN_SECONDS = 0.005
+
+
+def best_time(func, repeat):
+    """Return the shortest time of ``repeat`` calls, and the last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_stages(src, repeat, optimize):
+    """Time each stage of the pipeline on the source.
+
+    Returns
+    -------
+    : dict
+        Seconds taken by each stage, and the sizes of the source and of the
+        generated C.
+    """
+    results = {"source_bytes": len(src)}
+    results["preprocess"], src = best_time(lambda: stercus.preprocess(src), repeat)
+    results["lex"], tokens = best_time(lambda: stercus.lex(src), repeat)
+    results["parse"], applications = best_time(
+        lambda: stercus.parse(tokens), repeat
+    )
+    results["compile"], c_src = best_time(
+        lambda: stercus.compile(applications, MEMORY_SIZE, optimize=optimize),
+        repeat,
+    )
+    results["c_bytes"] = len(c_src)
+    return results
+
+
+def bench_binary(src, input, repeat, command, optimize):
+    """Compile a program to a binary and time running it on the input."""
+    c_src = stercus.compile_string(src, MEMORY_SIZE, optimize=optimize)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        c_file = os.path.join(tmpdir, "program.c")
+        binary = os.path.join(tmpdir, "program")
+        with open(c_file, "w") as f:
+            f.write(c_src)
+        subprocess.run([command, "-O2", "-o", binary, c_file], check=True)
+        seconds, _ = best_time(
+            lambda: subprocess.run(
+                [binary], input=input, stdout=subprocess.DEVNULL, check=True
+            ),
+            repeat,
+        )
+    return {"run": seconds}
+
+
+def run(args):
+    results = {
+        "stercus": stercus.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": args.scale,
+        "optimize": args.optimize,
+        "stages": {},
+        "binaries": {},
+    }
+
+    for name, generate in GENERATORS.items():
+        src = generate(max(1, int(BASE_COUNTS[name] * args.scale)))
+        results["stages"][name] = stages = bench_stages(
+            src, args.repeat, args.optimize
+        )
+        print(
+            f"{name:>20}"
+            + "".join(
+                f" {stage} {stages[stage]:.3f}s"
+                for stage in ("preprocess", "lex", "parse", "compile")
+            )
+        )
+
+    if args.cc is None:
+        return results
+    if shutil.which(args.cc) is None:
+        print(f"{args.cc} not found, skipping binaries", file=sys.stderr)
+        return results
+
+    programs = {
+        path: ((EXAMPLES / path).read_text(), input)
+        for path, input in BINARIES.items()
+    }
+    programs["nested_loops"] = (nested_loops(3), b"")
+    for name, (src, input) in programs.items():
+        results["binaries"][name] = binary = bench_binary(
+            src, input, args.repeat, args.cc, args.optimize
+        )
+        print(f"{name:>20} run {binary['run']:.3f}s")
+    return results
+
+
+def compare(old, new, threshold):
+    """Print the change in each timing between two runs.
+
+    Returns
+    -------
+    : list of str
+        The names of the timings that got slower by more than the threshold.
+    """
+    regressions = []
+    for group in ("stages", "binaries"):
+        for name, timings in new[group].items():
+            for key, seconds in timings.items():
+                try:
+                    before = old[group][name][key]
+                except KeyError:
+                    continue
+                if key.endswith("_bytes") or not before:
+                    continue
+                ratio = seconds / before
+                flag = ""
+                if ratio > threshold and seconds > MIN_SECONDS:
+                    flag = "  REGRESSION"
+                    regressions.append(f"{name}/{key}")
+                print(
+                    f"{name + '/' + key:>32} {before:.3f}s -> {seconds:.3f}s"
+                    f" ({ratio:.2f}x){flag}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1,
+        help="Multiplier for the size of the generated programs.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to run each benchmark; the best time is kept.",
+    )
+    parser.add_argument(
+        "-O",
+        "--optimize",
+        type=int,
+        default=0,
+        help="Optimization level to compile with.",
+    )
+    parser.add_argument(
+        "--cc",
+        default="gcc",
+        help="C compiler for the binary benchmarks. Pass an empty string to skip them.",
+    )
+    parser.add_argument("-o", "--output", help="File to save the results to as JSON.")
+    parser.add_argument(
+        "--compare", help="JSON results of an earlier run to compare with."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="Slowdown ratio reported as a regression (default 1.2).",
+    )
+    args = parser.parse_args()
+    if not args.cc:
+        args.cc = None
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
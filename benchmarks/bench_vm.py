@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""Compare the VM against a naive interpreter that walks the tokens.
+
+Usage: python benchmarks/bench_vm.py [--repeat 3]
+
+For each workload, prints the run time of the naive interpreter, of the VM
+without superinstructions and of the VM with them, and the rate of each as
+source tokens per second, counted by the naive interpreter, so the rates of
+the three compare the same work.
+"""
+
+import argparse
+import io
+import time
+
+from stercus import lex, parse, preprocess, vm
+from stercus.constants import C_FUNC_ARG_NAME
+
+from generators import nested_loops, text
+
+MEMORY_SIZE = 10000
+
+
+def run_tokens(app_table, memory):
+    """Run a program by walking its tokens, as a reference point.
+
+    Each applicator and conditional is interpreted from its tokens every
+    time it runs, and the ends of loop bodies and nested applicators are
+    found by counting brackets. Indices are read from memory again before
+    each application, as the language requires.
+    Out of bounds accesses and input are not supported.
+
+    Returns
+    -------
+    : tuple
+        The output of the program and the number of tokens executed.
+    """
+    output = bytearray()
+    count = 0
+
+    def signed(value):
+        return value - 256 if value > 127 else value
+
+    def matching(tokens, pos):
+        depth = 0
+        while True:
+            if tokens[pos] in "[(":
+                depth += 1
+            elif tokens[pos] in "])":
+                depth -= 1
+                if not depth:
+                    return pos
+            pos += 1
+
+    def read(tokens, pos, arg):
+        """Read the value of an index without running its applications."""
+        nonlocal count
+        count += 1
+        token = tokens[pos]
+        if token == "[":
+            index, _ = read(tokens, pos + 1, arg)
+            return signed(memory[index]), matching(tokens, pos) + 1
+        if token == C_FUNC_ARG_NAME:
+            return arg, pos + 1
+        return int(token), pos + 1
+
+    def skip(tokens, pos):
+        """The position after the index or application at pos."""
+        return matching(tokens, pos) + 1 if tokens[pos] == "[" else pos + 1
+
+    def applicator(tokens, pos, arg):
+        """Run an applicator, returning the position after it."""
+        nonlocal count
+        # The applications of nested applicators run before any of the
+        # applications of this one.
+        index_pos = pos + 1
+        if tokens[index_pos] == "[":
+            applicator(tokens, index_pos, arg)
+        pos = skip(tokens, index_pos)
+        applications = []
+        while tokens[pos] != "]":
+            applications.append(pos)
+            if tokens[pos] == "[":
+                applicator(tokens, pos, arg)
+            pos = skip(tokens, pos)
+
+        for start in applications:
+            # The index is read again for each application, as the one
+            # before may have changed it.
+            index, _ = read(tokens, index_pos, arg)
+            count += 1
+            token = tokens[start]
+            if token == "+":
+                memory[index] = (memory[index] + 1) & 0xFF
+            elif token == "-":
+                memory[index] = (memory[index] - 1) & 0xFF
+            elif token == ".":
+                output.extend(str(signed(memory[index])).encode())
+            elif token == ":":
+                output.append(memory[index])
+            elif token == "[" or token == C_FUNC_ARG_NAME or token[-1].isdigit():
+                memory[index] = read(tokens, start, arg)[0] & 0xFF
+            else:
+                statements(app_table[token], ((index + 128) & 0xFF) - 128)
+        return pos + 1
+
+    def statements(tokens, arg, pos=0, end=None):
+        nonlocal count
+        if end is None:
+            end = len(tokens)
+        while pos < end:
+            if tokens[pos] == "[":
+                pos = applicator(tokens, pos, arg)
+                continue
+            close = matching(tokens, pos)
+            while True:
+                count += 1
+                if tokens[pos + 1] == "[":
+                    applicator(tokens, pos + 1, arg)
+                index, body = read(tokens, pos + 1, arg)
+                if not memory[index]:
+                    break
+                statements(tokens, arg, body, close)
+            pos = close + 1
+
+    statements(app_table["main"], 0)
+    return bytes(output), count
+
+
+def generate_workloads():
+    loop = "[0 {0}] (0 [1 {0}] (1 {1} [1 -]) [0 -])"
+    return {
+        "nested_loops": nested_loops(2),
+        "copies": loop.format(120, "[2 [1]] [3 [2]] [4 + +] [5 [4]]"),
+        "calls": "{inc [$ +]} {twice [$ inc inc]} "
+        + loop.format(90, "[2 inc] [3 twice] [4 [3]]"),
+        "dynamic": loop.format(60, "[6 6] [[6] + + 5 +] [8 [[6] [7] -]]"),
+        "text": text(300),
+    }
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_vm(code):
+    memory = bytearray(MEMORY_SIZE)
+    stdout = io.BytesIO()
+    vm.execute(code, memory, stdout=stdout)
+    return stdout.getvalue(), memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs of each workload; the fastest is reported.",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'workload':>14} {'tokens':>10} {'naive':>15} {'vm':>15}"
+        f" {'vm fused':>15} {'speedup':>8}"
+    )
+    for name, src in generate_workloads().items():
+        app_table = parse(lex(preprocess(src)))
+
+        def naive():
+            memory = bytearray(MEMORY_SIZE)
+            output, count = run_tokens(app_table, memory)
+            return output, memory, count
+
+        t_naive, (output, memory, count) = timed(naive, args.repeat)
+        unfused = vm.load_string(src, fuse=False)
+        fused = vm.load_string(src)
+        t_unfused, result = timed(lambda: run_vm(unfused), args.repeat)
+        assert result == (output, memory)
+        t_fused, result = timed(lambda: run_vm(fused), args.repeat)
+        assert result == (output, memory)
+
+        rates = " ".join(
+            f"{count / t / 1e6:>6.2f}M/s {t:>5.2f}s"
+            for t in (t_naive, t_unfused, t_fused)
+        )
+        print(f"{name:>14} {count:>10} {rates} {t_naive / t_fused:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Generators of large synthetic Stercus programs for the benchmarks.
+
+Each generator takes a size parameter and returns Stercus source code.
+"""
+
+from stercus.text2stercus import parse as text2stercus
+
+# Highest index used by the generated programs, so that they fit in the
+# default memory.
+MAX_INDEX = 9999
+
+
+def deep_nesting(count, depth=100):
+    """Repeated conditionals nested ``depth`` deep, each over a nested index."""
+    index = "[" * depth + "0" + "]" * depth
+    block = f"[0 1] [1 {index}] " + "(0 " * depth + "[0 -]" + ")" * depth
+    return "\n".join([block] * count) + "\n"
+
+
+def application_name(i):
+    """A unique application name for ``i``, made of letters only."""
+    name = ""
+    while True:
+        name = chr(ord("a") + i % 26) + name
+        i //= 26
+        if not i:
+            return "f" + name
+
+
+def many_applications(count):
+    """``count`` small applications, each calling the one before it."""
+    names = [application_name(i) for i in range(count)]
+    lines = [f"{{{names[0]} [$ +]}}"]
+    for i in range(1, count):
+        lines.append(f"{{{names[i]} [$ {names[i - 1]} -] [[$] +]}}")
+    for i in range(count):
+        lines.append(f"[{i % MAX_INDEX} {names[i]}]")
+    return "\n".join(lines) + "\n"
+
+
+def literal_runs(count, run_length=64):
+    """Runs of literal assignments to consecutive indices, and copies."""
+    lines = []
+    for i in range(count):
+        start = (i * run_length) % (MAX_INDEX - 2 * run_length)
+        lines.append(
+            " ".join(f"[{start + j} {(i + j) % 256}]" for j in range(run_length))
+        )
+        lines.append(
+            " ".join(
+                f"[{start + run_length + j} [{start + j}]]"
+                for j in range(run_length)
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def text(count):
+    """``count`` lines of text2stercus output, with a comment per line."""
+    line = text2stercus("The quick brown fox jumps over the lazy dog.")
+    return f"# text2stercus output\n{line}\n" * count
+
+
+def nested_loops(depth=3):
+    """A program that spends its time in ``depth`` nested 255 step loops."""
+    src = "[0 -1] "
+    for i in range(depth):
+        src += f"({i} "
+        if i + 1 < depth:
+            src += f"[{i + 1} -1] "
+    src += f"[{depth} +]"
+    for i in reversed(range(depth)):
+        src += f" [{i} -])"
+    return src + f" [{depth} .]\n"
+
+
+GENERATORS = {
+    "deep_nesting": deep_nesting,
+    "many_applications": many_applications,
+    "literal_runs": literal_runs,
+    "text": text,
+}
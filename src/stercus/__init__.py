@@ -1,12 +1,21 @@
+from importlib.metadata import version, PackageNotFoundError
+
+try:
+    __version__ = version("stercus")
+except PackageNotFoundError:
+    __version__ = "0+unknown"
+
 from .constants import *
 from .errors import *
-from .compiler import compile
-from .lexer import lex
-from .parser import parse
-from .preprocessor import preprocess
+from .compiler import compile, compile_to_file
+from .lexer import lex, lex_stream, tokenize
+from .parser import parse, parse_stream, build_tree
+from .preprocessor import preprocess, preprocess_stream
+from .profiler import Profile, stage as _stage
+from .units import compile_units
 
 
-def compile_string(src, memory_size):
+def compile_string(src, memory_size, profile=None, **kwargs):
     """Compile a Stercus string to C.
 
     Parameters
@@ -15,16 +24,34 @@ def compile_string(src, memory_size):
         String of Stercus code.
     memory_size : int
         Number of bytes to use for program memory.
+    profile : Profile, optional
+        If provided, each stage is measured and recorded in the profile.
+    **kwargs : dict
+        Keyword arguments are passed to ``compile``.
 
     Returns
     -------
     : str
         Corresponding string of C code.
     """
-    src = preprocess(src)
-    src = lex(src)
-    src = parse(src)
-    src = compile(src, memory_size)
+    # Counters are keyed by the positions of tokens in the source, which the
+    # line-by-line preprocessor keeps.
+    positions = kwargs.get("instrument_counts", False)
+    with _stage(profile, "preprocess") as record:
+        if positions:
+            src = "".join(preprocess_stream(src.splitlines(keepends=True)))
+        else:
+            src = preprocess(src)
+        record["source_bytes"] = len(src)
+    with _stage(profile, "lex") as record:
+        src = list(tokenize(src)) if positions else lex(src)
+        record["tokens"] = len(src)
+    with _stage(profile, "parse") as record:
+        src = parse(src)
+        record["applications"] = len(src) - 1
+    with _stage(profile, "compile") as record:
+        src = compile(src, memory_size, **kwargs)
+        record["c_bytes"] = len(src)
     return src
 
 
@@ -46,3 +73,30 @@ def compile_file(path, **kwargs):
     with open(path) as f:
         src = f.read()
     return compile_string(src, **kwargs)
+
+
+def compile_stream(src_iter, out_file, memory_size, profile=None, **kwargs):
+    """Compile Stercus source to C without holding the whole program.
+
+    Each stage consumes the output of the previous one lazily, and the C code
+    for each application is written as soon as it is compiled, so memory use
+    is bounded by the largest single application.
+
+    Parameters
+    ----------
+    src_iter : iterable of str
+        Lines of Stercus code, such as an open file.
+    out_file : file-like
+        Text stream to write the C code to.
+    memory_size : int
+        Number of bytes to use for program memory.
+    profile : Profile, optional
+        If provided, the compilation is measured and recorded in the
+        profile. The stages run interleaved, so they are recorded together
+        as a single "stream" stage.
+    **kwargs : dict
+        Keyword arguments are passed to ``compile_to_file``.
+    """
+    with _stage(profile, "stream"):
+        tokens = lex_stream(preprocess_stream(src_iter))
+        compile_to_file(parse_stream(tokens), out_file, memory_size, **kwargs)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+""" Stercus command line interface. """
+
+import argparse
+import sys
+
+from stercus import heatmap, vm
+from stercus.errors import *
+from stercus.instrument import DEFAULT_COUNTS_FILE, load_counts
+
+
+def run(args):
+    try:
+        vm.run_file(args.src, memory_size=args.memory_size, args=args.args)
+    except (
+        UnbalancedBracketsError,
+        ApplicationNameError,
+        ExpressionError,
+        UnterminatedCommentError,
+    ) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+def show_heatmap(args):
+    try:
+        with open(args.src) as f:
+            src = f.read()
+        counters = load_counts(args.counts)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(heatmap.render(src, counters, color=args.color))
+    if args.top:
+        print()
+        print(heatmap.format_hot_spots(counters, args.top))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="The Stercus language.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Run a Stercus program without compiling it to C."
+    )
+    run_parser.add_argument("src", help="Stercus source file.")
+    run_parser.add_argument(
+        "args", nargs="*", help="Arguments to load into program memory."
+    )
+    run_parser.add_argument(
+        "-m",
+        "--memory-size",
+        type=int,
+        default=10000,
+        help="Number of bytes to use for program memory.",
+    )
+    run_parser.set_defaults(func=run)
+
+    heatmap_parser = subparsers.add_parser(
+        "heatmap",
+        help="Show the execution counts of a program compiled with stercusc --instrument on its source.",
+    )
+    heatmap_parser.add_argument("src", help="Stercus source file.")
+    heatmap_parser.add_argument(
+        "counts",
+        nargs="?",
+        default=DEFAULT_COUNTS_FILE,
+        help=f"Counts written by the program (default {DEFAULT_COUNTS_FILE}).",
+    )
+    heatmap_parser.add_argument(
+        "--color", action="store_true", help="Color the bars."
+    )
+    heatmap_parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of hottest counters to list after the source (default 10).",
+    )
+    heatmap_parser.set_defaults(func=show_heatmap)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+""" Static analysis of the Stercus syntax tree. """
+
+from .nodes import *
+
+# The range of values that a byte of memory, or the $ argument of an
+# application, may hold.
+CHAR_RANGE = (-128, 127)
+
+
+def to_char_range(value_range):
+    """Convert a range of ints to the range after conversion to a char."""
+    lo, hi = value_range
+    if lo >= CHAR_RANGE[0] and hi <= CHAR_RANGE[1]:
+        return value_range
+    if lo == hi:
+        value = (lo - CHAR_RANGE[0]) % 256 + CHAR_RANGE[0]
+        return value, value
+    return CHAR_RANGE
+
+
+def union_range(a, b):
+    """Smallest range containing both ranges. ``None`` is the empty range."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), max(a[1], b[1])
+
+
+def index_range(node, arg_range):
+    """Range of values of an index node.
+
+    Parameters
+    ----------
+    node : Node
+        A ``Literal``, ``Arg`` or ``Applicator`` index node.
+    arg_range : tuple or None
+        Range of the ``$`` argument of the enclosing application, or ``None``
+        if the application is never called.
+
+    Returns
+    -------
+    : tuple or None
+        The inclusive ``(low, high)`` range of the index.
+    """
+    kind = type(node)
+    if kind is Literal:
+        return node.value, node.value
+    if kind is Arg:
+        return arg_range
+    # The value of an applicator is whatever is stored in memory.
+    return CHAR_RANGE
+
+
+def call_sites(program):
+    """Find each use of a custom application.
+
+    Returns
+    -------
+    : list of tuple
+        ``(caller, index, callee)`` for each call, where ``index`` is the
+        index node of the applicator the callee is applied to.
+    """
+    sites = []
+    for caller, body in program.items():
+        for node in walk(body):
+            if type(node) is Applicator:
+                for application in node.applications:
+                    if type(application) is Call:
+                        sites.append((caller, node.index, application.name))
+    return sites
+
+
+def arg_ranges(program):
+    """Compute the range of the ``$`` argument of each application.
+
+    The ranges are propagated along the call graph until they stop changing.
+    Applications that are never called get ``None``.
+    """
+    # main has no argument of its own, so $ may hold anything there.
+    ranges = {name: None for name in program}
+    ranges["main"] = CHAR_RANGE
+
+    sites = call_sites(program)
+    changed = True
+    while changed:
+        changed = False
+        for caller, index, callee in sites:
+            if callee not in ranges:
+                continue
+            value_range = index_range(index, ranges[caller])
+            if value_range is None:
+                continue
+            value_range = union_range(ranges[callee], to_char_range(value_range))
+            if value_range != ranges[callee]:
+                ranges[callee] = value_range
+                changed = True
+    return ranges
+
+
+def mark_bounds_checks(program, memory_size):
+    """Clear the ``checked`` flag of accesses proven to be within memory.
+
+    An access is proven safe when its index is a literal within the memory,
+    or is ``$`` in an application that is only ever called with indices
+    within the memory.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes. Modified in
+        place.
+    memory_size : int
+        Number of bytes of program memory.
+    """
+    ranges = arg_ranges(program)
+    for name, body in program.items():
+        arg_range = ranges[name]
+        for node in walk(body):
+            if isinstance(node, MemoryAccess):
+                value_range = index_range(node.index, arg_range)
+                node.checked = not (
+                    value_range is not None
+                    and value_range[0] >= 0
+                    and value_range[1] < memory_size
+                )
@@ -0,0 +1,362 @@
+""" Run one Stercus program on many inputs at once with NumPy.
+
+The memories of all the runs are the rows of a single 2-D ``uint8`` array,
+one row per lane, and each applicator of the program is executed on every
+lane at once with array operations. Lanes only part ways at conditionals:
+the lanes whose byte is zero leave the loop, and the body runs on the lanes
+that are left, until none are. Indices that are literals are the same for
+every lane, so they cost a single column operation; indices read from memory
+or ``$`` become arrays holding the index of each lane.
+
+The syntax tree is optimized at level 2 by default, so that counting loops,
+which would otherwise run a different number of iterations on each lane, are
+replaced with arithmetic that runs on all lanes at once.
+
+NumPy is an optional dependency of Stercus, needed only by this module.
+"""
+
+import sys
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError(
+        "stercus.batch requires NumPy; install it with 'pip install numpy'"
+    ) from e
+
+from .constants import *
+from .errors import *
+from .lexer import lex
+from .nodes import *
+from . import optimizer
+from .parser import build_tree, parse
+from .preprocessor import preprocess
+from .vm import load_cli_args
+
+# The bytes that OUTPUT_INT and OUTPUT_CHAR write for each byte value.
+_INT_TEXT = np.array(
+    [str(value - 256 if value > 127 else value).encode() for value in range(256)],
+    dtype=object,
+)
+_CHAR_TEXT = np.array([bytes([value]) for value in range(256)], dtype=object)
+_INT_SIZE = np.array([len(text) for text in _INT_TEXT], dtype=np.intp)
+
+
+def _wrap_char(index):
+    """Wrap an index to a signed char, as it is passed to an application."""
+    return ((index + 128) & 0xFF) - 128
+
+
+def _select(value, keep):
+    """Select the kept lanes of a per-lane value, which may be uniform."""
+    return value[keep] if isinstance(value, np.ndarray) else value
+
+
+class _BatchExecutor:
+    """Runs statements on the lanes of a batch of memories."""
+
+    def __init__(self, program, memory, inputs, stderr):
+        self.program = program
+        self.memory = memory
+        self.size = memory.shape[1]
+        self.stderr = stderr
+        self.input, self.input_size = inputs
+        self.input_pos = np.zeros(len(memory), dtype=np.intp)
+        # The lanes of each output application, the bytes it wrote on each
+        # lane and their sizes.
+        self.output_lanes = []
+        self.output_text = []
+        self.output_sizes = []
+
+    def warn(self, indices):
+        for index in np.atleast_1d(indices).tolist():
+            self.stderr.write(f"attempted out of bounds access to index {index}\n")
+
+    def read(self, lanes, index):
+        """Unsigned bytes at the index on each lane; 0 if out of bounds."""
+        if not isinstance(index, np.ndarray):
+            if 0 <= index < self.size:
+                return self.memory[lanes, index]
+            self.warn(np.full(len(lanes), index))
+            return np.zeros(len(lanes), dtype=np.uint8)
+        valid = (index >= 0) & (index < self.size)
+        if valid.all():
+            return self.memory[lanes, index]
+        self.warn(index[~valid])
+        values = np.zeros(len(lanes), dtype=np.uint8)
+        values[valid] = self.memory[lanes[valid], index[valid]]
+        return values
+
+    def write(self, lanes, index, values):
+        """Write bytes at the index on each lane, skipping out of bounds."""
+        if not isinstance(index, np.ndarray):
+            if 0 <= index < self.size:
+                self.memory[lanes, index] = values
+            else:
+                self.warn(np.full(len(lanes), index))
+            return
+        valid = (index >= 0) & (index < self.size)
+        if valid.all():
+            self.memory[lanes, index] = values
+            return
+        self.warn(index[~valid])
+        if isinstance(values, np.ndarray):
+            values = values[valid]
+        self.memory[lanes[valid], index[valid]] = values
+
+    def value(self, node, lanes, arg, variables):
+        """Signed value of an index node on each lane, or one for all."""
+        kind = type(node)
+        if kind is Literal:
+            return node.value
+        if kind is Arg:
+            return arg
+        if kind is Local:
+            return variables[node.name]
+        index = self.value(node.index, lanes, arg, variables)
+        return self.read(lanes, index).view(np.int8).astype(np.intp)
+
+    def input_bytes(self, lanes):
+        """Read the next byte of input of each lane; 0xFF at the end."""
+        position = self.input_pos[lanes]
+        available = position < self.input_size[lanes]
+        values = np.full(len(lanes), 0xFF, dtype=np.uint8)
+        values[available] = self.input[lanes[available], position[available]]
+        self.input_pos[lanes] += available
+        return values
+
+    def apply(self, application, lanes, index, arg, variables):
+        kind = type(application)
+        if kind is Builtin:
+            op = application.op
+            if op == INCREMENT:
+                self.write(lanes, index, self.read(lanes, index) + np.uint8(1))
+            elif op == DECREMENT:
+                self.write(lanes, index, self.read(lanes, index) - np.uint8(1))
+            elif op == OUTPUT_INT:
+                values = self.read(lanes, index)
+                self.output_lanes.append(lanes)
+                self.output_text.append(_INT_TEXT[values])
+                self.output_sizes.append(_INT_SIZE[values])
+            elif op == OUTPUT_CHAR:
+                self.output_lanes.append(lanes)
+                self.output_text.append(_CHAR_TEXT[self.read(lanes, index)])
+                self.output_sizes.append(np.ones(len(lanes), dtype=np.intp))
+            elif op == INPUT:
+                self.write(lanes, index, self.input_bytes(lanes))
+        elif kind is Add:
+            amount = np.uint8(application.amount & 0xFF)
+            self.write(lanes, index, self.read(lanes, index) + amount)
+        elif kind is Call:
+            body = self.program[application.name]
+            self.statements(body, lanes, _wrap_char(index), {})
+        elif kind is Inlined:
+            if application.variable is not None:
+                variables = {**variables, application.variable: _wrap_char(index)}
+            self.statements(application.body, lanes, arg, variables)
+        else:
+            value = self.value(application, lanes, arg, variables)
+            if isinstance(value, np.ndarray):
+                value = (value & 0xFF).astype(np.uint8)
+            else:
+                value &= 0xFF
+            self.write(lanes, index, value)
+
+    def applicator(self, node, lanes, arg, variables):
+        index = node.index
+        if type(index) is Applicator:
+            self.applicator(index, lanes, arg, variables)
+        for application in node.applications:
+            if type(application) is Applicator:
+                self.applicator(application, lanes, arg, variables)
+        for application in node.applications:
+            self.apply(
+                application,
+                lanes,
+                self.value(index, lanes, arg, variables),
+                arg,
+                variables,
+            )
+
+    def conditional(self, node, lanes, arg, variables):
+        while True:
+            if type(node.index) is Applicator:
+                self.applicator(node.index, lanes, arg, variables)
+            index = self.value(node.index, lanes, arg, variables)
+            keep = self.read(lanes, index) != 0
+            if not keep.all():
+                # Lanes that leave the loop are done with it.
+                lanes = lanes[keep]
+                arg = _select(arg, keep)
+                variables = {
+                    name: _select(value, keep) for name, value in variables.items()
+                }
+                if not len(lanes):
+                    return
+            self.statements(node.body, lanes, arg, variables)
+
+    def counted_loop(self, node, lanes, arg, variables):
+        counter = self.value(node.index, lanes, arg, variables)
+        value = self.read(lanes, counter)
+        count = value if node.step < 0 else np.uint8(0) - value
+        # The loop does not run on lanes where the counter is already zero.
+        keep = count != 0
+        if not keep.all():
+            lanes = lanes[keep]
+            counter = _select(counter, keep)
+            count = count[keep]
+            if not len(lanes):
+                return
+        for target, factor in node.targets:
+            amount = count * np.uint8(factor & 0xFF)
+            self.write(lanes, target, self.read(lanes, target) + amount)
+        self.write(lanes, counter, 0)
+
+    def statements(self, nodes, lanes, arg, variables):
+        for node in nodes:
+            kind = type(node)
+            if kind is Applicator:
+                self.applicator(node, lanes, arg, variables)
+            elif kind is Conditional:
+                self.conditional(node, lanes, arg, variables)
+            elif kind is CountedLoop:
+                self.counted_loop(node, lanes, arg, variables)
+            else:
+                raise TypeError(f"cannot execute {type(node).__name__}")
+
+    def outputs(self):
+        """Collect the output of each lane."""
+        count = len(self.memory)
+        outputs = np.full(count, b"", dtype=object)
+        if len(self.output_lanes) <= 1:
+            # Each lane wrote at most one piece.
+            for lanes, text in zip(self.output_lanes, self.output_text):
+                outputs[lanes] = text
+            return outputs
+        lanes = np.concatenate(self.output_lanes)
+        text = np.concatenate(self.output_text)
+        # Sorting by lane keeps the pieces of each lane in the order they
+        # were written, so joining them all once leaves the output of each
+        # lane in one slice.
+        order = np.argsort(lanes, kind="stable")
+        data = b"".join(text[order].tolist())
+        sizes = np.concatenate(self.output_sizes)
+        ends = np.cumsum(np.bincount(lanes, weights=sizes, minlength=count))
+        ends = ends.astype(np.intp).tolist()
+        outputs[:] = [data[start:end] for start, end in zip([0] + ends, ends)]
+        return outputs
+
+
+def _input_array(inputs, batch_size):
+    """Pad the input of each lane into a 2-D array, with their sizes."""
+    if inputs is None:
+        return (
+            np.zeros((batch_size, 0), dtype=np.uint8),
+            np.zeros(batch_size, dtype=np.intp),
+        )
+    if isinstance(inputs, np.ndarray):
+        if inputs.ndim != 2 or len(inputs) != batch_size:
+            raise ValueError("inputs must have one row per lane")
+        inputs = inputs.astype(np.uint8, copy=False)
+        return inputs, np.full(batch_size, inputs.shape[1], dtype=np.intp)
+    if len(inputs) != batch_size:
+        raise ValueError("inputs must have one entry per lane")
+    sizes = np.array([len(data) for data in inputs], dtype=np.intp)
+    array = np.zeros((batch_size, sizes.max(initial=0)), dtype=np.uint8)
+    for lane, data in enumerate(inputs):
+        array[lane, : len(data)] = np.frombuffer(bytes(data), dtype=np.uint8)
+    return array, sizes
+
+
+def load_string(src, optimize=2):
+    """Preprocess, lex, parse and optimize a Stercus string for ``execute``.
+
+    The optimization level is at most 2, as the compile-time evaluation of
+    level 3 produces nodes that only the compiler runs.
+    """
+    program = build_tree(parse(lex(preprocess(src))))
+    for node in walk([node for body in program.values() for node in body]):
+        if type(node) is Call and node.name not in program:
+            raise ApplicationNameError("Undefined application: " + node.name + ".")
+    return optimizer.optimize(program, min(optimize, 2))
+
+
+def execute(program, memory, inputs=None, stderr=None):
+    """Execute a program on every row of a batch of memories.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes, as produced by
+        ``load_string``.
+    memory : numpy.ndarray
+        2-D ``uint8`` array with the memory of one lane in each row,
+        modified in place. Bytes hold signed chars in two's complement.
+    inputs : sequence of bytes or numpy.ndarray, optional
+        The input of each lane, either as one bytes-like object per lane or
+        as a 2-D array with one row per lane. Reads past the end of the
+        input of a lane return EOF, stored as 0xFF.
+    stderr : text file-like, optional
+        Stream for out of bounds warnings. Defaults to ``sys.stderr``.
+
+    Returns
+    -------
+    : numpy.ndarray
+        1-D object array with the output of each lane as bytes.
+    """
+    if memory.ndim != 2 or memory.dtype != np.uint8:
+        raise ValueError("memory must be a 2-D uint8 array")
+    if stderr is None:
+        stderr = sys.stderr
+    executor = _BatchExecutor(
+        program, memory, _input_array(inputs, len(memory)), stderr
+    )
+    lanes = np.arange(len(memory), dtype=np.intp)
+    executor.statements(program["main"], lanes, 0, {})
+    return executor.outputs()
+
+
+def run_string(
+    src,
+    inputs=None,
+    batch_size=None,
+    memory_size=10000,
+    args=(),
+    optimize=2,
+    **kwargs,
+):
+    """Run a Stercus string on a batch of inputs.
+
+    Parameters
+    ----------
+    src : str
+        String of Stercus code.
+    inputs : sequence of bytes or numpy.ndarray, optional
+        The input of each lane; see ``execute``.
+    batch_size : int, optional
+        Number of lanes. Defaults to the number of inputs.
+    memory_size : int
+        Number of bytes of memory of each lane.
+    args : sequence of str
+        CLI arguments to load into the memory of every lane.
+    optimize : int
+        Optimization level passed to ``load_string``.
+    **kwargs : dict
+        Keyword arguments are passed to ``execute``.
+
+    Returns
+    -------
+    : tuple
+        The outputs of the lanes, and their memories after the program has
+        finished, as a ``(batch_size, memory_size)`` array.
+    """
+    if batch_size is None:
+        if inputs is None:
+            raise ValueError("either inputs or batch_size must be given")
+        batch_size = len(inputs)
+    program = load_string(src, optimize)
+    row = bytearray(memory_size)
+    load_cli_args(row, args)
+    memory = np.tile(np.frombuffer(bytes(row), dtype=np.uint8), (batch_size, 1))
+    outputs = execute(program, memory, inputs, **kwargs)
+    return outputs, memory
@@ -0,0 +1,182 @@
+""" On-disk cache of compiled Stercus programs.
+
+Each entry is a directory named after a hash of everything that determines
+the output of the compiler: the source bytes, the compile options, the
+version of Stercus and a hash of the sources of the compiler itself, so
+that entries written by another build of the same version are not reused.
+It holds the generated C and any binaries built from it, one per C
+compiler command. The modification time of an entry is bumped whenever it
+is used, and the least recently used entries are evicted when the cache
+grows beyond its size limit.
+"""
+
+from functools import lru_cache
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+from . import __version__
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+C_SOURCE_NAME = "program.c"
+
+# Bumped whenever the layout of the cache or the generated code changes in a
+# way that the hash of the compiler sources does not capture.
+CACHE_FORMAT = 2
+
+
+@lru_cache(maxsize=None)
+def compiler_revision():
+    """Hash the sources of the Stercus package, which generate the code."""
+    h = hashlib.sha256()
+    package = Path(__file__).resolve().parent
+    for path in sorted(package.glob("*.py")):
+        h.update(path.name.encode())
+        h.update(b"\0")
+        h.update(path.read_bytes())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def default_cache_dir():
+    """Return the cache directory from the environment, or the default."""
+    path = os.environ.get("STERCUS_CACHE_DIR")
+    if path:
+        return Path(path)
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "stercus"
+
+
+def _atomic_write(path, data):
+    """Write bytes to a file so that readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class CompilationCache:
+    """Content-addressed cache of generated C and binaries.
+
+    Parameters
+    ----------
+    directory : str or Path, optional
+        Where to store the cache. Defaults to ``default_cache_dir()``.
+    max_size : int
+        Maximum total size of the cache in bytes.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(src, **options):
+        """Hash the source bytes and the compile options into a cache key."""
+        h = hashlib.sha256()
+        h.update(
+            f"{__version__}\0{CACHE_FORMAT}\0{compiler_revision()}".encode()
+        )
+        h.update(b"\0")
+        h.update(json.dumps(options, sort_keys=True).encode())
+        h.update(b"\0")
+        h.update(src)
+        return h.hexdigest()
+
+    @staticmethod
+    def _binary_name(command):
+        digest = hashlib.sha256(command.encode()).hexdigest()[:16]
+        return f"program-{digest}"
+
+    def _entry(self, key):
+        return self.directory / key
+
+    def _touch(self, key):
+        try:
+            os.utime(self._entry(key))
+        except FileNotFoundError:
+            pass
+
+    def get_c_source(self, key):
+        """Return the cached C source for the key, or None."""
+        try:
+            c_src = (self._entry(key) / C_SOURCE_NAME).read_text()
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return c_src
+
+    def put_c_source(self, key, c_src):
+        """Store the C source for the key."""
+        entry = self._entry(key)
+        entry.mkdir(parents=True, exist_ok=True)
+        _atomic_write(entry / C_SOURCE_NAME, c_src.encode())
+        self.evict()
+
+    def get_binary(self, key, command):
+        """Return the path of the cached binary built with the command."""
+        path = self._entry(key) / self._binary_name(command)
+        if not path.exists():
+            return None
+        self._touch(key)
+        return path
+
+    def put_binary(self, key, command, binary):
+        """Copy a binary built with the command into the cache.
+
+        Returns
+        -------
+        : Path
+            The path of the cached binary.
+        """
+        entry = self._entry(key)
+        entry.mkdir(parents=True, exist_ok=True)
+        path = entry / self._binary_name(command)
+        fd, tmp = tempfile.mkstemp(dir=entry, prefix=".tmp-")
+        os.close(fd)
+        shutil.copy2(binary, tmp)
+        os.replace(tmp, path)
+        self.evict()
+        return path
+
+    def entries(self):
+        """List ``(mtime, size, path)`` of each entry, oldest first."""
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for entry in self.directory.iterdir():
+            if not entry.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except FileNotFoundError:
+                # Removed concurrently by another process.
+                continue
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until under the limit."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for _, _, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
@@ -2,22 +2,323 @@
 """ Stercus Language Compiler """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import json
+import os
 from textwrap import dedent
 
 from .constants import *
 from .errors import *
+from .nodes import *
+from . import optimizer
+from .analysis import mark_bounds_checks
+from .evaluator import evaluate_prefix
+from .instrument import COUNTS_FILE_VARIABLE, DEFAULT_COUNTS_FILE, instrument
+from .parser import build_body, build_tree
 
+# Number of top-level statements compiled into each block of main by
+# compile_to_file.
+MAIN_BLOCK_SIZE = 1024
+
+# Minimum number of applicators on consecutive literal indices that are
+# compiled into a single bulk memory operation.
+BULK_MIN_SIZE = 4
+
+# Ways of allocating the data array. "auto" picks "static" for memories of at
+# most STATIC_MAX_SIZE bytes and "mmap" for larger ones.
+BACKING_STORES = ("heap", "static", "mmap", "file", "auto")
+STATIC_MAX_SIZE = 1 << 20
+
+# Size in bytes of the output buffer of the buffered I/O runtime.
+OUTPUT_BUFFER_SIZE = 65536
+
+# Number of chunks of applications handed to each worker process when
+# compiling in parallel, to balance the load between the workers.
+CHUNKS_PER_JOB = 4
+
+
+def c_io_runtime(buffered_io=False, linkage="static inline "):
+    """Return the C functions that the compiled program does I/O with.
+
+    By default they are the stdio functions. The buffered runtime collects
+    output in a large buffer of its own, which is flushed when it is full,
+    before reading input and at exit, and formats ints by hand. ``linkage``
+    is prepended to the definitions of the functions of the buffered runtime
+    that the compiled program calls.
+    """
+    if not buffered_io:
+        return dedent(
+            f"""
+        #define {C_PUT_CHAR_NAME}(c) putchar(c)
+        #define {C_PUT_INT_NAME}(value) printf("%d", value)
+        #define {C_GET_CHAR_NAME}() getchar()
+        #define {C_WRITE_NAME}(data, size) fwrite(data, 1, size, stdout)
+        #define {C_FLUSH_NAME}()
+        """
+        ).strip()
 
-def c_header(memory_size):
     return dedent(
         f"""
+    #if (defined(_POSIX_C_SOURCE) && _POSIX_C_SOURCE >= 199506L) || defined(__APPLE__)
+    #define _STERCUS_GETCHAR() getchar_unlocked()
+    #else
+    #define _STERCUS_GETCHAR() getchar()
+    #endif
+
+    static char _stercus_out[{OUTPUT_BUFFER_SIZE}];
+    static size_t _stercus_out_size = 0;
+
+    static void {C_FLUSH_NAME}(void) {{
+        if (_stercus_out_size) {{
+            fwrite(_stercus_out, 1, _stercus_out_size, stdout);
+            _stercus_out_size = 0;
+        }}
+        fflush(stdout);
+    }}
+
+    {linkage}void {C_PUT_CHAR_NAME}(char c) {{
+        if (_stercus_out_size == sizeof(_stercus_out)) {{
+            {C_FLUSH_NAME}();
+        }}
+        _stercus_out[_stercus_out_size++] = c;
+    }}
+
+    {linkage}void {C_PUT_INT_NAME}(int value) {{
+        char digits[12];
+        int n = 0;
+        unsigned int u = value < 0 ? -(unsigned int)value : (unsigned int)value;
+        if (value < 0) {{
+            {C_PUT_CHAR_NAME}('-');
+        }}
+        do {{
+            digits[n++] = '0' + u % 10;
+            u /= 10;
+        }} while (u);
+        while (n) {{
+            {C_PUT_CHAR_NAME}(digits[--n]);
+        }}
+    }}
+
+    {linkage}int {C_GET_CHAR_NAME}(void) {{
+        // flush first in case the output prompts for the input
+        if (_stercus_out_size) {{
+            {C_FLUSH_NAME}();
+        }}
+        return _STERCUS_GETCHAR();
+    }}
+
+    {linkage}void {C_WRITE_NAME}(const char *data, size_t size) {{
+        if (_stercus_out_size + size > sizeof(_stercus_out)) {{
+            {C_FLUSH_NAME}();
+            if (size > sizeof(_stercus_out)) {{
+                fwrite(data, 1, size, stdout);
+                return;
+            }}
+        }}
+        memcpy(_stercus_out + _stercus_out_size, data, size);
+        _stercus_out_size += size;
+    }}
+    """
+    ).strip()
+
+
+def resolve_backing_store(memory_size, backing_store):
+    """Return the backing store that "auto" stands for with the memory size."""
+    if backing_store not in BACKING_STORES:
+        raise ValueError(f"unknown backing store: {backing_store}")
+    if backing_store == "auto":
+        return "static" if memory_size <= STATIC_MAX_SIZE else "mmap"
+    return backing_store
+
+
+def c_memory(memory_size, backing_store="heap", memory_file=None):
+    """Return the C code that allocates and releases the data array.
+
+    Parameters
+    ----------
+    memory_size : int
+        Number of bytes to use for program memory.
+    backing_store : str
+        One of ``BACKING_STORES``. "heap" allocates memory with calloc,
+        "static" uses a zero-initialized global array, "mmap" maps anonymous
+        memory that the kernel only zero-fills when it is first touched and
+        "file" maps ``memory_file``, so that the final memory of the program
+        is left in that file.
+    memory_file : str, optional
+        Path of the file to map when ``backing_store`` is "file".
+
+    Returns
+    -------
+    : tuple of str
+        The lines that must come before any include, which may be empty, and
+        the definitions of the data array and of the functions
+        ``_stercus_alloc`` and ``_stercus_free``.
+    """
+    backing_store = resolve_backing_store(memory_size, backing_store)
+    if backing_store == "file" and memory_file is None:
+        raise ValueError("the file backing store needs a memory file")
+
+    if backing_store == "heap":
+        return "", dedent(
+            f"""
+        char *{C_DATA_ARRAY_NAME};
+
+        static void _stercus_alloc(void) {{
+            {C_DATA_ARRAY_NAME} = (char *)calloc({C_DATA_ARRAY_SIZE_NAME}, sizeof(char));
+        }}
+
+        static void _stercus_free(void) {{
+            free({C_DATA_ARRAY_NAME});
+        }}
+        """
+        ).strip()
+
+    if backing_store == "static":
+        return "", dedent(
+            f"""
+        char {C_DATA_ARRAY_NAME}[{memory_size}];
+
+        static void _stercus_alloc(void) {{}}
+
+        static void _stercus_free(void) {{}}
+        """
+        ).strip()
+
+    # MAP_ANONYMOUS is not standard C, so glibc hides it by default.
+    features = "#ifndef _DEFAULT_SOURCE\n#define _DEFAULT_SOURCE\n#endif\n"
+    if backing_store == "mmap":
+        name = '"mmap"'
+        open_file = "int fd = -1;"
+        flags = "MAP_PRIVATE | MAP_ANONYMOUS"
+        close_file = ""
+    else:
+        name = c_string(memory_file.encode())
+        open_file = (
+            f"int fd = open({name}, O_RDWR | O_CREAT | O_TRUNC, 0644);\n"
+            f"    if (fd < 0 || ftruncate(fd, {C_DATA_ARRAY_SIZE_NAME}) != 0) {{\n"
+            f"        perror({name});\n"
+            f"        exit(1);\n"
+            f"    }}"
+        )
+        flags = "MAP_SHARED"
+        close_file = "close(fd);"
+
+    definitions = f"""\
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+#if !defined(MAP_ANONYMOUS) && defined(MAP_ANON)
+#define MAP_ANONYMOUS MAP_ANON
+#endif
+
+char *{C_DATA_ARRAY_NAME};
+
+static void _stercus_alloc(void) {{
+    {open_file}
+    void *data = mmap(NULL, {C_DATA_ARRAY_SIZE_NAME}, PROT_READ | PROT_WRITE, {flags}, fd, 0);
+    if (data == MAP_FAILED) {{
+        perror({name});
+        exit(1);
+    }}
+    {close_file}
+    {C_DATA_ARRAY_NAME} = (char *)data;
+}}
+
+static void _stercus_free(void) {{
+    munmap({C_DATA_ARRAY_NAME}, {C_DATA_ARRAY_SIZE_NAME});
+}}"""
+    return features, definitions
+
+
+def c_header(
+    memory_size, buffered_io=False, backing_store="heap", memory_file=None
+):
+    features, memory = c_memory(memory_size, backing_store, memory_file)
+    includes = dedent(
+        f"""
+    #include <stdio.h>
+    #include <stdlib.h>
+    #include <string.h>
+
+    const size_t {C_DATA_ARRAY_SIZE_NAME} = {memory_size};
+    """
+    ).strip()
+    return "\n\n".join(
+        [features + includes + "\n" + memory, c_helpers(), c_io_runtime(buffered_io)]
+    )
+
+
+def c_library_header(memory_size):
+    """Return the header of a program compiled as a shared library.
+
+    Program memory is provided by the caller of ``stercus_run``, input is
+    read from a buffer and output is collected in a buffer that grows as
+    needed.
+    """
+    io = dedent(
+        f"""
+    static const char *_stercus_in;
+    static size_t _stercus_in_size;
+    static size_t _stercus_in_pos;
+    static char *_stercus_out;
+    static size_t _stercus_out_size;
+    static size_t _stercus_out_capacity;
+    static int _stercus_out_failed;
+
+    #define {C_FLUSH_NAME}()
+
+    static inline void {C_WRITE_NAME}(const char *data, size_t size) {{
+        if (_stercus_out_size + size > _stercus_out_capacity) {{
+            size_t capacity = _stercus_out_capacity ? _stercus_out_capacity : 4096;
+            while (capacity < _stercus_out_size + size) {{
+                capacity *= 2;
+            }}
+            char *out = (char *)realloc(_stercus_out, capacity);
+            if (!out) {{
+                _stercus_out_failed = 1;
+                return;
+            }}
+            _stercus_out = out;
+            _stercus_out_capacity = capacity;
+        }}
+        memcpy(_stercus_out + _stercus_out_size, data, size);
+        _stercus_out_size += size;
+    }}
+
+    static inline void {C_PUT_CHAR_NAME}(char c) {{
+        {C_WRITE_NAME}(&c, 1);
+    }}
+
+    static inline void {C_PUT_INT_NAME}(int value) {{
+        char digits[12];
+        {C_WRITE_NAME}(digits, sprintf(digits, "%d", value));
+    }}
+
+    static inline int {C_GET_CHAR_NAME}(void) {{
+        if (_stercus_in_pos == _stercus_in_size) {{
+            return EOF;
+        }}
+        return (unsigned char)_stercus_in[_stercus_in_pos++];
+    }}
+    """
+    ).strip()
+    includes = dedent(
+        f"""
     #include <stdio.h>
     #include <stdlib.h>
+    #include <string.h>
 
     const size_t {C_DATA_ARRAY_SIZE_NAME} = {memory_size};
     char *{C_DATA_ARRAY_NAME};
+    """
+    ).strip()
+    return "\n\n".join([includes, c_helpers(), io])
+
 
+def c_helpers():
+    """Return the C functions that access memory and copy the CLI args."""
+    return dedent(
+        f"""
     int {C_GET_BYTE_NAME}(int i) {{
         if (i < {C_DATA_ARRAY_SIZE_NAME}) {{
             return {C_DATA_ARRAY_NAME}[i];
@@ -59,142 +360,728 @@ def c_header(memory_size):
     ).strip()
 
 
-def apply(output, application, accessor, func_list):
-    """Apply an application to the accessed location."""
+def c_counters(counters):
+    """Return the C code that defines the execution counters.
+
+    Parameters
+    ----------
+    counters : list of dict
+        The counters, as returned by ``instrument.instrument``.
+
+    Returns
+    -------
+    : str
+        The definitions of the counters and of ``_stercus_dump_counts``,
+        which writes them to a JSON file.
+    """
+    size = max(len(counters), 1)
+    entries = ",\n".join(
+        f"    {{{c_string(c['kind'].encode())}, "
+        f"{c_string(c['application'].encode())}, "
+        f"{c_string(c['name'].encode())}, {c['line']}, {c['column']}}}"
+        for c in counters
+    )
+    return f"""\
+static unsigned long long _stercus_counts[{size}];
+
+static const struct {{
+    const char *kind;
+    const char *application;
+    const char *name;
+    int line;
+    int column;
+}} _stercus_counters[{size}] = {{
+{entries}
+}};
+
+static void _stercus_dump_counts(void) {{
+    const char *path = getenv("{COUNTS_FILE_VARIABLE}");
+    FILE *f = fopen(path ? path : "{DEFAULT_COUNTS_FILE}", "w");
+    if (!f) {{
+        perror("{COUNTS_FILE_VARIABLE}");
+        return;
+    }}
+    fprintf(f, "[");
+    for (int i = 0; i < {len(counters)}; ++i) {{
+        fprintf(f,
+            "%s\\n  {{\\"kind\\": \\"%s\\", \\"application\\": \\"%s\\", "
+            "\\"name\\": \\"%s\\", \\"line\\": %d, \\"column\\": %d, \\"count\\": %llu}}",
+            i ? "," : "", _stercus_counters[i].kind,
+            _stercus_counters[i].application, _stercus_counters[i].name,
+            _stercus_counters[i].line, _stercus_counters[i].column,
+            _stercus_counts[i]);
+    }}
+    fprintf(f, "\\n]\\n");
+    fclose(f);
+}}
+"""
+
+
+def c_string(data):
+    """Return a C string literal holding the bytes.
+
+    Long strings are split into adjacent literals on separate lines.
+    """
+    chunks = []
+    for start in range(0, len(data), 64):
+        chunk = []
+        for byte in data[start : start + 64]:
+            char = chr(byte)
+            if char in '"\\?' or not 32 <= byte < 127:
+                # Octal escapes always have three digits, so that a following
+                # digit is not read as part of the escape.
+                chunk.append(f"\\{byte:03o}")
+            else:
+                chunk.append(char)
+        chunks.append('"' + "".join(chunk) + '"')
+    return "\n".join(chunks) or '""'
+
+
+def read_expr(accessor, checked=True):
+    """Return the C expression reading the byte at the accessor."""
+    if checked:
+        return f"{C_GET_BYTE_NAME}({accessor})"
+    return f"{C_DATA_ARRAY_NAME}[{accessor}]"
+
+
+def index_expr(node):
+    """Return the C expression for the value of an index node."""
+    kind = type(node)
+    if kind is Literal:
+        return str(node.value)
+    if kind is Arg:
+        return C_FUNC_ARG_NAME
+    if kind is Local:
+        return node.name
+    return read_expr(index_expr(node.index), node.checked)
+
+
+def apply(output, application, accessor, checked=True, memory_size=None):
+    """Apply an application to the accessed location.
+
+    If ``checked`` is False, the accessor has been proven to be within memory
+    and the data array is accessed directly.
+    """
+    kind = type(application)
     ele = f"{C_DATA_ARRAY_NAME}[{accessor}]"
-    if application == NOP:
-        pass
-    elif application == INCREMENT:
-        # output.append(ele + "++;")
-        output.append(
-            f"{C_SET_BYTE_NAME}({accessor}, {C_GET_BYTE_NAME}({accessor}) + 1);"
-        )
-    elif application == DECREMENT:
-        # output.append(ele + "--;")
+    value = read_expr(accessor, checked)
+    if kind is Builtin:
+        op = application.op
+        if op == INCREMENT:
+            if checked:
+                output.append(f"{C_SET_BYTE_NAME}({accessor}, {value} + 1);")
+            else:
+                output.append(ele + "++;")
+        elif op == DECREMENT:
+            if checked:
+                output.append(f"{C_SET_BYTE_NAME}({accessor}, {value} - 1);")
+            else:
+                output.append(ele + "--;")
+        elif op == OUTPUT_INT:
+            output.append(f"{C_PUT_INT_NAME}({value});")
+        elif op == OUTPUT_CHAR:
+            output.append(f"{C_PUT_CHAR_NAME}({value});")
+        elif op == INPUT:
+            assign(output, accessor, f"{C_GET_CHAR_NAME}()", checked)
+    elif kind is Add:
+        amount = application.amount
+        if checked:
+            sign = "+" if amount > 0 else "-"
+            output.append(
+                f"{C_SET_BYTE_NAME}({accessor}, {value} {sign} {abs(amount)});"
+            )
+        else:
+            output.append(f"{ele} += {amount};")
+    elif kind is Call:
+        output.append(f"{application.name}({accessor});")
+    elif kind is Count:
+        output.append(f"_stercus_counts[{application.counter}]++;")
+    elif kind is Inlined:
+        if application.variable is None:
+            output.append("{")
+        else:
+            output.append(f"{{char {application.variable} = {accessor};")
+        compile_statements(output, application.body, memory_size)
+        output.append("}")
+    else:
+        assign(output, accessor, index_expr(application), checked)
+
+
+def assign(output, accessor, value, checked=True):
+    """Assign a C expression to the accessed location."""
+    if checked:
+        output.append(f"{C_SET_BYTE_NAME}({accessor}, {value});")
+    else:
+        output.append(f"{C_DATA_ARRAY_NAME}[{accessor}] = {value};")
+
+
+def compile_applicator(output, node, memory_size=None):
+    """Compile an applicator and any applicators nested inside of it."""
+    index = node.index
+
+    # compile-time bounds checking
+    if memory_size is not None and type(index) is Literal:
+        if index.value >= memory_size:
+            raise IndexOutOfRangeError(
+                f"attempted out of bounds access to index {index.value}; aborting"
+            )
+
+    # The applications of nested applicators are run before any of the
+    # applications of this one.
+    if type(index) is Applicator:
+        compile_applicator(output, index, memory_size)
+    for application in node.applications:
+        if type(application) is Applicator:
+            compile_applicator(output, application, memory_size)
+
+    accessor = index_expr(index)
+    # Runs of assignments and outputs on a byte that is known to be in
+    # memory are written with a single call, followed by the final value.
+    fold_output = (
+        memory_size is not None and type(index) is Literal and index.value >= 0
+    )
+    applications = node.applications
+    position = 0
+    while position < len(applications):
+        run = fold_output and optimizer.output_run(applications, position)
+        if run:
+            position, value, data = run
+            output.append(f"{C_WRITE_NAME}({c_string(data)}, {len(data)});")
+            assign(output, accessor, optimizer.wrap_char(value), False)
+            continue
+        application = applications[position]
+        apply(output, application, accessor, node.checked, memory_size)
+        position += 1
+
+
+def compile_conditional(output, node, memory_size=None):
+    """Compile a conditional into a C loop."""
+    output.append("while(1){")
+    if type(node.index) is Applicator:
+        compile_applicator(output, node.index, memory_size)
+    test = read_expr(index_expr(node.index), node.checked)
+    output.append(f"if(!{test}){{break;}}")
+    compile_statements(output, node.body, memory_size)
+    output.append("}")
+
+
+def compile_counted_loop(output, node, memory_size=None):
+    """Compile a counting loop into straight-line arithmetic."""
+    counter = index_expr(node.index)
+    value = read_expr(counter, node.checked)
+
+    # The number of iterations it takes the counter to wrap to zero.
+    if node.step < 0:
+        count = f"(unsigned char)({value})"
+    else:
+        count = f"(unsigned char)(-{value})"
+    output.append(f"{{int n = {count}; if(n){{")
+    for target, factor in node.targets:
+        if memory_size is not None and target >= memory_size:
+            raise IndexOutOfRangeError(
+                f"attempted out of bounds access to index {target}; aborting"
+            )
+        checked = memory_size is None or target < 0 or node.checked
+        target_value = read_expr(target, checked)
+        assign(output, target, f"{target_value} + {factor} * n", checked)
+    assign(output, counter, "0", node.checked)
+    output.append("}}")
+
+
+def compile_preset(output, node):
+    """Compile a block of constant bytes into a memset or a memcpy."""
+    data = node.data
+    target = f"{C_DATA_ARRAY_NAME} + {node.start}"
+    if len(set(data)) == 1:
+        value = data[0] - 256 if data[0] > 127 else data[0]
+        output.append(f"memset({target}, {value}, {len(data)});")
+    else:
+        output.append(f"memcpy({target}, {c_string(data)}, {len(data)});")
+
+
+def compile_copy(output, node):
+    """Compile a copy between blocks of memory."""
+    target = f"{C_DATA_ARRAY_NAME} + {node.target}"
+    source = f"{C_DATA_ARRAY_NAME} + {node.source}"
+    if abs(node.target - node.source) >= node.size:
+        output.append(f"memcpy({target}, {source}, {node.size});")
+    elif node.target < node.source:
+        output.append(f"memmove({target}, {source}, {node.size});")
+    else:
+        # Copying upwards over the source repeats the bytes copied first.
         output.append(
-            f"{C_SET_BYTE_NAME}({accessor}, {C_GET_BYTE_NAME}({accessor}) - 1);"
+            f"for(int i = 0; i < {node.size}; ++i){{"
+            f"{C_DATA_ARRAY_NAME}[{node.target} + i] = "
+            f"{C_DATA_ARRAY_NAME}[{node.source} + i];}}"
         )
-    elif application == OUTPUT_INT:
-        output.append(f'printf("%d", {C_GET_BYTE_NAME}({accessor}));')
-    elif application == OUTPUT_CHAR:
-        output.append(f"putchar({C_GET_BYTE_NAME}({accessor}));")
-    elif application == INPUT:
-        output.append(f"{C_SET_BYTE_NAME}({accessor}, getchar());")
-    elif application in func_list:
-        output.append(f"{application}({accessor});")
-    else:
-        output.append(f"{C_SET_BYTE_NAME}({accessor}, {application});")
 
 
-def compile_body(tokens, func_list, memory_size=None):
-    output = []
-    stack = []
-    for token in tokens:
-        if token == APPLICATOR["CLOSE"]:
-            li = []
-            val = stack.pop()
-            while val != APPLICATOR["OPEN"]:
-                li.append(val)
-                val = stack.pop()
-            li.reverse()
-
-            accessor = li[0]
-
-            # compile-time bounds checking
-            if memory_size is not None:
-                try:
-                    idx = int(accessor)
-                    if idx >= memory_size:
-                        raise IndexOutOfRangeError(
-                            f"attempted out of bounds access to index {idx}; aborting"
-                        )
-                except ValueError:
-                    pass
-
-            for application in li[1:]:
-                apply(output, application, accessor, func_list)
-            if len(stack) > 0 and stack[-1] == CONDITIONAL["OPEN"]:
-                output.append(
-                    f"if(!{C_GET_BYTE_NAME}({C_GET_BYTE_NAME}({accessor}))){{break;}}"
+def _bulk_operand(node):
+    """Classify a statement that may be part of a bulk memory operation.
+
+    Returns
+    -------
+    : tuple or None
+        ``(index, value, source)`` for an applicator on a literal index that
+        assigns a literal ``value`` or copies from the literal index
+        ``source``, with the other one None. Otherwise None.
+    """
+    if type(node) is not Applicator or type(node.index) is not Literal:
+        return None
+    if len(node.applications) != 1:
+        return None
+    application = node.applications[0]
+    if type(application) is Literal:
+        return node.index.value, application.value, None
+    if (
+        type(application) is Applicator
+        and type(application.index) is Literal
+        and not application.applications
+    ):
+        return node.index.value, None, application.index.value
+    return None
+
+
+def bulk_statements(nodes, memory_size):
+    """Replace runs of fills and copies on consecutive indices.
+
+    A run of at least ``BULK_MIN_SIZE`` applicators that assign literals to
+    consecutive literal indices becomes a ``Preset``, and a run that copies
+    from consecutive literal indices becomes a ``Copy``. The bounds of the
+    whole run are checked once, here; runs reaching outside of memory are
+    left alone so that the error is reported as usual.
+
+    Returns
+    -------
+    : list
+        The statements, with the runs replaced.
+    """
+    if memory_size is None:
+        return nodes
+    result = []
+    run = []
+
+    def end_run(end):
+        """Replace the run of statements that ends before index end."""
+        start, value, source = run[0]
+        size = len(run)
+        in_bounds = start >= 0 and start + size <= memory_size
+        if source is not None:
+            in_bounds = in_bounds and source >= 0 and source + size <= memory_size
+        if size < BULK_MIN_SIZE or not in_bounds:
+            result.extend(nodes[end - size : end])
+        elif source is None:
+            data = bytes(value & 0xFF for _, value, _ in run)
+            result.append(Preset(start, data))
+        else:
+            result.append(Copy(start, source, size))
+        run.clear()
+
+    for i, node in enumerate(nodes):
+        operand = _bulk_operand(node)
+        if run and operand is not None:
+            index, value, source = operand
+            last_index, last_value, last_source = run[-1]
+            if index == last_index + 1 and (
+                (source is None and last_source is None)
+                or (
+                    source is not None
+                    and last_source is not None
+                    and source == last_source + 1
                 )
-            stack.append(f"{C_GET_BYTE_NAME}({accessor})")
-        elif token == CONDITIONAL["CLOSE"]:
-            val = stack.pop()
-            while val != CONDITIONAL["OPEN"]:
-                val = stack.pop()
-            output.append("}")
-        elif token == CONDITIONAL["OPEN"]:
-            output.append("while(1){")
-            stack.append(token)
-        elif token == APPLICATOR["OPEN"]:
-            stack.append(token)
+            ):
+                run.append(operand)
+                continue
+        if run:
+            end_run(i)
+        if operand is None:
+            result.append(node)
+        else:
+            run.append(operand)
+    if run:
+        end_run(len(nodes))
+    return result
+
+
+def compile_statements(output, nodes, memory_size=None):
+    """Compile a list of statements, appending lines of C to the output."""
+    for node in bulk_statements(nodes, memory_size):
+        kind = type(node)
+        if kind is Conditional:
+            compile_conditional(output, node, memory_size)
+        elif kind is CountedLoop:
+            compile_counted_loop(output, node, memory_size)
+        elif kind is Preset:
+            compile_preset(output, node)
+        elif kind is Copy:
+            compile_copy(output, node)
+        elif kind is Count:
+            output.append(f"_stercus_counts[{node.counter}]++;")
+        elif kind is Print:
+            output.append(
+                f"{C_WRITE_NAME}({c_string(node.data)}, {len(node.data)});"
+            )
         else:
-            # Check if the token is the accessor for a conditional.
-            if len(stack) > 0 and stack[-1] == CONDITIONAL["OPEN"]:
-                output.append(f"if(!{C_GET_BYTE_NAME}({token})){{break;}}")
-            stack.append(token)
+            compile_applicator(output, node, memory_size)
+
+
+def compile_body(nodes, memory_size=None):
+    """Compile the statements of an application body to C."""
+    output = []
+    compile_statements(output, nodes, memory_size)
     return "\n".join(output)
 
 
-def compile_application(name, tokens, app_list, memory_size):
+def compile_application(name, nodes, memory_size):
     """Compile a function from stercus to C."""
     declaration = f"void {name}(char {C_FUNC_ARG_NAME})"
-    body = compile_body(tokens, app_list, memory_size)
+    body = compile_body(nodes, memory_size)
     definition = f"{declaration} {{\n{body}}}\n"
     return f"{declaration};\n", definition
 
 
-def compile_main(tokens, app_table, memory_size, argv_max_bytes=None):
-    """Compile the main C function."""
+def _compile_chunk(chunk):
+    items, memory_size, optimize = chunk
+    compiled = []
+    for name, tokens in items:
+        nodes = build_body(tokens)
+        nodes = optimizer.optimize({name: nodes}, optimize)[name]
+        compiled.append(compile_application(name, nodes, memory_size))
+    return compiled
+
+
+def compile_applications(applications, memory_size, optimize=0, jobs=1):
+    """Build, optimize and compile each application on its own.
+
+    Applications are independent of each other unless they are optimized
+    together, so with ``optimize`` below 2 they can be compiled in parallel.
+
+    Parameters
+    ----------
+    applications : dict
+        Maps application names to their tokens, as produced by ``parse``.
+    memory_size : int
+        Number of bytes to use for program memory.
+    optimize : int
+        Optimization level, at most 1.
+    jobs : int
+        Number of processes to compile the applications in, or 0 for one
+        per CPU.
+
+    Returns
+    -------
+    : list of tuple
+        The declaration and definition of each application, in the order of
+        ``applications``.
+    """
+    items = list(applications.items())
+    if jobs == 1 or len(items) < 2:
+        return _compile_chunk((items, memory_size, optimize))
+
+    # Tokens are sent to the workers rather than trees, as they are much
+    # faster to pickle than it is to build the trees.
+    workers = jobs or os.cpu_count() or 1
+    size = -(-len(items) // (workers * CHUNKS_PER_JOB))
+    chunks = [
+        (items[i : i + size], memory_size, optimize)
+        for i in range(0, len(items), size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map yields the results in the order of the chunks.
+        return [
+            compiled
+            for results in executor.map(_compile_chunk, chunks)
+            for compiled in results
+        ]
+
+
+def main_function(body, argv_max_bytes=None, dump_counts=False):
+    """Wrap compiled C statements in the C main function.
+
+    If ``dump_counts`` is True, the execution counters are written out at
+    exit.
+    """
     if argv_max_bytes is None:
         argv_max_bytes = C_DATA_ARRAY_SIZE_NAME
+    if dump_counts:
+        body += "\n_stercus_dump_counts();"
 
-    body = compile_body(tokens, app_table, memory_size)
     output = f"""
     int main(int argc, char* argv[]) {{
-      {C_DATA_ARRAY_NAME} = (char *)calloc({C_DATA_ARRAY_SIZE_NAME}, sizeof(char));
+      _stercus_alloc();
       _stercus_copy_cli_args(argc, argv, {argv_max_bytes});
       {body}
-      free({C_DATA_ARRAY_NAME});
+      {C_FLUSH_NAME}();
+      _stercus_free();
       return 0;
     }}
     """
     return dedent(output).strip()
 
 
-def compile(applications, memory_size, argv_max_bytes=None):
-    """Compile the Stercus function table to C."""
+def compile_main(nodes, memory_size, argv_max_bytes=None, dump_counts=False):
+    """Compile the main C function."""
+    body = compile_body(nodes, memory_size)
+    return main_function(body, argv_max_bytes, dump_counts)
 
-    # Save and remove the main function, as it must be placed at the end of the
-    # generated C code.
-    main_appl = applications["main"]
-    applications.pop("main")
 
-    app_declarations = []
-    app_bodies = []
+def library_functions(body, dump_counts=False):
+    """Wrap compiled C statements in the entry points of a shared library.
 
-    # Compile applications into C functions.
-    for name, content in applications.items():
-        body, declaration = compile_application(
-            name, content, applications.keys(), memory_size
-        )
-        app_bodies.append(body)
-        app_declarations.append(declaration)
+    ``stercus_run`` runs the program on the memory, which must hold the
+    memory size given to the compiler, with the input in a buffer. It sets
+    ``output`` to a buffer holding the output, which the caller frees with
+    ``stercus_free_output``, and returns nonzero if the output could not be
+    allocated.
+    """
+    if dump_counts:
+        body += "\n_stercus_dump_counts();"
 
-    c_src = c_header(memory_size)
-    c_src += "\n".join(app_bodies)
+    output = f"""
+    int {C_RUN_NAME}(char *memory, const char *input, size_t input_size,
+                    char **output, size_t *output_size) {{
+      {C_DATA_ARRAY_NAME} = memory;
+      _stercus_in = input;
+      _stercus_in_size = input_size;
+      _stercus_in_pos = 0;
+      _stercus_out = NULL;
+      _stercus_out_size = 0;
+      _stercus_out_capacity = 0;
+      _stercus_out_failed = 0;
+      {body}
+      *output = _stercus_out;
+      *output_size = _stercus_out_size;
+      return _stercus_out_failed;
+    }}
+
+    void {C_FREE_OUTPUT_NAME}(char *output) {{
+      free(output);
+    }}
+    """
+    return dedent(output).strip()
+
+
+def compile(
+    applications,
+    memory_size,
+    argv_max_bytes=None,
+    elide_bounds_checks=False,
+    optimize=0,
+    buffered_io=False,
+    backing_store="heap",
+    memory_file=None,
+    instrument_counts=False,
+    jobs=1,
+    library=False,
+):
+    """Compile the Stercus application table to C.
+
+    Parameters
+    ----------
+    applications : dict
+        The application table produced by ``parse``.
+    memory_size : int
+        Number of bytes to use for program memory.
+    argv_max_bytes : int, optional
+        Maximum number of bytes of CLI arguments to copy into memory.
+        Defaults to the whole memory.
+    elide_bounds_checks : bool
+        If True, memory accesses that are proven to be within bounds index the
+        data array directly instead of calling the checked helpers.
+    optimize : int
+        Optimization level passed to ``optimizer.optimize``. At 3 and above,
+        the start of main is also evaluated at compile time, up to the first
+        statement that depends on input or the CLI arguments.
+    buffered_io : bool
+        If True, the program buffers its output itself instead of calling
+        stdio for each character. The output is the same.
+    backing_store : str
+        How to allocate program memory; see ``c_memory``.
+    memory_file : str, optional
+        Path of the file that holds program memory when ``backing_store``
+        is "file".
+    instrument_counts : bool
+        If True, the program counts the execution of each statement, loop
+        iteration and call, and writes the counts out at exit; see
+        ``instrument``. Tokens need positions for the counts to be mapped
+        back to the source.
+    jobs : int
+        Number of processes to compile the applications in, or 0 for one
+        per CPU. Only used when no pass needs the whole program, that is
+        below ``optimize`` 2 and without bounds check elision or
+        instrumentation; see ``compile_applications``. The C code is the
+        same for any number of jobs.
+    library : bool
+        If True, the C code is meant to be built as a shared library and
+        defines ``stercus_run`` instead of main; see ``library_functions``.
+        Memory and I/O buffers are provided by the caller, so
+        ``argv_max_bytes``, ``buffered_io``, ``backing_store`` and
+        ``memory_file`` are ignored.
+
+    Returns
+    -------
+    : str
+        Corresponding string of C code.
+    """
+    whole_program = optimize >= 2 or elide_bounds_checks or instrument_counts
+    if jobs != 1 and not whole_program:
+        # No pass looks across applications, so each one can be compiled
+        # from its tokens in parallel.
+        others = dict(applications)
+        main_body = build_body(others.pop("main"))
+        main_body = optimizer.optimize({"main": main_body}, optimize)["main"]
+        compiled = compile_applications(others, memory_size, optimize, jobs)
+    else:
+        program = optimizer.optimize(build_tree(applications), optimize)
+        if optimize >= 3:
+            evaluate_prefix(program, memory_size)
+        if elide_bounds_checks:
+            mark_bounds_checks(program, memory_size)
+        if instrument_counts:
+            counters = instrument(program)
+
+        # Save and remove the main function, as it must be placed at the end
+        # of the generated C code.
+        main_body = program.pop("main")
+
+        # Compile applications into C functions.
+        compiled = [
+            compile_application(name, nodes, memory_size)
+            for name, nodes in program.items()
+        ]
+
+    app_declarations = [declaration for declaration, _ in compiled]
+    app_definitions = [definition for _, definition in compiled]
+
+    if library:
+        header = c_library_header(memory_size)
+    else:
+        header = c_header(memory_size, buffered_io, backing_store, memory_file)
+    c_src = header + "\n"
+    if instrument_counts:
+        c_src += c_counters(counters) + "\n"
     c_src += "\n".join(app_declarations)
+    c_src += "\n".join(app_definitions)
+
+    if library:
+        body = compile_body(main_body, memory_size)
+        return c_src + "\n\n" + library_functions(body, instrument_counts)
 
     # Compile the main function.
     c_src += "\n\n" + compile_main(
-        main_appl,
-        applications.keys(),
+        main_body,
         memory_size,
         argv_max_bytes=argv_max_bytes,
+        dump_counts=instrument_counts,
     )
     return c_src
 
 
+def _prepare(
+    name, nodes, memory_size, elide_bounds_checks, optimize, evaluate=False
+):
+    """Optimize the body of a single application on its own."""
+    program = optimizer.optimize({name: nodes}, optimize)
+    if evaluate and optimize >= 3:
+        evaluate_prefix(program, memory_size)
+    if elide_bounds_checks:
+        # Without the rest of the program, only literal indices are proven.
+        mark_bounds_checks(program, memory_size)
+    return program[name]
+
+
+def _declarations(nodes):
+    """Declare the custom applications called in the nodes."""
+    names = {node.name for node in walk(nodes) if type(node) is Call}
+    return "".join(
+        f"void {name}(char {C_FUNC_ARG_NAME});\n" for name in sorted(names)
+    )
+
+
+def compile_to_file(
+    applications,
+    out_file,
+    memory_size,
+    argv_max_bytes=None,
+    elide_bounds_checks=False,
+    optimize=0,
+    buffered_io=False,
+    backing_store="heap",
+    memory_file=None,
+):
+    """Compile applications to C, writing each one as soon as it is compiled.
+
+    Each application is declared right before the first definition that
+    uses it, so no application has to be held in memory once written. The
+    statements of main are compiled in blocks of ``MAIN_BLOCK_SIZE`` into
+    separate functions that the C main function calls in order.
+
+    Parameters
+    ----------
+    applications : iterable of tuple
+        ``(name, tokens)`` pairs as yielded by ``parser.parse_stream``.
+    out_file : file-like
+        Text stream to write the C code to.
+    memory_size : int
+        Number of bytes to use for program memory.
+    argv_max_bytes : int, optional
+        Maximum number of bytes of CLI arguments to copy into memory.
+    elide_bounds_checks : bool
+        If True, accesses at literal indices within memory index the data
+        array directly. Unlike ``compile``, ``$`` is never proven in bounds,
+        since the callers of an application are not known yet.
+    optimize : int
+        Optimization level passed to ``optimizer.optimize``. At 3 and above,
+        the start of the first block of main is evaluated at compile time,
+        stopping at its first use of a custom application.
+    buffered_io : bool
+        If True, the program buffers its output itself.
+    backing_store : str
+        How to allocate program memory; see ``c_memory``.
+    memory_file : str, optional
+        Path of the file to map when ``backing_store`` is "file".
+    """
+    header = c_header(memory_size, buffered_io, backing_store, memory_file)
+    out_file.write(header + "\n")
+
+    blocks = []
+    pending = []
+
+    def write_main_block():
+        name = f"_stercus_main_{len(blocks)}"
+        # Only the first block starts from memory known at compile time.
+        nodes = _prepare(
+            "main",
+            pending,
+            memory_size,
+            elide_bounds_checks,
+            optimize,
+            evaluate=not blocks,
+        )
+        out_file.write(_declarations(nodes))
+        body = compile_body(nodes, memory_size)
+        out_file.write(f"static void {name}(void) {{\n{body}}}\n")
+        blocks.append(name)
+        pending.clear()
+
+    for name, tokens in applications:
+        nodes = build_body(tokens)
+        if name == "main":
+            pending.extend(nodes)
+            if len(pending) >= MAIN_BLOCK_SIZE:
+                write_main_block()
+            continue
+        nodes = _prepare(name, nodes, memory_size, elide_bounds_checks, optimize)
+        out_file.write(_declarations(nodes))
+        _, definition = compile_application(name, nodes, memory_size)
+        out_file.write(definition)
+
+    if pending:
+        write_main_block()
+    body = "\n".join(f"{name}();" for name in blocks)
+    out_file.write("\n" + main_function(body, argv_max_bytes) + "\n")
+
+
 def main():
     """Run the compiler as an independent program."""
     parser = argparse.ArgumentParser()
@@ -202,14 +1089,21 @@ def main():
     parser.add_argument(
         "-o", "--output", help="Output file for compiled" " result.", dest="out"
     )
+    parser.add_argument(
+        "-m",
+        "--memory-size",
+        type=int,
+        default=10000,
+        help="Number of bytes to use for program memory.",
+    )
     args = parser.parse_args()
 
-    # Tokens are read from a whitespace-separated list in a file.
+    # The application table is read from a JSON file written by the parser.
     with open(args.src, "r") as f:
         applications = json.load(f)
 
     # Output the result.
-    c_src = compile(applications)
+    c_src = compile(applications, args.memory_size)
     if args.out:
         with open(args.out, "w") as f:
             f.write(c_src)
@@ -4,6 +4,13 @@ C_DATA_ARRAY_NAME = "_STERCUS_DATA"
 C_DATA_ARRAY_SIZE_NAME = "_STERCUS_DATA_SIZE"
 C_GET_BYTE_NAME = "_stercus_get"
 C_SET_BYTE_NAME = "_stercus_set"
+C_PUT_CHAR_NAME = "_stercus_putchar"
+C_PUT_INT_NAME = "_stercus_put_int"
+C_GET_CHAR_NAME = "_stercus_getchar"
+C_WRITE_NAME = "_stercus_write"
+C_FLUSH_NAME = "_stercus_flush"
+C_RUN_NAME = "stercus_run"
+C_FREE_OUTPUT_NAME = "stercus_free_output"
 
 C_FUNC_ARG_NAME = "s0"
 STERCUS_ARG_NAME = "$"
@@ -11,3 +11,11 @@ class UnbalancedBracketsError(Exception):
 class ApplicationNameError(Exception):
     """ Raised when a disallowed application name is encountered. """
     pass
+
+class ExpressionError(Exception):
+    """ Raised when an applicator or conditional is malformed. """
+    pass
+
+class UnterminatedCommentError(Exception):
+    """ Raised when a multi-line comment is not closed. """
+    pass
@@ -0,0 +1,222 @@
+""" Compile-time evaluation of the start of a Stercus program.
+
+Many programs begin with a deterministic setup: literal assignments, text
+output and loops over constants, all before the first input. The partial
+evaluator runs the top-level statements of main at compile time for as long
+as everything they do is known, and replaces them with ``Preset`` nodes that
+restore the memory they wrote and a ``Print`` node with the output they
+produced.
+
+Bytes that the program has not written are unknown at compile time, since
+the CLI arguments are copied into memory at run time. Evaluation stops at the
+first statement that reads such a byte, reads input, uses ``$`` in main,
+accesses memory out of bounds or runs for too long. That statement and all
+the ones after it are left to run as usual.
+"""
+
+from .constants import *
+from .nodes import *
+from .optimizer import wrap_char
+
+# Maximum number of applicators and loop iterations run at compile time.
+EVALUATE_MAX_STEPS = 1000000
+
+
+class _Unknown(Exception):
+    """Raised when a statement depends on something only known at run time."""
+
+
+class _Evaluator:
+    """Runs statements on the bytes of memory known at compile time."""
+
+    def __init__(self, program, memory_size, max_steps):
+        self.program = program
+        self.memory_size = memory_size
+        self.steps = max_steps
+        # Maps indices to the values written by the evaluated statements.
+        self.memory = {}
+        self.output = bytearray()
+        # (index, previous value) of each write by the current statement, so
+        # that it can be undone if the statement cannot be evaluated.
+        self.journal = []
+
+    def step(self):
+        self.steps -= 1
+        if self.steps < 0:
+            raise _Unknown
+
+    def address(self, index):
+        if not 0 <= index < self.memory_size:
+            raise _Unknown
+        return index
+
+    def load(self, index):
+        try:
+            return self.memory[self.address(index)]
+        except KeyError:
+            raise _Unknown from None
+
+    def store(self, index, value):
+        index = self.address(index)
+        self.journal.append((index, self.memory.get(index)))
+        self.memory[index] = wrap_char(value)
+
+    def value(self, node, arg, variables):
+        """Value of an index node."""
+        kind = type(node)
+        if kind is Literal:
+            return node.value
+        if kind is Arg:
+            if arg is None:
+                raise _Unknown
+            return arg
+        if kind is Local:
+            return variables[node.name]
+        return self.load(self.value(node.index, arg, variables))
+
+    def apply(self, application, index, arg, variables):
+        kind = type(application)
+        if kind is Builtin:
+            op = application.op
+            if op == INCREMENT:
+                self.store(index, self.load(index) + 1)
+            elif op == DECREMENT:
+                self.store(index, self.load(index) - 1)
+            elif op == OUTPUT_INT:
+                self.output += str(self.load(index)).encode()
+            elif op == OUTPUT_CHAR:
+                self.output.append(self.load(index) & 0xFF)
+            elif op == INPUT:
+                raise _Unknown
+        elif kind is Add:
+            self.store(index, self.load(index) + application.amount)
+        elif kind is Call:
+            body = self.program.get(application.name)
+            if body is None:
+                raise _Unknown
+            self.statements(body, wrap_char(index), {})
+        elif kind is Inlined:
+            if application.variable is not None:
+                variables = {**variables, application.variable: wrap_char(index)}
+            self.statements(application.body, arg, variables)
+        else:
+            self.store(index, self.value(application, arg, variables))
+
+    def applicator(self, node, arg, variables):
+        self.step()
+        index = node.index
+        if type(index) is Literal:
+            # Out of bounds literal indices are reported by the compiler.
+            self.address(index.value)
+        if type(index) is Applicator:
+            self.applicator(index, arg, variables)
+        for application in node.applications:
+            if type(application) is Applicator:
+                self.applicator(application, arg, variables)
+        for application in node.applications:
+            self.apply(
+                application, self.value(index, arg, variables), arg, variables
+            )
+
+    def conditional(self, node, arg, variables):
+        while True:
+            self.step()
+            if type(node.index) is Applicator:
+                self.applicator(node.index, arg, variables)
+            if not self.load(self.value(node.index, arg, variables)):
+                return
+            self.statements(node.body, arg, variables)
+
+    def counted_loop(self, node, arg, variables):
+        self.step()
+        counter = self.value(node.index, arg, variables)
+        value = self.load(counter)
+        count = (value if node.step < 0 else -value) & 0xFF
+        if count:
+            for target, factor in node.targets:
+                self.store(target, self.load(target) + factor * count)
+            self.store(counter, 0)
+
+    def statements(self, nodes, arg, variables):
+        for node in nodes:
+            kind = type(node)
+            if kind is Applicator:
+                self.applicator(node, arg, variables)
+            elif kind is Conditional:
+                self.conditional(node, arg, variables)
+            elif kind is CountedLoop:
+                self.counted_loop(node, arg, variables)
+            else:
+                raise _Unknown
+
+    def run(self, statements):
+        """Evaluate statements until one cannot be evaluated.
+
+        Returns
+        -------
+        : int
+            The number of statements evaluated.
+        """
+        count = 0
+        for node in statements:
+            output_size = len(self.output)
+            try:
+                self.statements([node], None, {})
+            except (_Unknown, RecursionError):
+                for index, value in reversed(self.journal):
+                    if value is None:
+                        del self.memory[index]
+                    else:
+                        self.memory[index] = value
+                del self.output[output_size:]
+                break
+            self.journal.clear()
+            count += 1
+        return count
+
+    def presets(self):
+        """Create the nodes that restore the known bytes of memory."""
+        nodes = []
+        start = None
+        data = bytearray()
+        for index in sorted(self.memory):
+            if start is None or index != start + len(data):
+                if data:
+                    nodes.append(Preset(start, bytes(data)))
+                start = index
+                data = bytearray()
+            data.append(self.memory[index] & 0xFF)
+        if data:
+            nodes.append(Preset(start, bytes(data)))
+        return nodes
+
+
+def evaluate_prefix(program, memory_size, max_steps=EVALUATE_MAX_STEPS):
+    """Evaluate the start of main at compile time.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes. Modified in
+        place.
+    memory_size : int
+        Number of bytes of program memory.
+    max_steps : int
+        Maximum number of applicators and loop iterations to run.
+
+    Returns
+    -------
+    : int
+        The number of top-level statements of main that were evaluated.
+    """
+    if "main" not in program:
+        return 0
+    main = program["main"]
+    evaluator = _Evaluator(program, memory_size, max_steps)
+    count = evaluator.run(main)
+    if count:
+        nodes = evaluator.presets()
+        if evaluator.output:
+            nodes.append(Print(bytes(evaluator.output)))
+        program["main"] = nodes + main[count:]
+    return count
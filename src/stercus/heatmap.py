@@ -0,0 +1,90 @@
+""" Heat maps of the execution counts of instrumented Stercus programs.
+
+The counts written by a program compiled with ``stercusc --instrument`` are
+mapped back onto its source: each line is shown with the largest count of the
+code on it, and a bar on a log scale.
+"""
+
+import math
+
+# Shades of the bars, from cold to hot.
+BAR_CHARS = " ▁▂▃▄▅▆▇█"
+
+# ANSI colors of the bars, from cold to hot.
+COLORS = ["\033[34m", "\033[36m", "\033[32m", "\033[33m", "\033[31m"]
+RESET = "\033[0m"
+
+
+def line_counts(counters):
+    """Map each source line to the largest count of the counters on it."""
+    counts = {}
+    for counter in counters:
+        line = counter["line"]
+        if line:
+            counts[line] = max(counts.get(line, 0), counter["count"])
+    return counts
+
+
+def heat(count, max_count):
+    """Return the heat of a count between 0 and 1, on a log scale."""
+    if not count or not max_count:
+        return 0.0
+    return math.log1p(count) / math.log1p(max_count)
+
+
+def render(src, counters, width=8, color=False):
+    """Render the source annotated with the counts of each line.
+
+    Parameters
+    ----------
+    src : str
+        The Stercus source code the counts were collected from.
+    counters : list of dict
+        The counts written by the instrumented program.
+    width : int
+        Width of the bars in characters.
+    color : bool
+        If True, color the bars with ANSI escape codes.
+
+    Returns
+    -------
+    : str
+        The annotated source.
+    """
+    counts = line_counts(counters)
+    max_count = max(counts.values(), default=0)
+    lines = []
+    for number, text in enumerate(src.splitlines(), start=1):
+        count = counts.get(number)
+        if count is None:
+            lines.append(f"{'':>12} {'':<{width}} | {text}")
+            continue
+        h = heat(count, max_count)
+        full = h * width
+        bar = BAR_CHARS[-1] * int(full)
+        if len(bar) < width:
+            bar += BAR_CHARS[round((full - int(full)) * (len(BAR_CHARS) - 1))]
+        bar = f"{bar:<{width}}"
+        if color:
+            bar = COLORS[min(int(h * len(COLORS)), len(COLORS) - 1)] + bar + RESET
+        lines.append(f"{count:>12} {bar} | {text}")
+    return "\n".join(lines)
+
+
+def hot_spots(counters, limit=10):
+    """Return the counters with the largest counts, largest first."""
+    return sorted(counters, key=lambda c: c["count"], reverse=True)[:limit]
+
+
+def format_hot_spots(counters, limit=10):
+    """Format the counters with the largest counts as a table."""
+    lines = [f"{'count':>12}  {'kind':<10} {'where':<12} application"]
+    for counter in hot_spots(counters, limit):
+        where = f"{counter['line']}:{counter['column']}"
+        application = counter["application"]
+        if counter["name"]:
+            application += f" -> {counter['name']}"
+        lines.append(
+            f"{counter['count']:>12}  {counter['kind']:<10} {where:<12} {application}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,109 @@
+""" Execution counters for profiling compiled Stercus programs.
+
+``instrument`` inserts a ``Count`` node wherever something is to be counted,
+and the compiler emits a counter for each. The counts are written to a JSON
+file when the program exits: a list with one object per counter holding its
+``kind``, the ``application`` it is in, the ``name`` of the called
+application for calls, the ``line`` and ``column`` of the code it counts
+(zero if unknown) and the ``count``.
+
+Counters count the program as optimized. Loops replaced by arithmetic at
+``-O2`` count how often they are entered rather than their iterations, and
+inlined applications are counted like calls. Statements evaluated at compile
+time at ``-O3`` are not counted at all.
+"""
+
+import json
+
+from .nodes import *
+
+# Environment variable naming the file that counts are written to.
+COUNTS_FILE_VARIABLE = "STERCUS_COUNTS_FILE"
+DEFAULT_COUNTS_FILE = "stercus-counts.json"
+
+
+class _Instrumenter:
+    def __init__(self):
+        self.counters = []
+
+    def counter(self, kind, application, node, name=""):
+        """Add a counter for the node and return the node that counts it."""
+        self.counters.append(
+            {
+                "kind": kind,
+                "application": application,
+                "name": name,
+                "line": node.line or 0,
+                "column": node.column or 0,
+            }
+        )
+        return Count(len(self.counters) - 1, line=node.line, column=node.column)
+
+    def applicator(self, application, node):
+        """Count the calls made by the applicator and its nested ones."""
+        if type(node.index) is Applicator:
+            self.applicator(application, node.index)
+        applications = []
+        for child in node.applications:
+            kind = type(child)
+            if kind is Applicator:
+                self.applicator(application, child)
+            elif kind is Call:
+                applications.append(
+                    self.counter("call", application, child, child.name)
+                )
+            elif kind is Inlined:
+                applications.append(
+                    self.counter("call", application, child, child.name)
+                )
+                child.body = self.statements(application, child.body)
+            applications.append(child)
+        node.applications = applications
+
+    def statements(self, application, nodes):
+        """Count the statements, and the iterations of conditionals."""
+        result = []
+        for node in nodes:
+            kind = type(node)
+            if kind is Applicator:
+                self.applicator(application, node)
+                node.applications.insert(
+                    0, self.counter("applicator", application, node)
+                )
+            elif kind is Conditional:
+                if type(node.index) is Applicator:
+                    self.applicator(application, node.index)
+                node.body = [
+                    self.counter("loop", application, node)
+                ] + self.statements(application, node.body)
+            elif kind is CountedLoop:
+                result.append(self.counter("loop", application, node))
+            result.append(node)
+        return result
+
+
+def instrument(program):
+    """Insert execution counters into a program.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes. Modified in
+        place.
+
+    Returns
+    -------
+    : list of dict
+        The description of each counter, indexed by the number of its
+        ``Count`` nodes, without the count.
+    """
+    instrumenter = _Instrumenter()
+    for name, body in program.items():
+        program[name] = instrumenter.statements(name, body)
+    return instrumenter.counters
+
+
+def load_counts(path):
+    """Load the counts written by an instrumented program."""
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,184 @@
+""" Run Stercus programs as native code inside the Python process.
+
+``compile`` compiles a program to C with ``library=True``, builds it into a
+shared library with the system C compiler and loads it with ``ctypes``. The
+library is kept in the compilation cache, keyed on the source, the compile
+options and the C compiler command, so compiling the same program again,
+even from another process, only loads the library. ``Program.run`` then
+calls into it directly, with the program memory in a ``bytearray`` of the
+caller and input and output in buffers, so running a program costs no
+process spawn at all.
+
+The program runs on the thread that calls ``Program.run``, so a program that
+never terminates blocks it. Out of bounds accesses are still reported on the
+standard error of the process.
+"""
+
+import ctypes
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import tempfile
+import threading
+
+from .cache import CompilationCache
+from .constants import *
+from .lexer import lex
+from .parser import parse
+from .preprocessor import preprocess
+from .vm import load_cli_args
+from . import compiler
+
+DEFAULT_CFLAGS = ("-O2", "-shared", "-fPIC")
+
+# The entry points of the libraries loaded by this process, by path.
+_libraries = {}
+
+
+class Program:
+    """A Stercus program loaded from a shared library.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the shared library.
+    memory_size : int
+        Number of bytes of program memory the library was compiled for.
+    """
+
+    def __init__(self, path, memory_size):
+        self.path = Path(path)
+        self.memory_size = memory_size
+        functions = _libraries.get(self.path)
+        if functions is None:
+            library = ctypes.CDLL(str(self.path))
+            run = getattr(library, C_RUN_NAME)
+            run.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_size_t,
+                ctypes.POINTER(ctypes.c_void_p),
+                ctypes.POINTER(ctypes.c_size_t),
+            ]
+            run.restype = ctypes.c_int
+            free_output = getattr(library, C_FREE_OUTPUT_NAME)
+            free_output.argtypes = [ctypes.c_void_p]
+            free_output.restype = None
+            # The runtime of the library keeps its state in globals, so only
+            # one thread may run it at a time.
+            functions = (run, free_output, threading.Lock())
+            _libraries[self.path] = functions
+        self._run, self._free_output, self._lock = functions
+
+    def run(self, memory=None, input=b"", args=()):
+        """Run the program.
+
+        Parameters
+        ----------
+        memory : bytearray, optional
+            Program memory of exactly ``memory_size`` bytes, modified in
+            place. Defaults to fresh zeroed memory.
+        input : bytes
+            Everything the program reads. Reads past the end return EOF.
+        args : sequence of str
+            CLI arguments to load into memory before running.
+
+        Returns
+        -------
+        : bytes
+            Everything the program wrote.
+        """
+        if memory is None:
+            memory = bytearray(self.memory_size)
+        if len(memory) != self.memory_size:
+            raise ValueError(
+                f"memory must be {self.memory_size} bytes, not {len(memory)}"
+            )
+        load_cli_args(memory, args)
+        buffer = (ctypes.c_char * len(memory)).from_buffer(memory)
+        output = ctypes.c_void_p()
+        output_size = ctypes.c_size_t()
+        input = bytes(input)
+        with self._lock:
+            failed = self._run(
+                buffer,
+                input,
+                len(input),
+                ctypes.byref(output),
+                ctypes.byref(output_size),
+            )
+        try:
+            if failed:
+                raise MemoryError("could not allocate the program output")
+            if not output.value:
+                return b""
+            return ctypes.string_at(output.value, output_size.value)
+        finally:
+            self._free_output(output)
+
+
+def _command(cc, cflags):
+    if cc is None:
+        cc = os.environ.get("CC", "cc")
+    return shlex.split(cc) + list(cflags)
+
+
+def compile(
+    src, memory_size=10000, cc=None, cflags=DEFAULT_CFLAGS, cache_dir=None, **kwargs
+):
+    """Compile a Stercus string to a shared library and load it.
+
+    Parameters
+    ----------
+    src : str
+        String of Stercus code.
+    memory_size : int
+        Number of bytes to use for program memory.
+    cc : str, optional
+        C compiler command. Defaults to ``$CC``, or ``cc``.
+    cflags : sequence of str
+        Flags to build the shared library with.
+    cache_dir : str or Path, optional
+        Directory of the compilation cache; see ``cache.default_cache_dir``.
+    **kwargs : dict
+        Keyword arguments are passed to ``compiler.compile``.
+
+    Returns
+    -------
+    : Program
+        The loaded program.
+    """
+    command = _command(cc, cflags)
+    cache = CompilationCache(cache_dir)
+    key = cache.key(src.encode(), memory_size=memory_size, library=True, **kwargs)
+    command_name = shlex.join(command)
+    path = cache.get_binary(key, command_name)
+    if path is None:
+        c_src = compiler.compile(
+            parse(lex(preprocess(src))), memory_size, library=True, **kwargs
+        )
+        cache.put_c_source(key, c_src)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            c_file = os.path.join(tmpdir, "program.c")
+            library = os.path.join(tmpdir, "program.so")
+            with open(c_file, "w") as f:
+                f.write(c_src)
+            subprocess.run(command + ["-o", library, c_file], check=True)
+            path = cache.put_binary(key, command_name, library)
+    return Program(path, memory_size)
+
+
+def run_string(src, memory_size=10000, args=(), input=b"", **kwargs):
+    """Compile and run a Stercus string.
+
+    Keyword arguments are passed to ``compile``.
+
+    Returns
+    -------
+    : tuple
+        The output of the program and its memory after it finished.
+    """
+    memory = bytearray(memory_size)
+    output = compile(src, memory_size, **kwargs).run(memory, input, args)
+    return output, memory
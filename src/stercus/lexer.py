@@ -2,19 +2,76 @@
 """ Stercus Language Lexer """
 
 import argparse
+import re
 
 from .constants import BRACKETS
 
+# A token is either a single bracket or a run of characters that are neither
+# whitespace nor brackets.
+_BRACKET_CHARS = re.escape("".join(BRACKETS["ALL"]))
+TOKEN_RULE = re.compile(rf"[{_BRACKET_CHARS}]|[^\s{_BRACKET_CHARS}]+")
+
+
+def tokenize(src):
+    """Lazily convert Stercus source code into tokens with their positions.
+
+    Parameters
+    ----------
+    src : str
+        Stercus source code.
+
+    Yields
+    ------
+    : tuple
+        ``(text, line, column)`` for each token of the source, in order. The
+        line and column are one-based and locate the first character of the
+        token.
+    """
+    line = 0
+    line_start = 0
+    size = len(src)
+    while line_start <= size:
+        line_end = src.find("\n", line_start)
+        if line_end < 0:
+            line_end = size
+        line += 1
+        for match in TOKEN_RULE.finditer(src, line_start, line_end):
+            yield match.group(), line, match.start() - line_start + 1
+        line_start = line_end + 1
+
 
 def lex(src):
     """Convert the Stercus source code into a list of tokens."""
-    lexed_src = ""
-    for char in src:
-        if char in BRACKETS["ALL"]:
-            lexed_src += " " + char + " "
-        else:
-            lexed_src += char
-    return lexed_src.split()
+    return TOKEN_RULE.findall(src)
+
+
+def lex_stream(chunks):
+    """Lazily convert chunks of Stercus source code into tokens.
+
+    Tokens may be split across chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of str
+        Consecutive pieces of Stercus source code.
+
+    Yields
+    ------
+    : str
+        The tokens of the source, in order.
+    """
+    rest = ""
+    for chunk in chunks:
+        if rest:
+            chunk = rest + chunk
+            rest = ""
+        tokens = TOKEN_RULE.findall(chunk)
+        # The last token may continue in the next chunk.
+        if tokens and not chunk[-1].isspace() and chunk[-1] not in BRACKETS["ALL"]:
+            rest = tokens.pop()
+        yield from tokens
+    if rest:
+        yield rest
 
 
 def main():
@@ -0,0 +1,251 @@
+""" Stercus Syntax Tree Nodes """
+
+
+class Node:
+    """Base class of the nodes of the Stercus syntax tree.
+
+    Every node records the line and column of the token it was built from,
+    or ``None`` if the tokens carried no position.
+    """
+
+    __slots__ = ("line", "column")
+
+    # Names of the slots that make up the node's value, in constructor order.
+    _fields = ()
+
+    def __init__(self, *values, line=None, column=None):
+        for field, value in zip(self._fields, values):
+            setattr(self, field, value)
+        self.line = line
+        self.column = column
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, field) == getattr(other, field)
+            for field in self._fields
+        )
+
+    def __repr__(self):
+        values = ", ".join(repr(getattr(self, f)) for f in self._fields)
+        return f"{type(self).__name__}({values})"
+
+
+class Literal(Node):
+    """An integer: an index, or an assignment when used as an application."""
+
+    __slots__ = ("value",)
+    _fields = __slots__
+
+
+class Arg(Node):
+    """The ``$`` argument of a custom application."""
+
+    __slots__ = ()
+
+
+class Builtin(Node):
+    """A built-in application such as ``+`` or ``:``."""
+
+    __slots__ = ("op",)
+    _fields = __slots__
+
+
+class Call(Node):
+    """A use of a custom application."""
+
+    __slots__ = ("name",)
+    _fields = __slots__
+
+
+class Add(Node):
+    """Add a constant to the byte; produced by the optimizer."""
+
+    __slots__ = ("amount",)
+    _fields = __slots__
+
+
+class Local(Node):
+    """A C variable holding the argument of an inlined application."""
+
+    __slots__ = ("name",)
+    _fields = __slots__
+
+
+class Inlined(Node):
+    """The body of a custom application, inlined where it is applied.
+
+    If ``variable`` is not None, it names the ``Local`` that the body uses in
+    place of ``$``, which holds the index the application is applied to.
+    Produced by the optimizer.
+    """
+
+    __slots__ = ("name", "variable", "body")
+    _fields = __slots__
+
+
+class Preset(Node):
+    """Copy the bytes ``data`` into memory starting at index ``start``.
+
+    Produced by the partial evaluator for the memory set up by the start of
+    the program.
+    """
+
+    __slots__ = ("start", "data")
+    _fields = __slots__
+
+
+class Print(Node):
+    """Write the bytes ``data`` to standard output.
+
+    Produced by the partial evaluator for the output of the start of the
+    program.
+    """
+
+    __slots__ = ("data",)
+    _fields = __slots__
+
+
+class Copy(Node):
+    """Copy ``size`` bytes from index ``source`` to index ``target``.
+
+    The bytes are copied one at a time from the lowest index up, as the
+    applicators the node replaces would. Produced by the compiler.
+    """
+
+    __slots__ = ("target", "source", "size")
+    _fields = __slots__
+
+
+class Count(Node):
+    """Increment the execution counter numbered ``counter``.
+
+    Used both as a statement and as an application. Produced by
+    ``instrument.instrument``.
+    """
+
+    __slots__ = ("counter",)
+    _fields = __slots__
+
+
+class MemoryAccess(Node):
+    """Base class of the nodes that access memory at an index.
+
+    ``checked`` is True unless analysis has proven that the index is always
+    within the bounds of memory, in which case the access may skip the
+    runtime bounds check.
+    """
+
+    __slots__ = ("index", "checked")
+
+    def __init__(self, *values, checked=True, **position):
+        super().__init__(*values, **position)
+        self.checked = checked
+
+
+class Applicator(MemoryAccess):
+    """An applicator ``[index applications...]``.
+
+    The index is a ``Literal``, an ``Arg`` or another ``Applicator``; when an
+    applicator is used as an index or as an application, it stands for the
+    value stored at its own index.
+    """
+
+    __slots__ = ("applications",)
+    _fields = ("index", "applications")
+
+
+class Conditional(MemoryAccess):
+    """A conditional loop ``(index body...)``.
+
+    The index takes the same forms as an applicator index. The body is a list
+    of ``Applicator`` and ``Conditional`` nodes.
+    """
+
+    __slots__ = ("body",)
+    _fields = ("index", "body")
+
+
+class CountedLoop(MemoryAccess):
+    """A conditional that counts its index down (or up) to zero.
+
+    Each iteration adds ``step`` to the byte at the index, and for each
+    ``(target, factor)`` pair in ``targets`` adds ``factor`` to the byte at
+    the literal index ``target``. Produced by the optimizer.
+    """
+
+    __slots__ = ("step", "targets")
+    _fields = ("index", "step", "targets")
+
+
+def walk(nodes):
+    """Iterate over the given nodes and all nodes nested within them."""
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        yield node
+        kind = type(node)
+        if kind is Applicator:
+            stack.extend(reversed(node.applications))
+            stack.append(node.index)
+        elif kind is Conditional:
+            stack.extend(reversed(node.body))
+            stack.append(node.index)
+        elif kind is CountedLoop:
+            stack.append(node.index)
+        elif kind is Inlined:
+            stack.extend(reversed(node.body))
+
+
+def clone(node, arg=None):
+    """Deep copy a node.
+
+    Parameters
+    ----------
+    node : Node
+        The node to copy.
+    arg : callable, optional
+        If provided, each ``Arg`` is replaced by the node it returns.
+
+    Returns
+    -------
+    : Node
+        The copy.
+    """
+    kind = type(node)
+    position = {"line": node.line, "column": node.column}
+    if kind is Arg:
+        return arg() if arg else Arg(**position)
+    if kind is Applicator:
+        return Applicator(
+            clone(node.index, arg),
+            [clone(a, arg) for a in node.applications],
+            checked=node.checked,
+            **position,
+        )
+    if kind is Conditional:
+        return Conditional(
+            clone(node.index, arg),
+            [clone(n, arg) for n in node.body],
+            checked=node.checked,
+            **position,
+        )
+    if kind is CountedLoop:
+        return CountedLoop(
+            clone(node.index, arg),
+            node.step,
+            list(node.targets),
+            checked=node.checked,
+            **position,
+        )
+    if kind is Inlined:
+        return Inlined(
+            node.name,
+            node.variable,
+            [clone(n, arg) for n in node.body],
+            **position,
+        )
+    return kind(*(getattr(node, f) for f in node._fields), **position)
+
+
+INDEX_NODES = (Literal, Arg, Applicator)
+STATEMENT_NODES = (Applicator, Conditional, CountedLoop)
@@ -0,0 +1,549 @@
+""" Stercus Syntax Tree Optimizer """
+
+from .constants import *
+from .nodes import *
+
+
+def wrap_char(value):
+    """Wrap an int to the range of a signed char."""
+    return (value + 128) % 256 - 128
+
+
+def is_pure(node):
+    """Check if evaluating an index node has no side effects."""
+    while type(node) is Applicator:
+        if node.applications:
+            return False
+        node = node.index
+    return True
+
+
+def output_run(applications, start):
+    """Find a run of applications whose output is known at compile time.
+
+    The run starts with a literal assignment at ``start`` and continues
+    through any literals, additions, increments, decrements and outputs that
+    follow it, all of which act on a byte whose value is then known.
+
+    Returns
+    -------
+    : tuple or None
+        ``(end, value, data)``, where the run ends before the application at
+        ``end``, ``value`` is the byte after the run as an unsigned char and
+        ``data`` is the output of the run. None if the run writes no output.
+    """
+    if start >= len(applications) or type(applications[start]) is not Literal:
+        return None
+    value = None
+    data = bytearray()
+    end = start
+    for application in applications[start:]:
+        kind = type(application)
+        if kind is Literal:
+            value = application.value & 0xFF
+        elif kind is Add:
+            value = (value + application.amount) & 0xFF
+        elif kind is Builtin:
+            op = application.op
+            if op == INCREMENT:
+                value = (value + 1) & 0xFF
+            elif op == DECREMENT:
+                value = (value - 1) & 0xFF
+            elif op == OUTPUT_CHAR:
+                data.append(value)
+            elif op == OUTPUT_INT:
+                data += str(value - 256 if value > 127 else value).encode()
+            elif op != NOP:
+                break
+        else:
+            break
+        end += 1
+    if not data:
+        return None
+    return end, value, bytes(data)
+
+
+def _drop_dead_stores(applications):
+    """Remove trailing writes that are about to be overwritten unread."""
+    while applications and type(applications[-1]) in (Literal, Arg, Add):
+        applications.pop()
+
+
+def fold_applications(applications, stable=True):
+    """Fold a list of applications acting on the same byte.
+
+    Runs of increments and decrements become a single ``Add``, an ``Add``
+    following a literal assignment is merged into the literal, and writes
+    that are overwritten before being read are dropped.
+
+    If ``stable`` is False, the index of the applications is read from
+    memory before each of them, so a write may change the byte that the
+    next one acts on. Their writes are then left as they are, and only the
+    applications nested in them are folded.
+    """
+    result = []
+    for application in applications:
+        kind = type(application)
+        if kind is Builtin:
+            op = application.op
+            if op == INCREMENT or op == DECREMENT:
+                application = Add(
+                    1 if op == INCREMENT else -1,
+                    line=application.line,
+                    column=application.column,
+                )
+                kind = Add
+            elif op == NOP:
+                continue
+            elif op == INPUT and stable:
+                _drop_dead_stores(result)
+        elif kind is Applicator:
+            fold_applicator(application)
+        elif kind is Inlined:
+            application.body = fold_statements(application.body)
+
+        if not stable:
+            result.append(application)
+            continue
+        if kind is Add:
+            last = result[-1] if result else None
+            if type(last) is Add:
+                result.pop()
+                amount = wrap_char(last.amount + application.amount)
+                if amount:
+                    result.append(
+                        Add(amount, line=last.line, column=last.column)
+                    )
+                continue
+            if type(last) is Literal:
+                result[-1] = Literal(
+                    wrap_char(last.value + application.amount),
+                    line=last.line,
+                    column=last.column,
+                )
+                continue
+            if not wrap_char(application.amount):
+                continue
+        elif kind is Literal or kind is Arg:
+            _drop_dead_stores(result)
+        result.append(application)
+    return result
+
+
+def fold_applicator(node):
+    """Fold the applications of an applicator and its nested applicators."""
+    if type(node.index) is Applicator:
+        fold_applicator(node.index)
+    node.applications = fold_applications(
+        node.applications, type(node.index) is not Applicator
+    )
+
+
+def _can_merge(previous, node):
+    """Check if two consecutive applicators can be merged into one."""
+    if type(previous) is not Applicator or type(node) is not Applicator:
+        return False
+    if type(previous.index) is not Literal or type(node.index) is not Literal:
+        return False
+    if previous.index.value != node.index.value:
+        return False
+
+    # Nested applicators run before all the applications of the applicator
+    # they are in, so merging would reorder their effects.
+    return all(
+        is_pure(application)
+        for application in node.applications
+        if type(application) is Applicator
+    )
+
+
+def _splice_inlined(node):
+    """Split an applicator around the inlined bodies it applies.
+
+    Only bodies that need no variable are spliced, and only when the
+    applicator has no nested effects whose order would change.
+
+    Returns
+    -------
+    : list
+        The statements equivalent to the applicator.
+    """
+    if not any(
+        type(a) is Inlined and a.variable is None for a in node.applications
+    ):
+        return [node]
+    if not is_pure(node.index) or not all(
+        is_pure(a) for a in node.applications if type(a) is Applicator
+    ):
+        return [node]
+
+    statements = []
+    applications = []
+    for application in node.applications:
+        if type(application) is Inlined and application.variable is None:
+            if applications:
+                statements.append(
+                    Applicator(
+                        clone(node.index),
+                        applications,
+                        checked=node.checked,
+                        line=node.line,
+                        column=node.column,
+                    )
+                )
+                applications = []
+            statements.extend(application.body)
+        else:
+            applications.append(application)
+    if applications:
+        statements.append(
+            Applicator(
+                clone(node.index),
+                applications,
+                checked=node.checked,
+                line=node.line,
+                column=node.column,
+            )
+        )
+    return statements
+
+
+def fold_statements(statements):
+    """Fold the applications in a list of statements.
+
+    Consecutive applicators on the same literal index are merged so that
+    their applications can be folded together, and the bodies of inlined
+    applications are spliced into the statements where possible.
+    """
+    result = []
+    pending = list(reversed(statements))
+    while pending:
+        node = pending.pop()
+        if type(node) is Applicator:
+            statements = _splice_inlined(node)
+            if statements[0] is not node:
+                pending.extend(reversed(statements))
+                continue
+
+        if type(node) is Conditional:
+            if type(node.index) is Applicator:
+                fold_applicator(node.index)
+            node.body = fold_statements(node.body)
+        elif result and _can_merge(result[-1], node):
+            previous = result[-1]
+            previous.applications = fold_applications(
+                previous.applications + node.applications
+            )
+            continue
+        else:
+            fold_applicator(node)
+            # An applicator without applications does nothing on its own.
+            if not node.applications and is_pure(node.index):
+                continue
+        result.append(node)
+    return result
+
+
+def _counted_loop(node):
+    """Return the ``CountedLoop`` equivalent to a conditional, if any.
+
+    Recognizes clear loops ``(0 [0 -])``, move and add loops
+    ``(0 [1 +] [0 -])``, copy loops ``(0 [1 +] [2 +] [0 -])`` and
+    multiply-accumulate loops ``(0 [1 + + +] [0 -])``.
+    """
+    counter = node.index
+    if type(counter) is not Literal and type(counter) is not Arg:
+        return None
+
+    totals = {}
+    for statement in node.body:
+        if type(statement) is not Applicator:
+            return None
+        index = statement.index
+        if type(counter) is Arg:
+            # Only a clear loop is allowed, since $ may alias any literal.
+            if type(index) is not Arg:
+                return None
+            key = None
+        elif type(index) is Literal:
+            key = index.value
+        else:
+            return None
+        for application in statement.applications:
+            if type(application) is not Add:
+                return None
+            totals[key] = totals.get(key, 0) + application.amount
+
+    key = None if type(counter) is Arg else counter.value
+    step = wrap_char(totals.pop(key, 0))
+    if step != 1 and step != -1:
+        return None
+    targets = [
+        (index, wrap_char(amount))
+        for index, amount in totals.items()
+        if wrap_char(amount)
+    ]
+    return CountedLoop(
+        counter, step, targets, line=node.line, column=node.column
+    )
+
+
+def _replace_inlined_loop_idioms(node):
+    if type(node.index) is Applicator:
+        _replace_inlined_loop_idioms(node.index)
+    for application in node.applications:
+        if type(application) is Inlined:
+            application.body = replace_loop_idioms(application.body)
+        elif type(application) is Applicator:
+            _replace_inlined_loop_idioms(application)
+
+
+def replace_loop_idioms(statements):
+    """Replace conditionals that only count to zero with ``CountedLoop``s."""
+    result = []
+    for node in statements:
+        if type(node) is Conditional:
+            if type(node.index) is Applicator:
+                _replace_inlined_loop_idioms(node.index)
+            node.body = replace_loop_idioms(node.body)
+            node = _counted_loop(node) or node
+        elif type(node) is Applicator:
+            _replace_inlined_loop_idioms(node)
+        result.append(node)
+    return result
+
+
+# Applications with at most this many nodes are inlined at every call site;
+# larger ones only if they are called exactly once.
+INLINE_MAX_SIZE = 32
+
+# Inlining stops once it has added this many nodes to the program.
+INLINE_MAX_GROWTH = 100000
+
+
+def call_graph(program):
+    """Map each application to the applications it calls."""
+    return {
+        name: [
+            node.name
+            for node in walk(body)
+            if type(node) is Call and node.name in program
+        ]
+        for name, body in program.items()
+    }
+
+
+def strongly_connected_components(graph):
+    """Find the strongly connected components of a graph.
+
+    Returns
+    -------
+    : list of list
+        The components, ordered so that each comes after every component
+        reachable from it.
+    """
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in graph:
+        if root in index:
+            continue
+        # Iterative Tarjan's algorithm: each frame is a node and an iterator
+        # over its successors.
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        frames = [(root, iter(graph[root]))]
+        while frames:
+            node, successors = frames[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    frames.append((successor, iter(graph[successor])))
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                frames.pop()
+                if frames:
+                    parent = frames[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+class _Inliner:
+    """Inlines calls to small or single-use applications."""
+
+    def __init__(self, program, max_size, max_growth):
+        self.program = program
+        self.max_size = max_size
+        self.budget = max_growth
+        self.variables = 0
+        self.sizes = {}
+
+        graph = call_graph(program)
+        self.components = strongly_connected_components(graph)
+        self.recursive = set()
+        for component in self.components:
+            if len(component) > 1 or component[0] in graph[component[0]]:
+                self.recursive.update(component)
+        self.uses = {}
+        for callees in graph.values():
+            for callee in callees:
+                self.uses[callee] = self.uses.get(callee, 0) + 1
+
+    def size(self, name):
+        # Callees are finished before their callers, so sizes do not change.
+        if name not in self.sizes:
+            self.sizes[name] = sum(1 for _ in walk(self.program[name]))
+        return self.sizes[name]
+
+    def inlinable(self, name):
+        if name not in self.program or name == "main":
+            return False
+        if name in self.recursive:
+            return False
+        size = self.size(name)
+        if self.uses[name] == 1:
+            return True
+        if size > self.max_size or size > self.budget:
+            return False
+        self.budget -= size
+        return True
+
+    def inline(self, call, index):
+        """Build the ``Inlined`` node for a call on the given index."""
+        position = {"line": call.line, "column": call.column}
+        variable = None
+        if type(index) is Literal:
+            # Specialize the body on the constant argument.
+            value = wrap_char(index.value)
+            arg = lambda: Literal(value, **position)
+        elif type(index) is Applicator:
+            # The value in memory may change while the body runs, so it is
+            # saved in a variable first.
+            self.variables += 1
+            variable = f"_stercus_arg{self.variables}"
+            arg = lambda: Local(variable, **position)
+        else:
+            # $ and variables already hold a char that can not change.
+            arg = lambda: clone(index)
+        body = [clone(node, arg) for node in self.program[call.name]]
+        return Inlined(call.name, variable, body, **position)
+
+    def inline_applicator(self, node):
+        if type(node.index) is Applicator:
+            self.inline_applicator(node.index)
+        applications = node.applications
+        for i, application in enumerate(applications):
+            kind = type(application)
+            if kind is Applicator:
+                self.inline_applicator(application)
+            elif kind is Call and self.inlinable(application.name):
+                applications[i] = self.inline(application, node.index)
+
+    def inline_statements(self, statements):
+        for node in statements:
+            kind = type(node)
+            if kind is Applicator:
+                self.inline_applicator(node)
+            elif kind is Conditional:
+                if type(node.index) is Applicator:
+                    self.inline_applicator(node.index)
+                self.inline_statements(node.body)
+
+    def run(self):
+        # Callees come first, so the bodies being inlined have already had
+        # their own calls inlined.
+        for component in self.components:
+            for name in component:
+                self.inline_statements(self.program[name])
+
+
+def remove_unused_applications(program):
+    """Remove the applications that can not be reached from main."""
+    graph = call_graph(program)
+    reachable = {"main"}
+    stack = ["main"]
+    while stack:
+        for callee in graph[stack.pop()]:
+            if callee not in reachable:
+                reachable.add(callee)
+                stack.append(callee)
+    for name in list(program):
+        if name not in reachable:
+            del program[name]
+
+
+def inline_applications(
+    program, max_size=INLINE_MAX_SIZE, max_growth=INLINE_MAX_GROWTH
+):
+    """Inline calls to custom applications.
+
+    Applications that are called once, or that have at most ``max_size``
+    nodes, are inlined at their call sites. Where the index an application
+    is applied to is a literal, the inlined body is specialized on it.
+    Applications in recursive cycles are never inlined. Applications that are
+    no longer called are removed.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes. Modified in
+        place.
+    max_size : int
+        Maximum size, in nodes, of an application inlined at several sites.
+    max_growth : int
+        Maximum number of nodes that inlining may add to the program.
+    """
+    if "main" not in program:
+        return
+    _Inliner(program, max_size, max_growth).run()
+    remove_unused_applications(program)
+
+
+def optimize(program, level=1):
+    """Optimize the syntax tree of a program.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes. Modified in
+        place.
+    level : int
+        Optimization level. 0 does nothing; 1 folds runs of increments,
+        decrements and assignments and drops dead stores; 2 also replaces
+        counting loops with arithmetic and inlines small or single-use
+        applications.
+
+    Returns
+    -------
+    : dict
+        The optimized program.
+    """
+    if level >= 2:
+        inline_applications(program)
+    if level >= 1:
+        for name, body in program.items():
+            program[name] = fold_statements(body)
+    if level >= 2:
+        for name, body in program.items():
+            program[name] = replace_loop_idioms(body)
+    return program
@@ -7,93 +7,245 @@ from string import ascii_letters
 
 from .constants import *
 from .errors import *
+from .nodes import *
 
 
 APP_NAME_CHARS = ascii_letters + "_"
+BUILTIN_APPLICATIONS = frozenset(
+    (INCREMENT, DECREMENT, OUTPUT_INT, OUTPUT_CHAR, INPUT, NOP)
+)
 
 
-def check_brackets(tokens):
-    counts = {b: 0 for b in BRACKETS["OPEN"]}
+_OPENING_BRACKETS = frozenset(BRACKETS["OPEN"])
+_CLOSING_BRACKETS = {
+    close: opening for opening, close in BRACKETS["PAIRS"].items()
+}
+
+
+def check_application_name(name):
+    """Check if the application name is valid."""
+    # Application names may only contain letters and underscores.
+    for char in name:
+        if char not in APP_NAME_CHARS:
+            raise ApplicationNameError(
+                "Invalid application name: "
+                + name
+                + ". Application names may only contain letters."
+            )
+
+
+def parse_stream(tokens):
+    """Parse the Stercus tokens into applications as they are read.
+
+    The tokens are walked exactly once: brackets are checked, ``$`` is
+    rewritten to the C argument name and each application body is yielded
+    as soon as its closing bracket is reached, so only one application needs
+    to be held in memory at a time.
+
+    Parameters
+    ----------
+    tokens : iterable of str or tuple
+        The lexed Stercus tokens, either plain strings from ``lex`` or
+        ``(text, line, column)`` tuples from ``tokenize``, which are kept in
+        the bodies so that the nodes built from them have positions.
+
+    Yields
+    ------
+    : tuple
+        ``(name, tokens)`` for each application, in order. Each top-level
+        statement outside of the applications is yielded with the name
+        ``"main"``.
+    """
+    names = set()
     openings = []
+    body = []
+
+    # The name of the application being read, or None while reading main.
+    app_name = None
+    expect_name = False
+
     for token in tokens:
-        if token in BRACKETS["OPEN"]:
-            openings.append(token)
+        text = token[0] if type(token) is tuple else token
+        if text == "main":
+            raise ApplicationNameError(
+                "Application named 'main' is not" " allowed."
+            )
 
+        if expect_name:
+            check_application_name(text)
+            if text in names:
+                raise ApplicationNameError(
+                    "Application " + text + " is defined more than once."
+                )
+            names.add(text)
+            app_name = text
+            expect_name = False
+        elif text in _OPENING_BRACKETS:
             # Applications must not be nested within any expressions.
-            if token == "{":
-                for _, count in counts.items():
-                    if count > 0:
-                        raise UnbalancedBracketsError(
-                            "Application definitions"
-                            " must not be nested within any expressions."
-                        )
-            counts[token] += 1
-        elif token in BRACKETS["CLOSE"]:
-
+            if text == APPLICATION["OPEN"]:
+                if openings:
+                    raise UnbalancedBracketsError(
+                        "Application definitions"
+                        " must not be nested within any expressions."
+                    )
+                expect_name = True
+            else:
+                body.append(token)
+            openings.append(text)
+        elif text in _CLOSING_BRACKETS:
             # If the stack ever empties and a closing bracket is encounted,
             # the brackets must be unbalanced.
-            try:
-                opening = openings.pop()
-            except IndexError:
+            if not openings:
                 raise UnbalancedBracketsError(
-                    "Too many closing brackets of" ' type "' + token + '".'
+                    "Too many closing brackets of" ' type "' + text + '".'
                 )
 
             # The opening and closing brackets must match.
-            if BRACKETS["PAIRS"][opening] != token:
+            if _CLOSING_BRACKETS[text] != openings.pop():
                 raise UnbalancedBracketsError(
                     "Opening and closing brackets do" " not match."
                 )
-            counts[opening] -= 1
 
+            if text == APPLICATION["CLOSE"]:
+                yield app_name, body
+                body = []
+                app_name = None
+            else:
+                body.append(token)
+                if not openings:
+                    yield "main", body
+                    body = []
+        else:
+            if text == STERCUS_ARG_NAME:
+                if text is token:
+                    token = C_FUNC_ARG_NAME
+                else:
+                    token = (C_FUNC_ARG_NAME,) + token[1:]
+            body.append(token)
+            if not openings:
+                yield "main", body
+                body = []
+
+    if expect_name or openings:
+        raise UnbalancedBracketsError("Unclosed brackets at end of program.")
 
-def check_application_name(name):
-    """Check if the application name is valid."""
-    # Application names may only contain letters and underscores.
-    for char in name:
-        if char not in APP_NAME_CHARS:
-            raise ApplicationNameError(
-                "Invalid application name: "
-                + name
-                + ". Application names may only contain letters."
-            )
 
+def parse(tokens):
+    """Parse the Stercus tokens into separate applications.
+
+    Parameters
+    ----------
+    tokens : iterable of str or tuple
+        The lexed Stercus tokens, as for ``parse_stream``.
 
-def parse_applications(tokens):
-    """Parse the applications in the program."""
+    Returns
+    -------
+    : dict
+        Maps each application name to its list of body tokens. Code outside
+        of any application is collected under ``"main"``.
+    """
+    main = []
     applications = {}
-    open_index = 0
-    index = 0
-    while index < len(tokens):
-        if tokens[index] == APPLICATION["OPEN"]:
-            open_index = index
-        elif tokens[index] == APPLICATION["CLOSE"]:
-            # Check the application name.
-            app_name = tokens[open_index + 1]
-            check_application_name(app_name)
-
-            # Add the application to the application table.
-            applications[app_name] = tokens[open_index + 2 : index]
-
-            # Remove the application body from the tokens.
-            tokens = tokens[:open_index] + tokens[index + 1 :]
-            index = open_index
-            continue
-        index += 1
-    applications["main"] = tokens
+    for name, body in parse_stream(tokens):
+        if name == "main":
+            main.extend(body)
+        else:
+            applications[name] = body
+    applications["main"] = main
     return applications
 
 
-def parse(tokens):
-    """Parse the Stercus tokens into separate applications."""
-    check_brackets(tokens)
-    tokens = [C_FUNC_ARG_NAME if token == STERCUS_ARG_NAME else token for token in tokens]
-    for token in tokens:
-        if token == "main":
-            raise ApplicationNameError(
-                "Application named 'main' is not" " allowed."
+def _atom(token, line, column):
+    """Build the node for a token that is not a bracket."""
+    if token == C_FUNC_ARG_NAME:
+        return Arg(line=line, column=column)
+    if token in BUILTIN_APPLICATIONS:
+        return Builtin(token, line=line, column=column)
+    try:
+        return Literal(int(token), line=line, column=column)
+    except ValueError:
+        check_application_name(token)
+        return Call(token, line=line, column=column)
+
+
+def _close(opening, line, column, items):
+    """Build the applicator or conditional node for a closed bracket."""
+    if not items or not isinstance(items[0], INDEX_NODES):
+        raise ExpressionError(
+            f'Expected an index after "{opening}" at line {line}, '
+            f"column {column}."
+        )
+    index, rest = items[0], items[1:]
+    if opening == APPLICATOR["OPEN"]:
+        for item in rest:
+            if type(item) is Conditional:
+                raise ExpressionError(
+                    "Conditionals must not be nested within applicators."
+                )
+        return Applicator(index, rest, line=line, column=column)
+    _check_statements(rest)
+    return Conditional(index, rest, line=line, column=column)
+
+
+def _check_statements(nodes):
+    for node in nodes:
+        if not isinstance(node, STATEMENT_NODES):
+            raise ExpressionError(
+                f"Expected an applicator or conditional at line {node.line}, "
+                f"column {node.column}."
             )
-    return parse_applications(tokens)
+
+
+def build_body(tokens):
+    """Build the syntax tree for the tokens of one application body.
+
+    Parameters
+    ----------
+    tokens : list of str or tuple
+        The body tokens, with balanced brackets, as produced by ``parse``.
+        Positioned ``(text, line, column)`` tokens give the nodes their
+        positions.
+
+    Returns
+    -------
+    : list of Node
+        The ``Applicator`` and ``Conditional`` statements of the body.
+    """
+    statements = []
+    items = statements
+    stack = []
+    for token in tokens:
+        if type(token) is tuple:
+            token, line, column = token
+        else:
+            line = column = None
+        if token == APPLICATOR["OPEN"] or token == CONDITIONAL["OPEN"]:
+            stack.append((token, line, column, items))
+            items = []
+        elif token == APPLICATOR["CLOSE"] or token == CONDITIONAL["CLOSE"]:
+            opening, line, column, outer = stack.pop()
+            outer.append(_close(opening, line, column, items))
+            items = outer
+        else:
+            items.append(_atom(token, line, column))
+    _check_statements(statements)
+    return statements
+
+
+def build_tree(applications):
+    """Build the syntax tree of each application.
+
+    Parameters
+    ----------
+    applications : dict
+        The application table produced by ``parse``.
+
+    Returns
+    -------
+    : dict
+        Maps each application name to the list of statements in its body.
+    """
+    return {name: build_body(body) for name, body in applications.items()}
 
 
 def main():
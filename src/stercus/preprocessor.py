@@ -2,19 +2,100 @@
 """ Stercus Language Preprocessor. """
 
 import argparse
-import re
-import sys
 
 from .constants import *
+from .errors import UnterminatedCommentError
 
-SINGLE_LINE_COMMENT_RULE = re.compile(
-    SINGLE_LINE_COMMENT_DELIMITER + ".*?$", re.M
-)
+
+def _strip_line(line, in_block):
+    """Remove the comments from one line.
+
+    Parameters
+    ----------
+    line : str
+        A line of source code, with its line ending.
+    in_block : bool
+        Whether the line starts inside a multi-line comment.
+
+    Returns
+    -------
+    : tuple
+        The code of the line, and whether the line ends inside a multi-line
+        comment. The line ending is kept even when it is commented out.
+    """
+    newline = "\n" if line.endswith("\n") else ""
+    parts = []
+    start = 0
+    while True:
+        if in_block:
+            end = line.find(MULTI_LINE_COMMENT_DELIMITER, start)
+            if end < 0:
+                parts.append(newline)
+                return "".join(parts), True
+            # The comment separates the code around it, like whitespace.
+            parts.append(" ")
+            start = end + len(MULTI_LINE_COMMENT_DELIMITER)
+            in_block = False
+            continue
+        comment = line.find(SINGLE_LINE_COMMENT_DELIMITER, start)
+        if comment < 0:
+            parts.append(line[start:])
+            return "".join(parts), False
+        parts.append(line[start:comment])
+        if line.startswith(MULTI_LINE_COMMENT_DELIMITER, comment):
+            start = comment + len(MULTI_LINE_COMMENT_DELIMITER)
+            in_block = True
+        else:
+            parts.append(newline)
+            return "".join(parts), False
+
+
+def preprocess_stream(lines):
+    """Preprocess Stercus source code one line at a time.
+
+    A ``#`` comments out the rest of its line, and ``##`` starts a comment
+    that runs until the next ``##``, possibly on a later line. Only one line
+    is held in memory at a time.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        Lines of Stercus source code, such as an open file.
+
+    Yields
+    ------
+    : str
+        The preprocessed lines, with line endings preserved, so that each
+        line of code keeps its line number.
+
+    Raises
+    ------
+    UnterminatedCommentError
+        If the source ends inside a multi-line comment.
+    """
+    in_block = False
+    for line_number, line in enumerate(lines, 1):
+        if in_block and MULTI_LINE_COMMENT_DELIMITER not in line:
+            # Skip the inside of long comments without copying them.
+            yield "\n" if line.endswith("\n") else ""
+            continue
+        if not in_block and SINGLE_LINE_COMMENT_DELIMITER not in line:
+            yield line
+            continue
+        was_in_block = in_block
+        line, in_block = _strip_line(line, in_block)
+        if in_block and not was_in_block:
+            opened = line_number
+        yield line
+    if in_block:
+        raise UnterminatedCommentError(
+            f"multi-line comment opened on line {opened} is not closed"
+        )
 
 
 def remove_comments(src):
     """Remove comments from the source code."""
-    return re.sub(SINGLE_LINE_COMMENT_RULE, "", src).strip()
+    return "".join(preprocess_stream(src.splitlines(keepends=True))).strip()
 
 
 def preprocess(src):
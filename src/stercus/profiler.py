@@ -0,0 +1,94 @@
+""" Per-stage instrumentation of the Stercus compiler.
+
+A ``Profile`` is passed to ``compile_string`` (or ``compile_file`` and
+``compile_stream``), which runs each stage of the pipeline inside
+``Profile.stage``. Each stage records its wall time and the peak memory
+allocated while it ran, as measured by ``tracemalloc``, along with counts
+that the stage adds itself, such as the number of tokens.
+"""
+
+from contextlib import contextmanager, nullcontext
+import time
+import tracemalloc
+
+
+class Profile:
+    """Measurements of each stage of a compilation.
+
+    Parameters
+    ----------
+    memory : bool
+        If True, trace memory allocations to record the peak memory of each
+        stage. Tracing slows the compiler down noticeably.
+    hooks : list of callable, optional
+        Each hook is called as ``hook(name, record)`` after a stage finishes.
+
+    Attributes
+    ----------
+    stages : dict
+        Maps the name of each stage, in the order they ran, to its record: a
+        dict with ``seconds``, ``peak_memory`` in bytes (None if memory is not
+        traced) and any counts added by the stage.
+    """
+
+    def __init__(self, memory=True, hooks=None):
+        self.memory = memory
+        self.hooks = list(hooks or [])
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the code run in the context as the named stage.
+
+        Yields the record of the stage, so that counts can be added to it.
+        """
+        record = {"seconds": None, "peak_memory": None}
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.memory:
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if self.memory:
+                record["peak_memory"] = tracemalloc.get_traced_memory()[1] - baseline
+            if tracing:
+                tracemalloc.stop()
+        self.stages[name] = record
+        for hook in self.hooks:
+            hook(name, record)
+
+    def as_dict(self):
+        """Return the measurements as a dict of plain values."""
+        return {
+            "stages": {name: dict(record) for name, record in self.stages.items()},
+            "seconds": sum(record["seconds"] for record in self.stages.values()),
+        }
+
+    def format(self):
+        """Format the measurements as a table."""
+        lines = [f"{'stage':<12} {'time':>9} {'peak memory':>12}  counts"]
+        for name, record in self.stages.items():
+            memory = record["peak_memory"]
+            memory = "" if memory is None else f"{memory // 1024:,} KiB"
+            counts = " ".join(
+                f"{key}={value}"
+                for key, value in record.items()
+                if key not in ("seconds", "peak_memory")
+            )
+            lines.append(
+                f"{name:<12} {record['seconds']:>8.3f}s {memory:>12}  {counts}"
+            )
+        lines.append(f"{'total':<12} {self.as_dict()['seconds']:>8.3f}s")
+        return "\n".join(lines)
+
+
+def stage(profile, name):
+    """Measure a stage in the profile, or do nothing if it is None."""
+    if profile is None:
+        return nullcontext({})
+    return profile.stage(name)
@@ -1,16 +1,229 @@
 #!/usr/bin/env python
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
 from pathlib import Path
+import shutil
 import subprocess
+import sys
 import tempfile
 
-from stercus import compile_file, IndexOutOfRangeError
+from stercus import (
+    Profile,
+    compile_stream,
+    compile_string,
+    compile_units,
+    lex_stream,
+    parse_stream,
+    preprocess_stream,
+)
+from stercus.cache import CompilationCache, DEFAULT_MAX_SIZE
+from stercus.compiler import BACKING_STORES
+from stercus.errors import *
+from stercus.profiler import stage
+
+# Errors in a Stercus program that are reported instead of raised.
+COMPILE_ERRORS = (
+    IndexOutOfRangeError,
+    UnbalancedBracketsError,
+    ApplicationNameError,
+    ExpressionError,
+    UnterminatedCommentError,
+)
+
+
+def build_binary(c_str, command, output):
+    """Compile C source to a binary with a C compiler.
+
+    Returns
+    -------
+    : int
+        The exit code of the C compiler.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        c_file = os.path.join(tmpdir, "program.c")
+        with open(c_file, "w") as f:
+            f.write(c_str)
+        return subprocess.run([command, "-o", output, c_file]).returncode
+
+
+def stream_program(src, output, compile_options, command=None, profile=None):
+    """Compile a Stercus file without holding the program in memory.
+
+    The C code is written straight to the output file, or to a temporary
+    file if a binary is to be produced. Returns the exit code of the C
+    compiler, or 0 if it was not called.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if command is None:
+            c_file = str(output) + ".c"
+        else:
+            c_file = os.path.join(tmpdir, "program.c")
+        with open(src) as f, open(c_file, "w") as out_file:
+            compile_stream(f, out_file, profile=profile, **compile_options)
+        if command is None:
+            return 0
+        return subprocess.run([command, "-o", output, c_file]).returncode
+
+
+def units_program(src, output, compile_options, command=None, profile=None):
+    """Compile a Stercus file to a directory of C files and a Makefile.
+
+    Only the applications and blocks of main that changed since the last
+    compilation into the directory are written again. If a C compiler is
+    given, the binary ``program`` is built in the directory with make.
+    Returns the exit code of make, or 0 if it was not called.
+    """
+    with stage(profile, "units") as record, open(src) as f:
+        tokens = lex_stream(preprocess_stream(f))
+        result = compile_units(parse_stream(tokens), output, **compile_options)
+        record.update({key: len(files) for key, files in result.items()})
+    if command is None:
+        return 0
+    make = ["make", "-s", "-C", str(output), f"CC={command}"]
+    return subprocess.run(make).returncode
+
+
+def compile_program(
+    src, output, compile_options, command=None, cache=None, profile=None, jobs=1
+):
+    """Compile a Stercus file to a C file, or to a binary.
+
+    Parameters
+    ----------
+    src : str or Path
+        The path to the Stercus source file.
+    output : str or Path
+        Output path. ``.c`` is appended when producing C.
+    compile_options : dict
+        Keyword arguments for ``compile_string``.
+    command : str, optional
+        C compiler command. If provided, a binary is produced.
+    cache : CompilationCache, optional
+        Cache to look up and store results in.
+    profile : Profile, optional
+        Profile to record the stages of the compilation in. Nothing is
+        recorded when the C source is found in the cache.
+    jobs : int
+        Number of processes to compile the applications of the program in.
+        The C code does not depend on it, so it is not part of the cache key.
+
+    Returns
+    -------
+    : int
+        The exit code of the C compiler, or 0 if it was not called.
+    """
+    with open(src, "rb") as f:
+        src = f.read()
+
+    if cache:
+        key = cache.key(src, **compile_options)
+
+    c_str = cache.get_c_source(key) if cache else None
+    if c_str is None:
+        c_str = compile_string(
+            src.decode(), profile=profile, jobs=jobs, **compile_options
+        )
+        if cache:
+            cache.put_c_source(key, c_str)
+
+    if command is None:
+        with open(str(output) + ".c", "w") as f:
+            f.write(c_str)
+        return 0
+
+    binary = cache.get_binary(key, command) if cache else None
+    if binary is not None:
+        shutil.copy2(binary, output)
+        return 0
+
+    returncode = build_binary(c_str, command, output)
+    if returncode == 0 and cache:
+        cache.put_binary(key, command, output)
+    return returncode
+
+
+def _compile_job(job):
+    """Compile one file of a batch.
+
+    Returns
+    -------
+    : tuple
+        An error message, or None on success, and the formatted profile of
+        the compilation, or None if it was not profiled.
+    """
+    src, output, compile_options, command, cache, mode, profile, jobs = job
+    profile = Profile() if profile else None
+    try:
+        if mode == "stream":
+            returncode = stream_program(
+                src, output, compile_options, command, profile
+            )
+        elif mode == "units":
+            returncode = units_program(
+                src, output, compile_options, command, profile
+            )
+        else:
+            returncode = compile_program(
+                src, output, compile_options, command, cache, profile, jobs
+            )
+    except COMPILE_ERRORS as e:
+        error = f"{type(e).__name__}: {e}"
+    except OSError as e:
+        error = str(e)
+    else:
+        error = (
+            f"C compiler exited with code {returncode}" if returncode else None
+        )
+
+    report = None
+    if profile is not None:
+        report = profile.format() if profile.stages else "found in cache"
+    return error, report
+
+
+def find_sources(paths):
+    """Expand the given paths into Stercus source files.
+
+    Directories are searched recursively for ``.cus`` files.
+
+    Returns
+    -------
+    : list of tuple
+        ``(src, output)`` pairs, where ``output`` is the relative output path
+        of the file without a suffix.
+    """
+    sources = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            for src in sorted(path.rglob("*.cus")):
+                sources.append((src, src.relative_to(path).with_suffix("")))
+        else:
+            sources.append((path, Path(path.stem)))
+    return sources
+
+
+def _non_negative_int(value):
+    """Parse a command line value as an int that is at least 0."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, not {number}")
+    return number
 
 
 def main():
     parser = argparse.ArgumentParser(description="Compile Stercus to C.")
-    parser.add_argument("src", help="Stercus source file.")
-    parser.add_argument("-o", "--output", help="Output file for C code.")
+    parser.add_argument(
+        "src",
+        nargs="+",
+        help="Stercus source files, or directories to search for .cus files.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output file for C code. When compiling several files, the output "
+        "directory.",
+    )
     parser.add_argument(
         "-m",
         "--memory-size",
@@ -22,33 +235,188 @@ def main():
         "-c",
         "--c-compiler-command",
         type=str,
-        help="Command to call to compile code to C. If provided, a binary is produced using this C compiler. Otherwise, the output is a C source code file.",
+        help="Command to call to compile code to C. If provided, a binary is "
+        "produced using this C compiler. Otherwise, the output is a C source "
+        "code file.",
+    )
+    parser.add_argument(
+        "--elide-bounds-checks",
+        action="store_true",
+        help="Access memory directly wherever the index is proven to be in "
+        "bounds.",
+    )
+    parser.add_argument(
+        "-O",
+        "--optimize",
+        type=int,
+        default=0,
+        help="Optimization level from 0 to 3 (default 0).",
+    )
+    parser.add_argument(
+        "--buffered-io",
+        action="store_true",
+        help="Buffer program output in the generated C instead of calling "
+        "stdio for each character.",
+    )
+    parser.add_argument(
+        "--backing-store",
+        choices=BACKING_STORES,
+        help="How the program allocates its memory: calloc (heap), a static "
+        "array, anonymous mmap, a mapping of --memory-file, or static for "
+        "small memories and mmap for large ones (auto). Defaults to file if "
+        "--memory-file is given and heap otherwise.",
+    )
+    parser.add_argument(
+        "--memory-file",
+        help="File that the program maps its memory to, so that its final "
+        "memory is left in the file.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_non_negative_int,
+        default=1,
+        help="Number of files to compile in parallel (0 for one per CPU). When "
+        "compiling a single file, the number of processes to compile its "
+        "applications in.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write C as each application is compiled instead of holding the "
+        "whole program in memory. Implies --no-cache.",
+    )
+    parser.add_argument(
+        "--units",
+        action="store_true",
+        help="Write each application and block of main to its own C file in "
+        "the output directory, with a Makefile, and only rewrite those that "
+        "changed since the last compilation into it. With -c, the binary is "
+        "built there as 'program' by make. Implies --no-cache.",
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="Make the program count how often each statement, loop iteration "
+        "and call runs, and write the counts to $STERCUS_COUNTS_FILE (default "
+        "stercus-counts.json) at exit. Show them with 'stercus heatmap'.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time, peak memory and sizes of each compiler stage to "
+        "stderr.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always recompile, without reading or writing the compilation "
+        "cache.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory of the compilation cache (default $STERCUS_CACHE_DIR "
+        "or ~/.cache/stercus).",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE // 2**20,
+        help="Maximum size of the compilation cache in MB.",
     )
     args = parser.parse_args()
 
-    try:
-        c_str = compile_file(args.src, memory_size=args.memory_size)
-    except IndexOutOfRangeError as e:
-        print(e)
-        return 1
+    backing_store = args.backing_store
+    if backing_store is None:
+        backing_store = "file" if args.memory_file else "heap"
+    if backing_store == "file" and not args.memory_file:
+        parser.error("--backing-store file requires --memory-file")
+    if args.stream and args.units:
+        parser.error("--stream cannot be used with --units")
+    for mode in ("stream", "units"):
+        if args.instrument and getattr(args, mode):
+            parser.error(f"--instrument cannot be used with --{mode}")
+    mode = "stream" if args.stream else "units" if args.units else "string"
 
-    output = args.output
-    if output is None:
-        output = Path(args.src).stem
+    compile_options = dict(
+        memory_size=args.memory_size,
+        elide_bounds_checks=args.elide_bounds_checks,
+        optimize=args.optimize,
+        buffered_io=args.buffered_io,
+        backing_store=backing_store,
+        memory_file=args.memory_file,
+    )
+    if args.instrument:
+        # Not supported when streaming, so only passed when requested.
+        compile_options["instrument_counts"] = True
 
-    if args.c_compiler_command is None:
-        with open(output + ".c", "w") as f:
-            f.write(c_str)
+    cache = None
+    if not args.no_cache and mode == "string":
+        cache = CompilationCache(
+            args.cache_dir, max_size=args.cache_size * 2**20
+        )
+
+    sources = find_sources(args.src)
+    if len(args.src) == 1 and not Path(args.src[0]).is_dir():
+        # A single file is written to the output path itself.
+        src, output = sources[0]
+        outputs = [args.output or output]
     else:
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".c", delete_on_close=False
-        ) as f:
-            f.write(c_str)
-            f.close()
+        # Files with the same name in different directories would overwrite
+        # each other's output.
+        seen = {}
+        for src, output in sources:
+            if output in seen:
+                parser.error(
+                    f"{seen[output]} and {src} would both be compiled to "
+                    f"{output}"
+                )
+            seen[output] = src
+        out_dir = Path(args.output or ".")
+        outputs = [out_dir / output for _, output in sources]
+        for output in outputs:
+            output.parent.mkdir(parents=True, exist_ok=True)
 
-            args = [args.c_compiler_command, "-o", output, f.name]
-            subprocess.run(args)
+    # A single file is compiled with all the jobs, split among its
+    # applications.
+    app_jobs = args.jobs if len(sources) == 1 else 1
+    jobs = [
+        (
+            src,
+            output,
+            compile_options,
+            args.c_compiler_command,
+            cache,
+            mode,
+            args.profile,
+            app_jobs,
+        )
+        for (src, _), output in zip(sources, outputs)
+    ]
+    if args.jobs == 1 or len(jobs) <= 1:
+        results = list(map(_compile_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs or None) as executor:
+            results = list(executor.map(_compile_job, jobs, chunksize=8))
+    errors = [error for error, _ in results]
+
+    for job, (_, report) in zip(jobs, results):
+        if report is not None:
+            print(f"{job[0]}:", file=sys.stderr)
+            print(report, file=sys.stderr)
+
+    failures = [(job[0], error) for job, error in zip(jobs, errors) if error]
+    if failures:
+        if len(jobs) > 1:
+            print(
+                f"{len(failures)} of {len(jobs)} files failed to compile:",
+                file=sys.stderr,
+            )
+        for src, error in failures:
+            print(f"{src}: {error}", file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
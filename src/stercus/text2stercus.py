@@ -2,17 +2,63 @@
 
 import argparse
 
+ENCODINGS = ("literal", "delta")
 
-def parse(text):
-    code = " : ".join([str(ord(char)) for char in text])
-    return f"[0 {code}]"
+
+def _literal(byte):
+    """The Stercus literal for a byte, as a signed char."""
+    return str(byte - 256 if byte > 127 else byte)
+
+
+def parse(text, encoding="literal"):
+    """Return the Stercus applicator that outputs the text.
+
+    Parameters
+    ----------
+    text : str
+        The text to output, written as UTF-8.
+    encoding : str
+        ``"literal"`` assigns each character to byte 0 before outputting it.
+        ``"delta"`` instead steps byte 0 from each character to the next with
+        runs of ``+`` or ``-``, wherever that is no longer than the literal.
+        Repeated characters then cost a single ``:``, which makes banners
+        and other text with long runs of a character much smaller.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unknown encoding {encoding!r}")
+    tokens = []
+    previous = None
+    for byte in text.encode():
+        literal = _literal(byte)
+        if encoding == "delta" and previous is not None:
+            step = (byte - previous) % 256
+            if step > 128:
+                steps = ["-"] * (256 - step)
+            else:
+                steps = ["+"] * step
+            # Each step costs a token and a space, as does the literal.
+            if len(steps) * 2 <= len(literal) + 1:
+                literal = " ".join(steps)
+        if literal:
+            tokens.append(literal)
+        tokens.append(":")
+        previous = byte
+    return f"[0 {' '.join(tokens)}]"
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("text")
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        choices=ENCODINGS,
+        default="literal",
+        help="How to set each character: assign it as a literal, or step to "
+        "it from the previous character with + and -, whichever is shorter.",
+    )
     args = parser.parse_args()
-    print(parse(args.text))
+    print(parse(args.text, args.encoding))
 
 
 if __name__ == "__main__":
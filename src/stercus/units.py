@@ -0,0 +1,341 @@
+""" Incremental compilation of Stercus programs to several C files.
+
+Each custom application is compiled to its own C file, and the statements of
+main are split into blocks that are compiled to files of their own, so that
+``make`` only rebuilds the object files of the parts of a program that
+changed. Every such unit is fingerprinted from its tokens, the compile
+options, the version of Stercus and the revision of the compiler, as in the
+compilation cache, and the fingerprints are kept in a manifest in the output
+directory. On the next compilation into the same directory, only the units
+whose fingerprints changed are compiled and written again; the others are
+left untouched, along with their timestamps.
+
+As when streaming, each unit is optimized on its own: applications are not
+inlined into each other and ``$`` is never proven in bounds, so a unit only
+depends on its own tokens. The blocks of main end at statements chosen by
+the hash of their tokens, so that inserting or removing a statement only
+changes the block it is in.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from textwrap import dedent
+import zlib
+
+from . import __version__
+from .cache import compiler_revision
+from .constants import *
+from .compiler import (
+    MAIN_BLOCK_SIZE,
+    _declarations,
+    _prepare,
+    c_helpers,
+    c_io_runtime,
+    c_memory,
+    compile_application,
+    compile_body,
+    resolve_backing_store,
+)
+from .parser import build_body
+
+MANIFEST_NAME = "manifest.json"
+HEADER_NAME = "stercus.h"
+
+
+def fingerprint(options, kind, name, tokens):
+    """Hash everything that the C code of a unit depends on."""
+    h = hashlib.sha256()
+    options = json.dumps(options, sort_keys=True)
+    for part in (__version__, compiler_revision(), options, kind, name):
+        h.update(part.encode())
+        h.update(b"\0")
+    h.update(" ".join(tokens).encode())
+    return h.hexdigest()
+
+
+def main_blocks(statements):
+    """Split the statements of main into blocks.
+
+    A block ends after a statement whose hash is a multiple of
+    ``MAIN_BLOCK_SIZE``, once it holds at least a quarter of that many
+    statements, or when it reaches four times that many.
+
+    Parameters
+    ----------
+    statements : iterable of list
+        The tokens of each top-level statement of main.
+
+    Yields
+    ------
+    : list
+        The tokens of the statements of each block.
+    """
+    block = []
+    count = 0
+    for tokens in statements:
+        block.extend(tokens)
+        count += 1
+        boundary = zlib.crc32(" ".join(tokens).encode()) % MAIN_BLOCK_SIZE == 0
+        if (boundary and count >= MAIN_BLOCK_SIZE // 4) or (
+            count >= 4 * MAIN_BLOCK_SIZE
+        ):
+            yield block
+            block = []
+            count = 0
+    if block:
+        yield block
+
+
+def c_unit_header(memory_size, buffered_io=False, backing_store="heap"):
+    """Return the header shared by all the C files of a program."""
+    if resolve_backing_store(memory_size, backing_store) == "static":
+        data = f"extern char {C_DATA_ARRAY_NAME}[];"
+    else:
+        data = f"extern char *{C_DATA_ARRAY_NAME};"
+    if buffered_io:
+        io = dedent(
+            f"""
+        void {C_PUT_CHAR_NAME}(char c);
+        void {C_PUT_INT_NAME}(int value);
+        int {C_GET_CHAR_NAME}(void);
+        void {C_WRITE_NAME}(const char *data, size_t size);
+        """
+        ).strip()
+    else:
+        io = c_io_runtime(False)
+    return (
+        dedent(
+            f"""
+        #include <stdio.h>
+        #include <stdlib.h>
+        #include <string.h>
+
+        extern const size_t {C_DATA_ARRAY_SIZE_NAME};
+        {data}
+        int {C_GET_BYTE_NAME}(int i);
+        void {C_SET_BYTE_NAME}(int i, char value);
+        void _stercus_start(int argc, char* argv[]);
+        void _stercus_finish(void);
+        """
+        ).strip()
+        + "\n"
+        + io
+        + "\n"
+    )
+
+
+def c_unit_runtime(
+    memory_size,
+    argv_max_bytes=None,
+    buffered_io=False,
+    backing_store="heap",
+    memory_file=None,
+):
+    """Return the C file holding the memory and the runtime functions."""
+    if argv_max_bytes is None:
+        argv_max_bytes = C_DATA_ARRAY_SIZE_NAME
+    features, memory = c_memory(memory_size, backing_store, memory_file)
+    parts = [
+        features
+        + f'#include "{HEADER_NAME}"\n\n'
+        + f"const size_t {C_DATA_ARRAY_SIZE_NAME} = {memory_size};\n"
+        + memory,
+        c_helpers(),
+    ]
+    if buffered_io:
+        parts.append(c_io_runtime(True, linkage=""))
+    parts.append(
+        dedent(
+            f"""
+        void _stercus_start(int argc, char* argv[]) {{
+            _stercus_alloc();
+            _stercus_copy_cli_args(argc, argv, {argv_max_bytes});
+        }}
+
+        void _stercus_finish(void) {{
+            {C_FLUSH_NAME}();
+            _stercus_free();
+        }}
+        """
+        ).strip()
+    )
+    return "\n\n".join(parts) + "\n"
+
+
+def c_unit_main(blocks):
+    """Return the C file with the main function, calling the blocks in order."""
+    declarations = "".join(f"void {name}(void);\n" for name in sorted(set(blocks)))
+    calls = "".join(f"  {name}();\n" for name in blocks)
+    return (
+        f'#include "{HEADER_NAME}"\n\n'
+        + declarations
+        + "\nint main(int argc, char* argv[]) {\n"
+        + "  _stercus_start(argc, argv);\n"
+        + calls
+        + "  _stercus_finish();\n"
+        + "  return 0;\n}\n"
+    )
+
+
+def makefile():
+    """Return a Makefile that builds the program from the C files."""
+    return (
+        "CC ?= cc\n"
+        "CFLAGS ?= -O2\n\n"
+        "OBJECTS = $(patsubst %.c,%.o,$(wildcard *.c))\n\n"
+        "program: $(OBJECTS)\n"
+        "\t$(CC) $(CFLAGS) -o $@ $(OBJECTS)\n\n"
+        f"%.o: %.c {HEADER_NAME}\n"
+        "\t$(CC) $(CFLAGS) -c -o $@ $<\n\n"
+        "clean:\n"
+        "\trm -f program *.o\n"
+    )
+
+
+def _write_if_changed(path, text):
+    """Write the file unless it already holds the text.
+
+    Returns
+    -------
+    : bool
+        True if the file was written.
+    """
+    try:
+        if path.read_text() == text:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_text(text)
+    return True
+
+
+def compile_units(
+    applications,
+    out_dir,
+    memory_size,
+    argv_max_bytes=None,
+    elide_bounds_checks=False,
+    optimize=0,
+    buffered_io=False,
+    backing_store="heap",
+    memory_file=None,
+):
+    """Compile applications to C files, regenerating only those that changed.
+
+    Parameters
+    ----------
+    applications : iterable of tuple
+        ``(name, tokens)`` pairs as yielded by ``parser.parse_stream``.
+    out_dir : str or Path
+        Directory to write the C files, a Makefile and the manifest to.
+    memory_size : int
+        Number of bytes to use for program memory.
+    **options
+        The other parameters are the same as for ``compile_to_file``.
+
+    Returns
+    -------
+    : dict
+        The names of the C files that were ``"compiled"``, left
+        ``"unchanged"`` and ``"removed"``.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    options = dict(
+        memory_size=memory_size,
+        argv_max_bytes=argv_max_bytes,
+        elide_bounds_checks=elide_bounds_checks,
+        optimize=optimize,
+        buffered_io=buffered_io,
+        backing_store=backing_store,
+        memory_file=memory_file,
+    )
+
+    manifest_path = out_dir / MANIFEST_NAME
+    try:
+        old_units = json.loads(manifest_path.read_text())["units"]
+    except (FileNotFoundError, ValueError, KeyError):
+        old_units = {}
+    units = {}
+    result = {"compiled": [], "unchanged": [], "removed": []}
+
+    def write_unit(file_name, digest, compile_unit):
+        units[file_name] = digest
+        path = out_dir / file_name
+        if old_units.get(file_name) == digest and path.exists():
+            if file_name not in result["unchanged"]:
+                result["unchanged"].append(file_name)
+            return
+        path.write_text(f'#include "{HEADER_NAME}"\n\n' + compile_unit())
+        result["compiled"].append(file_name)
+
+    def compile_block(tokens, name, first):
+        nodes = _prepare(
+            "main",
+            build_body(tokens),
+            memory_size,
+            elide_bounds_checks,
+            optimize,
+            evaluate=first,
+        )
+        body = compile_body(nodes, memory_size)
+        return _declarations(nodes) + f"void {name}(void) {{\n{body}}}\n"
+
+    def compile_app(name, tokens):
+        nodes = _prepare(
+            name, build_body(tokens), memory_size, elide_bounds_checks, optimize
+        )
+        _, definition = compile_application(name, nodes, memory_size)
+        return _declarations(nodes) + definition
+
+    statements = []
+    for name, tokens in applications:
+        if name == "main":
+            statements.append(tokens)
+            continue
+        digest = fingerprint(options, "application", name, tokens)
+        write_unit(f"app_{name}.c", digest, lambda: compile_app(name, tokens))
+
+    blocks = []
+    for tokens in main_blocks(statements):
+        first = not blocks
+        digest = fingerprint(options, "main", "first" if first else "", tokens)
+        name = f"_stercus_main_{digest[:16]}"
+        blocks.append(name)
+        write_unit(
+            f"main_{digest[:16]}.c",
+            digest,
+            lambda: compile_block(tokens, name, first),
+        )
+
+    header = c_unit_header(memory_size, buffered_io, backing_store)
+    runtime = c_unit_runtime(
+        memory_size, argv_max_bytes, buffered_io, backing_store, memory_file
+    )
+    files = {
+        HEADER_NAME: header,
+        "runtime.c": runtime,
+        "main.c": c_unit_main(blocks),
+        "Makefile": makefile(),
+    }
+    for file_name, text in files.items():
+        if _write_if_changed(out_dir / file_name, text):
+            result["compiled"].append(file_name)
+        else:
+            result["unchanged"].append(file_name)
+
+    for file_name in old_units:
+        if file_name not in units:
+            (out_dir / file_name).unlink(missing_ok=True)
+            (out_dir / file_name).with_suffix(".o").unlink(missing_ok=True)
+            result["removed"].append(file_name)
+
+    manifest = {
+        "stercus": __version__,
+        "compiler": compiler_revision(),
+        "options": options,
+        "units": units,
+    }
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return result
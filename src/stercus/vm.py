@@ -0,0 +1,738 @@
+""" Stercus Virtual Machine
+
+Runs Stercus programs in-process, without generating C. The syntax tree is
+assembled into a flat list of ints (the bytecode), which is then executed on
+a ``bytearray`` of program memory.
+
+The VM works with two registers: ``a``, which holds the value computed by the
+last index instruction and is used as the address by the instructions that
+follow it, and ``arg``, which holds the ``$`` argument of the running
+application.
+
+Common sequences of instructions on literal indices are assembled into
+superinstructions that do the work of several, such as adding a constant to
+a byte, copying one byte to another, closing a loop that counts a byte down
+and writing a literal string. Before running, the bytecode is decoded into a
+list of ``(handler, operand, operand)`` tuples, with each handler looked up
+once in a table of opcodes, so that each step of the loop is a single call.
+"""
+
+import sys
+
+from .constants import *
+from .errors import *
+from .lexer import lex
+from .nodes import *
+from .optimizer import fold_statements, output_run
+from .parser import build_tree, parse
+from .preprocessor import preprocess
+
+# Opcodes. Instructions are followed by their operands; see OPERAND_COUNTS.
+LIT = 0  # a = operand
+ARG = 1  # a = arg
+LOAD = 2  # a = memory[a]
+ADD = 3  # memory[a] += operand
+SET = 4  # memory[a] = operand
+SET_ARG = 5  # memory[a] = arg
+PUSH = 6  # push a onto the value stack
+SET_POP = 7  # memory[a] = pop the value stack
+OUTPUT_INT_OP = 8  # write memory[a] as an int
+OUTPUT_CHAR_OP = 9  # write memory[a] as a char
+INPUT_OP = 10  # memory[a] = next byte of input
+CALL = 11  # call the application at operand with arg = a
+RET = 12  # return from the current application
+JZ = 13  # jump to operand if memory[a] == 0
+JMP = 14  # jump to operand
+HALT = 15  # stop the program
+
+# Superinstructions, on the byte at the literal index i. They leave a as is.
+ADD_AT = 16  # memory[i] += operand
+SET_AT = 17  # memory[i] = operand, an unsigned byte
+COPY = 18  # memory[i] = memory[operand]
+OUTPUT_INT_AT = 19  # write memory[i] as an int
+OUTPUT_CHAR_AT = 20  # write memory[i] as a char
+JZ_AT = 21  # jump to operand if memory[i] == 0
+JNZ_AT = 22  # jump to operand if memory[i] != 0
+DEC_JNZ = 23  # memory[i] -= 1, then jump to operand if memory[i] != 0
+# Write n bytes and set memory[i] = value, or if i is out of bounds, write
+# the m bytes the unfused instructions would and report w accesses. Followed
+# by the operands i, value, w, n, the n bytes, m and the m bytes.
+PRINT = 24
+
+OPERAND_COUNTS = {
+    LIT: 1,
+    ADD: 1,
+    SET: 1,
+    CALL: 1,
+    JZ: 1,
+    JMP: 1,
+    ADD_AT: 2,
+    SET_AT: 2,
+    COPY: 2,
+    OUTPUT_INT_AT: 1,
+    OUTPUT_CHAR_AT: 1,
+    JZ_AT: 2,
+    JNZ_AT: 2,
+    DEC_JNZ: 2,
+}
+
+# Output is written once this many bytes of it are pending, and before any
+# input is read.
+OUTPUT_BUFFER_SIZE = 65536
+
+# The bytes that OUTPUT_INT writes for each value of a byte.
+_INT_TEXT = [
+    str(value - 256 if value > 127 else value).encode() for value in range(256)
+]
+
+# Operands that are jump targets, by opcode, as the position of the operand.
+_TARGET_OPERANDS = {
+    CALL: 0,
+    JZ: 0,
+    JMP: 0,
+    JZ_AT: 1,
+    JNZ_AT: 1,
+    DEC_JNZ: 1,
+}
+
+
+class _Assembler:
+    """Assembles the syntax tree of a program into bytecode."""
+
+    def __init__(self, fuse=True):
+        self.fuse = fuse
+        self.code = []
+        # Offsets of CALL operands, with the name of the called application.
+        self.calls = []
+
+    def emit(self, *words):
+        self.code.extend(words)
+
+    def emit_value(self, node):
+        """Emit instructions leaving the value of an index node in ``a``."""
+        kind = type(node)
+        if kind is Literal:
+            self.emit(LIT, node.value)
+        elif kind is Arg:
+            self.emit(ARG)
+        else:
+            self.emit_value(node.index)
+            self.emit(LOAD)
+
+    def emit_print(self, index, applications, start):
+        """Emit a run of applications with known output as a single PRINT.
+
+        Returns
+        -------
+        : int
+            The offset in ``applications`` after the run, or ``start`` if
+            there is no run to fuse.
+        """
+        run = output_run(applications, start)
+        if run is None:
+            return start
+        end, value, data = run
+        # What the unfused instructions do when the index is out of bounds.
+        warnings = 0
+        fallback = bytearray()
+        for application in applications[start:end]:
+            kind = type(application)
+            if kind is Literal:
+                warnings += 1
+            elif kind is Add:
+                warnings += 2
+            elif application.op == INCREMENT or application.op == DECREMENT:
+                warnings += 2
+            elif application.op == OUTPUT_CHAR:
+                warnings += 1
+                fallback += b"\0"
+            elif application.op == OUTPUT_INT:
+                warnings += 1
+                fallback += b"0"
+        self.emit(PRINT, index, value, warnings, len(data), *data)
+        self.emit(len(fallback), *fallback)
+        return end
+
+    def emit_fused(self, index, application):
+        """Emit a single application at a literal index as a superinstruction.
+
+        Returns
+        -------
+        : bool
+            True if the application was emitted.
+        """
+        kind = type(application)
+        if kind is Add:
+            self.emit(ADD_AT, index, application.amount)
+        elif kind is Literal:
+            self.emit(SET_AT, index, application.value & 0xFF)
+        elif kind is Applicator and type(application.index) is Literal:
+            self.emit(COPY, index, application.index.value)
+        elif kind is Builtin and application.op == INCREMENT:
+            self.emit(ADD_AT, index, 1)
+        elif kind is Builtin and application.op == DECREMENT:
+            self.emit(ADD_AT, index, -1)
+        elif kind is Builtin and application.op == OUTPUT_INT:
+            self.emit(OUTPUT_INT_AT, index)
+        elif kind is Builtin and application.op == OUTPUT_CHAR:
+            self.emit(OUTPUT_CHAR_AT, index)
+        else:
+            return False
+        return True
+
+    def emit_applicator(self, node):
+        # The applications of nested applicators are run before any of the
+        # applications of this one.
+        if type(node.index) is Applicator:
+            self.emit_applicator(node.index)
+        for application in node.applications:
+            if type(application) is Applicator:
+                self.emit_applicator(application)
+
+        # a only needs to be recomputed when an instruction has clobbered it,
+        # or when the index depends on memory that may have changed.
+        stable = type(node.index) is not Applicator
+        literal = self.fuse and type(node.index) is Literal
+        address_ready = False
+        applications = node.applications
+        position = 0
+        while position < len(applications):
+            application = applications[position]
+            if literal:
+                index = node.index.value
+                end = self.emit_print(index, applications, position)
+                if end > position:
+                    position = end
+                    continue
+                position += 1
+                # Superinstructions do not use or change a.
+                if self.emit_fused(index, application):
+                    continue
+            else:
+                position += 1
+
+            kind = type(application)
+            if kind is Applicator:
+                self.emit_value(application)
+                self.emit(PUSH)
+                address_ready = False
+            if not address_ready:
+                self.emit_value(node.index)
+                address_ready = stable
+
+            if kind is Builtin:
+                op = application.op
+                if op == INCREMENT:
+                    self.emit(ADD, 1)
+                elif op == DECREMENT:
+                    self.emit(ADD, -1)
+                elif op == OUTPUT_INT:
+                    self.emit(OUTPUT_INT_OP)
+                elif op == OUTPUT_CHAR:
+                    self.emit(OUTPUT_CHAR_OP)
+                elif op == INPUT:
+                    self.emit(INPUT_OP)
+            elif kind is Add:
+                self.emit(ADD, application.amount)
+            elif kind is Literal:
+                self.emit(SET, application.value)
+            elif kind is Arg:
+                self.emit(SET_ARG)
+            elif kind is Applicator:
+                self.emit(SET_POP)
+            elif kind is Call:
+                self.emit(CALL, 0)
+                self.calls.append((len(self.code) - 1, application.name))
+                address_ready = False
+
+    def emit_conditional(self, node):
+        if self.fuse and type(node.index) is Literal:
+            self.emit_literal_loop(node)
+            return
+        start = len(self.code)
+        if type(node.index) is Applicator:
+            self.emit_applicator(node.index)
+        self.emit_value(node.index)
+        self.emit(JZ, 0)
+        exit_operand = len(self.code) - 1
+        self.emit_statements(node.body)
+        self.emit(JMP, start)
+        self.code[exit_operand] = len(self.code)
+
+    def emit_literal_loop(self, node):
+        """Emit a loop on a literal index, testing the byte at the bottom.
+
+        A body that ends by decrementing the byte is closed by a DEC_JNZ.
+        """
+        index = node.index.value
+        body = node.body
+        decrement = bool(body) and _is_decrement(body[-1], index)
+        if decrement:
+            body = body[:-1]
+        self.emit(JZ_AT, index, 0)
+        exit_operand = len(self.code) - 1
+        start = len(self.code)
+        self.emit_statements(body)
+        self.emit(DEC_JNZ if decrement else JNZ_AT, index, start)
+        self.code[exit_operand] = len(self.code)
+
+    def emit_statements(self, nodes):
+        for node in nodes:
+            if type(node) is Conditional:
+                self.emit_conditional(node)
+            elif type(node) is Applicator:
+                self.emit_applicator(node)
+            else:
+                raise TypeError(f"cannot assemble {type(node).__name__}")
+
+
+def _is_decrement(node, index):
+    """Whether the statement only decrements the byte at a literal index."""
+    if type(node) is not Applicator or type(node.index) is not Literal:
+        return False
+    if node.index.value != index or len(node.applications) != 1:
+        return False
+    application = node.applications[0]
+    if type(application) is Add:
+        return application.amount == -1
+    return type(application) is Builtin and application.op == DECREMENT
+
+
+def assemble(program, fuse=True):
+    """Assemble the syntax tree of a program into bytecode.
+
+    Parameters
+    ----------
+    program : dict
+        Maps application names to lists of statement nodes, as produced by
+        ``build_tree``.
+    fuse : bool
+        If True, use superinstructions where possible.
+
+    Returns
+    -------
+    : list of int
+        The bytecode. Execution starts at offset 0 with the body of main.
+    """
+    assembler = _Assembler(fuse)
+    assembler.emit_statements(program["main"])
+    assembler.emit(HALT)
+
+    entry_points = {}
+    for name, body in program.items():
+        if name == "main":
+            continue
+        entry_points[name] = len(assembler.code)
+        assembler.emit_statements(body)
+        assembler.emit(RET)
+
+    code = assembler.code
+    for offset, name in assembler.calls:
+        try:
+            code[offset] = entry_points[name]
+        except KeyError:
+            raise ApplicationNameError(
+                "Undefined application: " + name + "."
+            ) from None
+    return code
+
+
+def load_string(src, fuse=True):
+    """Preprocess, lex, parse and assemble a Stercus string into bytecode.
+
+    ``fuse`` is passed to ``assemble``.
+    """
+    program = build_tree(parse(lex(preprocess(src))))
+    for name, body in program.items():
+        program[name] = fold_statements(body)
+    return assemble(program, fuse)
+
+
+def load_cli_args(memory, args):
+    """Copy CLI arguments into memory, separated by spaces."""
+    data = " ".join(args).encode()[: len(memory)]
+    memory[: len(data)] = data
+
+
+def decode(code):
+    """Decode bytecode into one ``[opcode, x, y]`` list per instruction.
+
+    ``x`` and ``y`` are the operands of the instruction, or None. Jump
+    targets are rewritten from offsets in the bytecode to positions in the
+    returned list. The operands of PRINT are packed into
+    ``x = (i, value, warnings)`` and ``y = (data, fallback)``.
+    """
+    instructions = []
+    jumps = []
+    positions = {}
+    offset = 0
+    while offset < len(code):
+        op = code[offset]
+        positions[offset] = len(instructions)
+        count = OPERAND_COUNTS.get(op, 0)
+        if count == 0:
+            if op == PRINT:
+                index, value, warnings, count = code[offset + 1 : offset + 5]
+                offset += 5
+                data = bytes(code[offset : offset + count])
+                offset += count
+                count = code[offset]
+                fallback = bytes(code[offset + 1 : offset + 1 + count])
+                offset += 1 + count
+                operands = (index, value, warnings), (data, fallback)
+                instructions.append([op, *operands])
+                continue
+            if not 0 <= op < PRINT:
+                raise ValueError(f"invalid opcode {op} at offset {offset}")
+            instruction = [op, None, None]
+        elif count == 1:
+            instruction = [op, code[offset + 1], None]
+        else:
+            instruction = [op, code[offset + 1], code[offset + 2]]
+        if op in _TARGET_OPERANDS:
+            jumps.append(instruction)
+        instructions.append(instruction)
+        offset += 1 + count
+
+    for instruction in jumps:
+        target = 1 + _TARGET_OPERANDS[instruction[0]]
+        instruction[target] = positions[instruction[target]]
+    return instructions
+
+
+def execute(code, memory, stdin=None, stdout=None, stderr=None):
+    """Execute bytecode on a block of memory.
+
+    Parameters
+    ----------
+    code : list of int
+        Bytecode produced by ``assemble``.
+    memory : bytearray
+        Program memory, modified in place. Bytes hold signed chars in two's
+        complement.
+    stdin, stdout : binary file-like, optional
+        Streams for input and output. Default to the standard streams.
+    stderr : text file-like, optional
+        Stream for out of bounds warnings. Defaults to ``sys.stderr``.
+    """
+    if stdin is None:
+        stdin = sys.stdin.buffer
+    if stdout is None:
+        stdout = sys.stdout.buffer
+    if stderr is None:
+        stderr = sys.stderr
+
+    def warn(index):
+        stderr.write(f"attempted out of bounds access to index {index}\n")
+
+    size = len(memory)
+    output = bytearray()
+
+    def write_output():
+        try:
+            stdout.write(output)
+        finally:
+            output.clear()
+        stdout.flush()
+
+    stack = []
+    frames = []
+    a = 0
+    arg = 0
+
+    # Each handler runs the instruction at position pc, with operands x and
+    # y, and returns the position of the next one, or -1 to stop.
+
+    def lit(pc, x, y):
+        nonlocal a
+        a = x
+        return pc + 1
+
+    def load_arg(pc, x, y):
+        nonlocal a
+        a = arg
+        return pc + 1
+
+    def load(pc, x, y):
+        nonlocal a
+        if 0 <= a < size:
+            a = memory[a]
+            if a > 127:
+                a -= 256
+        else:
+            warn(a)
+            a = 0
+        return pc + 1
+
+    def add(pc, x, y):
+        if 0 <= a < size:
+            memory[a] = (memory[a] + x) & 0xFF
+        else:
+            warn(a)
+            warn(a)
+        return pc + 1
+
+    def set_(pc, x, y):
+        if 0 <= a < size:
+            memory[a] = x & 0xFF
+        else:
+            warn(a)
+        return pc + 1
+
+    def set_arg(pc, x, y):
+        if 0 <= a < size:
+            memory[a] = arg & 0xFF
+        else:
+            warn(a)
+        return pc + 1
+
+    def push(pc, x, y):
+        stack.append(a)
+        return pc + 1
+
+    def set_pop(pc, x, y):
+        value = stack.pop()
+        if 0 <= a < size:
+            memory[a] = value & 0xFF
+        else:
+            warn(a)
+        return pc + 1
+
+    def output_int(pc, x, y):
+        if 0 <= a < size:
+            output.extend(_INT_TEXT[memory[a]])
+        else:
+            warn(a)
+            output.extend(b"0")
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def output_char(pc, x, y):
+        if 0 <= a < size:
+            output.append(memory[a])
+        else:
+            warn(a)
+            output.append(0)
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def input_(pc, x, y):
+        # Flush pending output first in case it prompts for the input.
+        write_output()
+        char = stdin.read(1)
+        if 0 <= a < size:
+            memory[a] = char[0] if char else 0xFF
+        else:
+            warn(a)
+        return pc + 1
+
+    def call(pc, x, y):
+        nonlocal arg
+        frames.append((pc + 1, arg))
+        arg = ((a + 128) & 0xFF) - 128
+        return x
+
+    def ret(pc, x, y):
+        nonlocal arg
+        pc, arg = frames.pop()
+        return pc
+
+    def jz(pc, x, y):
+        if 0 <= a < size:
+            return pc + 1 if memory[a] else x
+        warn(a)
+        return x
+
+    def jmp(pc, x, y):
+        return x
+
+    def halt(pc, x, y):
+        return -1
+
+    # Superinstructions on a literal index, with the index checked once when
+    # choosing the handler. The out of bounds handlers warn as often as the
+    # instructions they replace would.
+
+    def add_at(pc, x, y):
+        memory[x] = (memory[x] + y) & 0xFF
+        return pc + 1
+
+    def set_at(pc, x, y):
+        memory[x] = y
+        return pc + 1
+
+    def copy(pc, x, y):
+        memory[x] = memory[y]
+        return pc + 1
+
+    def output_int_at(pc, x, y):
+        output.extend(_INT_TEXT[memory[x]])
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def output_char_at(pc, x, y):
+        output.append(memory[x])
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def jz_at(pc, x, y):
+        return pc + 1 if memory[x] else y
+
+    def jnz_at(pc, x, y):
+        return y if memory[x] else pc + 1
+
+    def dec_jnz(pc, x, y):
+        value = (memory[x] - 1) & 0xFF
+        memory[x] = value
+        return y if value else pc + 1
+
+    def print_at(pc, x, y):
+        memory[x[0]] = x[1]
+        output.extend(y[0])
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def add_at_out_of_bounds(pc, x, y):
+        warn(x)
+        warn(x)
+        return pc + 1
+
+    def set_at_out_of_bounds(pc, x, y):
+        warn(x)
+        return pc + 1
+
+    def copy_checked(pc, x, y):
+        if 0 <= y < size:
+            value = memory[y]
+        else:
+            warn(y)
+            value = 0
+        if 0 <= x < size:
+            memory[x] = value
+        else:
+            warn(x)
+        return pc + 1
+
+    def output_int_at_out_of_bounds(pc, x, y):
+        warn(x)
+        output.extend(b"0")
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def output_char_at_out_of_bounds(pc, x, y):
+        warn(x)
+        output.append(0)
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    def jz_at_out_of_bounds(pc, x, y):
+        warn(x)
+        return y
+
+    def jnz_at_out_of_bounds(pc, x, y):
+        warn(x)
+        return pc + 1
+
+    def dec_jnz_out_of_bounds(pc, x, y):
+        warn(x)
+        warn(x)
+        warn(x)
+        return pc + 1
+
+    def print_at_out_of_bounds(pc, x, y):
+        for _ in range(x[2]):
+            warn(x[0])
+        output.extend(y[1])
+        if len(output) >= OUTPUT_BUFFER_SIZE:
+            write_output()
+        return pc + 1
+
+    # The handlers for each opcode, in bounds and out of bounds.
+    handlers = {
+        LIT: lit,
+        ARG: load_arg,
+        LOAD: load,
+        ADD: add,
+        SET: set_,
+        SET_ARG: set_arg,
+        PUSH: push,
+        SET_POP: set_pop,
+        OUTPUT_INT_OP: output_int,
+        OUTPUT_CHAR_OP: output_char,
+        INPUT_OP: input_,
+        CALL: call,
+        RET: ret,
+        JZ: jz,
+        JMP: jmp,
+        HALT: halt,
+        ADD_AT: (add_at, add_at_out_of_bounds),
+        SET_AT: (set_at, set_at_out_of_bounds),
+        COPY: (copy, copy_checked),
+        OUTPUT_INT_AT: (output_int_at, output_int_at_out_of_bounds),
+        OUTPUT_CHAR_AT: (output_char_at, output_char_at_out_of_bounds),
+        JZ_AT: (jz_at, jz_at_out_of_bounds),
+        JNZ_AT: (jnz_at, jnz_at_out_of_bounds),
+        DEC_JNZ: (dec_jnz, dec_jnz_out_of_bounds),
+        PRINT: (print_at, print_at_out_of_bounds),
+    }
+
+    ops = []
+    for op, x, y in decode(code):
+        handler = handlers[op]
+        if type(handler) is tuple:
+            if op == PRINT:
+                in_bounds = 0 <= x[0] < size
+            elif op == COPY:
+                in_bounds = 0 <= x < size and 0 <= y < size
+            else:
+                in_bounds = 0 <= x < size
+            handler = handler[0] if in_bounds else handler[1]
+        ops.append((handler, x, y))
+
+    pc = 0
+    try:
+        while pc >= 0:
+            handler, x, y = ops[pc]
+            pc = handler(pc, x, y)
+    finally:
+        write_output()
+
+
+def run_string(src, memory_size=10000, args=(), **kwargs):
+    """Run a Stercus string.
+
+    Parameters
+    ----------
+    src : str
+        String of Stercus code.
+    memory_size : int
+        Number of bytes to use for program memory.
+    args : sequence of str
+        CLI arguments to load into memory before running.
+    **kwargs : dict
+        Keyword arguments are passed to ``execute``.
+
+    Returns
+    -------
+    : bytearray
+        The program memory after the program has finished.
+    """
+    code = load_string(src)
+    memory = bytearray(memory_size)
+    load_cli_args(memory, args)
+    execute(code, memory, **kwargs)
+    return memory
+
+
+def run_file(path, **kwargs):
+    """Run a Stercus file. Keyword arguments are passed to ``run_string``."""
+    with open(path) as f:
+        src = f.read()
+    return run_string(src, **kwargs)
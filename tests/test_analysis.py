@@ -0,0 +1,41 @@
+import stercus
+from stercus.analysis import CHAR_RANGE, arg_ranges, mark_bounds_checks
+
+
+def _tree(src):
+    return stercus.build_tree(stercus.parse(stercus.lex(src)))
+
+
+def test_arg_ranges_literal_calls():
+    program = _tree("{a [$ +]} [3 a] [7 a]")
+    assert arg_ranges(program)["a"] == (3, 7)
+
+
+def test_arg_ranges_through_calls():
+    program = _tree("{a [$ b]} {b [$ +]} {c [$ +]} [3 a]")
+    ranges = arg_ranges(program)
+    assert ranges["b"] == (3, 3)
+    assert ranges["c"] is None
+
+
+def test_arg_ranges_dynamic_index():
+    program = _tree("{a [$ +]} [[0] a]")
+    assert arg_ranges(program)["a"] == CHAR_RANGE
+
+
+def test_arg_ranges_char_conversion():
+    # the index is passed to the application as a char
+    program = _tree("{a [$ +]} [200 a]")
+    assert arg_ranges(program)["a"] == (-56, -56)
+
+
+def test_mark_bounds_checks():
+    program = _tree("{a [$ +]} [3 a] [200 a] (5 [[5] -])")
+    mark_bounds_checks(program, 100)
+    assert program["a"][0].checked
+    assert not program["main"][0].checked
+    assert program["main"][1].checked
+    loop = program["main"][2]
+    assert not loop.checked
+    assert loop.body[0].checked
+    assert not loop.body[0].index.checked
@@ -0,0 +1,84 @@
+import io
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from stercus import batch, vm
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+PROGRAMS = [
+    "[0 ,] [1 ,] (0 [1 +] [0 -]) [1 .]",
+    "[0 ,] (0 [1 [0]] [1 :] [0 -]) [2 3] [[2] -] [3 .]",
+    "{inc [$ +]} {twice [$ inc inc]} [0 ,] [[0] twice] [[0] .] [[0] :]",
+    "{show [$ .]} [0 ,] [0 - - show] [1 ,] ([1] [1 -] [0 show])",
+    "[0 ,] [1 [0]] (1 [2 ,] [2 :] [1 -]) [3 ,] [3 .]",
+    # Writes through a dynamic index move the applications that follow.
+    "[1 1] [[1] + + 5 +] [1 .] [2 .] [6 .] [5 5] [[5] , + :] [5 .]",
+]
+
+
+def _inputs(count, size, seed=0):
+    rng = np.random.default_rng(seed)
+    return [bytes(row) for row in rng.integers(0, 256, (count, size), np.uint8)]
+
+
+def _run_vm(src, input, memory_size):
+    stdout = io.BytesIO()
+    memory = vm.run_string(
+        src, memory_size, stdin=io.BytesIO(input), stdout=stdout, stderr=io.StringIO()
+    )
+    return stdout.getvalue(), bytes(memory)
+
+
+@pytest.mark.parametrize("src", PROGRAMS)
+@pytest.mark.parametrize("optimize", [0, 2])
+def test_batch_matches_vm(src, optimize):
+    inputs = _inputs(40, 4)
+    inputs[0] = b""
+    outputs, memory = batch.run_string(
+        src, inputs, memory_size=300, optimize=optimize, stderr=io.StringIO()
+    )
+    for lane, input in enumerate(inputs):
+        assert (outputs[lane], memory[lane].tobytes()) == _run_vm(src, input, 300)
+
+
+@pytest.mark.parametrize("name", ["add", "multiply", "subtract", "divide"])
+def test_batch_examples(name):
+    src = (EXAMPLES / "math" / f"{name}.cus").read_text()
+    inputs = np.random.default_rng(1).integers(0, 16, (100, 2), np.uint8)
+    outputs, _ = batch.run_string(src, inputs, memory_size=10)
+    for lane, input in enumerate(inputs):
+        assert outputs[lane] == _run_vm(src, input.tobytes(), 10)[0]
+
+
+def test_batch_args_and_size():
+    outputs, memory = batch.run_string("[0 .]", batch_size=3, args=["a"])
+    assert list(outputs) == [b"97"] * 3
+    assert memory.shape == (3, 10000)
+
+
+def test_batch_out_of_bounds():
+    stderr = io.StringIO()
+    src = "[0 ,] [[0] 7] [[0] .]"
+    outputs, memory = batch.run_string(
+        src, [b"\x01", b"\x05"], memory_size=4, stderr=stderr
+    )
+    assert list(outputs) == [b"7", b"0"]
+    assert stderr.getvalue().count("index 5") == 2
+
+
+def test_batch_counted_loop_skips_zero_counts():
+    # The loop becomes a CountedLoop with an out of bounds target, which
+    # is only accessed on the lanes where it runs.
+    src = "[0 ,] (0 [1 + +] [9 +] [0 -]) [1 .]"
+    stderr = io.StringIO()
+    outputs, _ = batch.run_string(src, [b"\0"] * 3, memory_size=5, stderr=stderr)
+    assert list(outputs) == [b"0"] * 3
+    assert stderr.getvalue() == ""
+
+    outputs, _ = batch.run_string(src, [b"\0", b"\3"], memory_size=5, stderr=stderr)
+    assert list(outputs) == [b"0", b"6"]
+    assert "index 9" in stderr.getvalue()
@@ -0,0 +1,56 @@
+import os
+
+from stercus import cache
+from stercus.cache import CompilationCache
+
+
+def test_cache_key_depends_on_options():
+    key = CompilationCache.key(b"[0 +]", memory_size=100, optimize=0)
+    assert key == CompilationCache.key(b"[0 +]", optimize=0, memory_size=100)
+    assert key != CompilationCache.key(b"[0 +]", memory_size=101, optimize=0)
+    assert key != CompilationCache.key(b"[0 -]", memory_size=100, optimize=0)
+
+
+def test_cache_c_source(tmp_path):
+    cache = CompilationCache(tmp_path)
+    key = CompilationCache.key(b"[0 +]", memory_size=100)
+    assert cache.get_c_source(key) is None
+    cache.put_c_source(key, "int main() {}")
+    assert cache.get_c_source(key) == "int main() {}"
+
+
+def test_cache_binary(tmp_path):
+    cache = CompilationCache(tmp_path / "cache")
+    key = CompilationCache.key(b"[0 +]", memory_size=100)
+    binary = tmp_path / "program"
+    binary.write_bytes(b"\x7fELF")
+    assert cache.get_binary(key, "gcc") is None
+    cache.put_binary(key, "gcc", binary)
+    assert cache.get_binary(key, "gcc").read_bytes() == b"\x7fELF"
+    assert cache.get_binary(key, "clang") is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = CompilationCache(tmp_path, max_size=250)
+    keys = [CompilationCache.key(bytes([i])) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.put_c_source(key, "x" * 100)
+        os.utime(tmp_path / key, (i, i))
+
+    # Using the oldest entry makes the other one the least recently used.
+    assert cache.get_c_source(keys[0]) is not None
+    cache.put_c_source(keys[2], "x" * 100)
+
+    assert cache.get_c_source(keys[0]) is not None
+    assert cache.get_c_source(keys[1]) is None
+    assert cache.get_c_source(keys[2]) is not None
+
+
+def test_cache_key_depends_on_compiler(monkeypatch):
+    key = CompilationCache.key(b"[0 +]", memory_size=100)
+    monkeypatch.setattr(cache, "compiler_revision", lambda: "another build")
+    assert key != CompilationCache.key(b"[0 +]", memory_size=100)
+    monkeypatch.undo()
+    assert key == CompilationCache.key(b"[0 +]", memory_size=100)
+    monkeypatch.setattr(cache, "CACHE_FORMAT", cache.CACHE_FORMAT + 1)
+    assert key != CompilationCache.key(b"[0 +]", memory_size=100)
@@ -1,19 +1,29 @@
+import io
 import subprocess
 import tempfile
 
+import pytest
+
 import stercus
 
 
 MEMORY_SIZE = 100
 
 
-def _compile_and_run(app_table, args=None, input=None):
+def _compile_and_run(app_table, args=None, input=None, **kwargs):
     """Compile stercus -> C -> binary and run."""
+    c_src = stercus.compile(app_table, MEMORY_SIZE, **kwargs)
+    # Compiling the applications in parallel must not change the output.
+    assert stercus.compile(app_table, MEMORY_SIZE, jobs=2, **kwargs) == c_src
+    return _run_c(c_src, args=args, input=input)
+
+
+def _run_c(c_src, args=None, input=None):
+    """Compile C -> binary and run."""
     if args is None:
         args = []
 
     with tempfile.TemporaryDirectory() as tmpdir:
-        c_src = stercus.compile(app_table, MEMORY_SIZE)
         c_file = tmpdir + "/test.c"
         with open(c_file, "w") as f:
             f.write(c_src)
@@ -116,3 +126,160 @@ def test_compile_multiple_custom_applications_with_ref():
     }
     out = _compile_and_run(app_table)
     assert out.stdout == "1"
+
+
+def test_compile_elide_bounds_checks():
+    app_table = stercus.parse(stercus.lex("[0 + + .] [1 [0] .]"))
+    c_src = stercus.compile(app_table, MEMORY_SIZE, elide_bounds_checks=True)
+    assert stercus.C_GET_BYTE_NAME + "(0)" not in c_src
+    out = _compile_and_run(app_table, elide_bounds_checks=True)
+    assert out.stdout == "22"
+
+
+def test_compile_elide_bounds_checks_out_of_range():
+    # [0] may hold any value, so accessing [[0]] must stay checked
+    app_table = stercus.parse(stercus.lex("[0 -] [[0] + .]"))
+    out = _compile_and_run(app_table, elide_bounds_checks=True)
+    assert out.stdout == "0"
+    assert "out of bounds" in out.stderr
+
+
+def test_compile_elide_bounds_checks_application():
+    app_table = stercus.parse(stercus.lex("{inc [$ +]} [0 inc inc .]"))
+    c_src = stercus.compile(app_table, MEMORY_SIZE, elide_bounds_checks=True)
+    assert f"{stercus.C_DATA_ARRAY_NAME}[s0]++;" in c_src
+    out = _compile_and_run(app_table, elide_bounds_checks=True)
+    assert out.stdout == "2"
+
+
+def _indexed(template, indices):
+    return " ".join(template.format(*i) for i in indices)
+
+
+@pytest.mark.parametrize(
+    "src,expected",
+    [
+        (_indexed("[{} 7]", [[i] for i in range(3, 9)]), "memset("),
+        (_indexed("[{} {}]", [[i, 65 + i] for i in range(6)]), "memcpy("),
+        # Copies without overlap, downwards over the source and upwards
+        # over the source.
+        (_indexed("[{} [{}]]", [[i + 10, i] for i in range(6)]), "memcpy("),
+        (_indexed("[{} [{}]]", [[i, i + 2] for i in range(6)]), "memmove("),
+        (_indexed("[{} [{}]]", [[i + 2, i] for i in range(6)]), "for("),
+    ],
+)
+def test_compile_bulk_memory(src, expected, monkeypatch):
+    setup = _indexed("[{} {}]", [[i, i + 1] for i in range(20)])
+    show = _indexed("[{} .]", [[i] for i in range(20)])
+    app_table = stercus.parse(stercus.lex(f"{setup} {src} {show}"))
+    c_src = stercus.compile(app_table, MEMORY_SIZE)
+    assert expected in c_src
+
+    # Compare with the applicators compiled one by one.
+    monkeypatch.setattr(stercus.compiler, "BULK_MIN_SIZE", 10**6)
+    reference = stercus.compile(app_table, MEMORY_SIZE)
+    assert expected not in reference.split("int main")[1]
+    assert _run_c(c_src).stdout == _run_c(reference).stdout
+
+
+def test_compile_bulk_memory_out_of_range():
+    src = _indexed("[{} 0]", [[i] for i in range(MEMORY_SIZE - 2, MEMORY_SIZE + 2)])
+    with pytest.raises(stercus.IndexOutOfRangeError):
+        stercus.compile(stercus.parse(stercus.lex(src)), MEMORY_SIZE)
+
+
+@pytest.mark.parametrize("optimize", [0, 3])
+@pytest.mark.parametrize(
+    "src,input",
+    [
+        ("[0 72 :] [0 + :] [1 10 :]", None),
+        ("[0 -128 .] [1 127 .] [2 .] [3 -7 .]", None),
+        ("[0 63 :] [1 , :] [1 .] [2 , .]", "x"),
+        # More output than fits in the buffer.
+        ("[0 65] [1 -1] (1 [2 -1] (2 [3 2] (3 [0 :] [3 -]) [2 -]) [1 -])", None),
+    ],
+)
+def test_compile_buffered_io(src, input, optimize):
+    app_table = stercus.parse(stercus.lex(src))
+    expected = _compile_and_run(app_table, input=input).stdout
+    out = _compile_and_run(
+        app_table, input=input, optimize=optimize, buffered_io=True
+    )
+    assert out.stdout == expected
+
+
+@pytest.mark.parametrize("backing_store", ["heap", "static", "mmap", "auto"])
+def test_compile_backing_store(backing_store):
+    app_table = stercus.parse(stercus.lex("[0 72 :] [1 , :] [2 [0] + .]"))
+    out = _compile_and_run(
+        app_table, args=["ab"], input="c", backing_store=backing_store
+    )
+    assert out.stdout == "Hc73"
+
+
+def test_compile_backing_store_auto():
+    src = stercus.compile_string("[0 +]", 100, backing_store="auto")
+    assert "char _STERCUS_DATA[100];" in src
+    src = stercus.compile_string("[0 +]", 2**24, backing_store="auto")
+    assert "MAP_ANONYMOUS" in src
+
+
+def test_compile_backing_store_file(tmp_path):
+    memory_file = tmp_path / "memory"
+    memory_file.write_bytes(b"old contents")
+    app_table = stercus.parse(stercus.lex("[1 , -] [3 -2]"))
+    out = _compile_and_run(
+        app_table,
+        args=["xy"],
+        input="b",
+        backing_store="file",
+        memory_file=str(memory_file),
+    )
+    assert out.returncode == 0
+    assert memory_file.read_bytes() == b"xa\0\xfe" + bytes(MEMORY_SIZE - 4)
+
+
+def test_compile_backing_store_file_missing():
+    with pytest.raises(ValueError):
+        stercus.compile_string("[0 +]", 100, backing_store="file")
+
+
+@pytest.mark.parametrize("optimize", [0, 2, 3])
+def test_compile_stream(optimize):
+    src = """# stream
+    {inc [$ +]}
+    [0 inc inc .]
+    {dec [$ -]}
+    [1 5] (1 [0 inc] [1 dec]) [0 .]
+    """
+    app_table = stercus.parse(stercus.lex(stercus.preprocess(src)))
+    expected = _compile_and_run(app_table).stdout
+
+    out = io.StringIO()
+    lines = io.StringIO(src)
+    stercus.compile_stream(lines, out, MEMORY_SIZE, optimize=optimize)
+    assert _run_c(out.getvalue()).stdout == expected == "27"
+
+
+def test_compile_stream_main_blocks(monkeypatch):
+    monkeypatch.setattr(stercus.compiler, "MAIN_BLOCK_SIZE", 2)
+    out = io.StringIO()
+    lines = ["[0 +] [0 +]\n", "[0 + .]\n", "[1 [0] .]"]
+    stercus.compile_stream(lines, out, MEMORY_SIZE)
+    assert "_stercus_main_1();" in out.getvalue()
+    assert _run_c(out.getvalue()).stdout == "33"
+
+
+@pytest.mark.parametrize("jobs", [0, 3])
+def test_compile_parallel(jobs):
+    # Application names may only contain letters.
+    names = ["a" + "".join(chr(ord("a") + int(d)) for d in str(i)) for i in range(200)]
+    src = "".join(
+        f"{{{name} [$ {i % 100}] [{i % 50} [$]]}}\n" for i, name in enumerate(names)
+    )
+    src += "".join(f"[{i % 50} {names[i]}]\n" for i in range(0, 200, 7))
+    src += "[28 .] [21 .]"
+    app_table = stercus.parse(stercus.lex(src))
+    c_src = stercus.compile(app_table, MEMORY_SIZE, jobs=jobs, optimize=1)
+    assert c_src == stercus.compile(app_table, MEMORY_SIZE, optimize=1)
+    assert _run_c(c_src).stdout == "2821"
@@ -0,0 +1,70 @@
+import pytest
+
+import stercus
+from stercus.evaluator import *
+from stercus.nodes import *
+from stercus.optimizer import optimize
+
+from test_compiler import MEMORY_SIZE, _compile_and_run
+
+
+def _tree(src):
+    return stercus.build_tree(stercus.parse(stercus.lex(src)))
+
+
+def test_evaluate_whole_program():
+    program = _tree("[3 72 :] [4 3] (4 [3 + :] [4 -]) [3 .]")
+    assert evaluate_prefix(program, MEMORY_SIZE) == 4
+    assert program["main"] == [
+        Preset(3, bytes([75, 0])),
+        Print(b"HIJK75"),
+    ]
+
+
+def test_evaluate_stops_at_input():
+    program = _tree("[0 5 .] [0 , .] [1 7]")
+    assert evaluate_prefix(program, MEMORY_SIZE) == 1
+    assert program["main"][:2] == [Preset(0, b"\x05"), Print(b"5")]
+    assert len(program["main"]) == 4
+
+
+def test_evaluate_stops_at_unwritten_byte():
+    # Bytes not written by the program may hold the CLI arguments.
+    program = _tree("[0 1] [1 +] [0 2]")
+    assert evaluate_prefix(program, MEMORY_SIZE) == 1
+    assert program["main"][0] == Preset(0, b"\x01")
+    assert program["main"][1:] == _tree("[1 +] [0 2]")["main"]
+
+
+def test_evaluate_undoes_partial_statement():
+    program = _tree("[0 1] [0 2 [1] :]")
+    assert evaluate_prefix(program, MEMORY_SIZE) == 1
+    assert program["main"] == [Preset(0, b"\x01")] + _tree("[0 2 [1] :]")["main"]
+
+
+def test_evaluate_calls_and_inlined():
+    src = "{a [$ 5 +]} {b [$ a a]} [2 b .] [[2] b]"
+    for level in (0, 2):
+        program = optimize(_tree(src), level)
+        assert evaluate_prefix(program, 100) == 2
+        assert program["main"] == [
+            Preset(2, b"\x06"),
+            Preset(6, b"\x06"),
+            Print(b"6"),
+        ]
+
+
+def test_evaluate_stops_out_of_bounds():
+    program = _tree("[0 99] [[0] +]")
+    assert evaluate_prefix(program, 50) == 1
+
+
+def test_evaluate_stops_on_infinite_loop():
+    program = _tree("[0 1] (0 [1 0])")
+    assert evaluate_prefix(program, MEMORY_SIZE, max_steps=1000) == 1
+
+
+def test_preset_keeps_cli_args():
+    app_table = stercus.parse(stercus.lex("[5 65] [0 :] [5 :]"))
+    out = _compile_and_run(app_table, args=["Z"], optimize=3)
+    assert out.stdout == "ZA"
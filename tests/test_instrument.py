@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+
+import stercus
+from stercus import heatmap
+from stercus.instrument import *
+from stercus.nodes import *
+
+SRC = """# multiply
+{inc [$ +]}
+[0 5] [1 7]
+(0
+  [2 [1]]
+  (2 [3 inc] [2 -])
+[0 -])
+[3 .]
+"""
+
+
+def _tree(src):
+    return stercus.build_tree(stercus.parse(list(stercus.tokenize(src))))
+
+
+def test_instrument_counters():
+    program = _tree("{f [$ +]} [0 f] (0 [0 -])")
+    counters = instrument(program)
+    assert [(c["kind"], c["application"], c["name"]) for c in counters] == [
+        ("applicator", "f", ""),
+        ("call", "main", "f"),
+        ("applicator", "main", ""),
+        ("loop", "main", ""),
+        ("applicator", "main", ""),
+    ]
+    assert program["main"][0].applications == [Count(2), Count(1), Call("f")]
+    assert program["main"][1].body[0] == Count(3)
+
+
+def test_instrumented_program_counts(tmp_path):
+    c_src = stercus.compile_string(SRC, 100, instrument_counts=True)
+    c_file = tmp_path / "program.c"
+    c_file.write_text(c_src)
+    binary = tmp_path / "program"
+    subprocess.run(["gcc", "-o", binary, c_file], check=True)
+    counts_file = tmp_path / "counts.json"
+    env = dict(os.environ, STERCUS_COUNTS_FILE=str(counts_file))
+    out = subprocess.run([binary], env=env, capture_output=True, text=True)
+    assert out.stdout == "35"
+
+    counters = load_counts(counts_file)
+    counts = {(c["kind"], c["line"], c["column"]): c["count"] for c in counters}
+    assert counts[("loop", 4, 1)] == 5
+    assert counts[("loop", 6, 3)] == 35
+    assert counts[("call", 6, 9)] == 35
+    assert counts[("applicator", 2, 6)] == 35
+    assert counts[("applicator", 8, 1)] == 1
+
+
+def test_heatmap():
+    counters = [
+        {"kind": "loop", "application": "main", "name": "", "line": 2,
+         "column": 1, "count": 1000},
+        {"kind": "call", "application": "main", "name": "f", "line": 3,
+         "column": 4, "count": 10},
+    ]
+    lines = heatmap.render("# comment\n(0\n[0 f])\n", counters).splitlines()
+    assert lines[0].strip() == "| # comment"
+    assert lines[1].split() == ["1000", "████████", "|", "(0"]
+    assert lines[2].split()[:2] == ["10", "██▆"]
+    assert heatmap.hot_spots(counters, 1) == counters[:1]
+    assert "main -> f" in heatmap.format_hot_spots(counters)
@@ -0,0 +1,67 @@
+import io
+import subprocess
+
+import pytest
+
+from stercus import jit, vm
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return tmp_path / "cache"
+
+
+@pytest.mark.parametrize(
+    "src, input",
+    [
+        ("[0 ,] [0 + :] [1 33] [1 :]", b"a"),
+        ("[0 ,] [0 .]", b""),
+        ("{inc [$ +]} [0 5] (0 [1 inc inc] [0 -]) [1 .]", b""),
+        ("[0 3] (0 [1 72] [1 :] [2 105] [2 :] [0 -])", b""),
+    ],
+)
+@pytest.mark.parametrize("optimize", [0, 3])
+def test_jit_matches_vm(src, input, optimize, cache_dir):
+    output, memory = jit.run_string(
+        src, 100, input=input, optimize=optimize, cache_dir=cache_dir
+    )
+    stdout = io.BytesIO()
+    expected = vm.run_string(
+        src, 100, stdin=io.BytesIO(input), stdout=stdout, stderr=io.StringIO()
+    )
+    assert output == stdout.getvalue()
+    assert memory == expected
+
+
+def test_jit_memory_and_args(cache_dir):
+    program = jit.compile("[2 [0]] [2 +] [2 :]", 10, cache_dir=cache_dir)
+    memory = bytearray(10)
+    assert program.run(memory, args=["ab"]) == b"b"
+    assert memory[:3] == b"abb"
+
+    # Each run starts from the memory it is given.
+    assert program.run(bytearray(10), args=["x"]) == b"y"
+    with pytest.raises(ValueError):
+        program.run(bytearray(5))
+
+
+def test_jit_large_output(cache_dir):
+    src = "[0 100] (0 [1 100] (1 [2 100] (2 [3 :] [2 -]) [1 -]) [0 -])"
+    assert jit.compile(src, 10, cache_dir=cache_dir).run() == b"\0" * 10**6
+
+
+def test_jit_cached(cache_dir, monkeypatch):
+    src = "[0 7] [0 .]"
+    program = jit.compile(src, 10, cache_dir=cache_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the C compiler was called")
+
+    monkeypatch.setattr(subprocess, "run", fail)
+    cached = jit.compile(src, 10, cache_dir=cache_dir)
+    assert cached.path == program.path
+    assert cached.run() == b"7"
+
+    # Different options are compiled separately.
+    with pytest.raises(AssertionError):
+        jit.compile(src, 10, cache_dir=cache_dir, optimize=1)
@@ -64,3 +64,40 @@ def test_lex_multiple_custom_application():
         "]",
     ]
     assert stercus.lex(program) == expected
+
+
+def test_tokenize_matches_lex():
+    program = "{a [$ +]}\n  (0 [1 a .]\n[0 -])"
+    texts = [text for text, _, _ in stercus.tokenize(program)]
+    assert texts == stercus.lex(program)
+
+
+def test_tokenize_positions():
+    program = "[0 +]\n  (10\t[1])"
+    tokens = stercus.tokenize(program)
+    positions = [(line, column) for _, line, column in tokens]
+    expected = [
+        (1, 1),
+        (1, 2),
+        (1, 4),
+        (1, 5),
+        (2, 3),
+        (2, 4),
+        (2, 7),
+        (2, 8),
+        (2, 9),
+        (2, 10),
+    ]
+    assert positions == expected
+
+
+def test_tokenize_is_lazy():
+    tokens = stercus.tokenize("[0 +]")
+    assert next(tokens) == ("[", 1, 1)
+    assert next(tokens) == ("0", 1, 2)
+
+
+def test_lex_stream_split_tokens():
+    program = "{abc [$ +]}\n[10 abc 120 .]"
+    chunks = [program[i : i + 3] for i in range(0, len(program), 3)]
+    assert list(stercus.lexer.lex_stream(chunks)) == stercus.lex(program)
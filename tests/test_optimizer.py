@@ -0,0 +1,207 @@
+from pathlib import Path
+
+import pytest
+
+import stercus
+from stercus.nodes import *
+from stercus.optimizer import *
+
+from test_compiler import _compile_and_run
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+PROGRAMS = [
+    ("[3 + + + + + .]", None),
+    ("[3 5 + + - .] [3 + :]", None),
+    ("[0 5 7 .] [0 200 + .]", None),
+    ("[0 , , :] [1 + 9 . - - .]", "ab"),
+    ("[0 3] (0 [1 + + +] [0 -]) [1 .]", None),
+    ("{a [$ 5 + +]} [0 a + .] [1 [0] + + .]", None),
+    ("[0 200] (0 [0 +] [1 + + +] [2 -]) [1 .] [2 .] [0 .]", None),
+    ("[0 7] [1 3] (0 [0 -] [1 -]) [1 .] ([1] [[1] -]) [1 .]", None),
+    ("{clr ($ [$ -])} [5 9 clr .] (5 [6 +]) [6 .]", None),
+    ("{a [$ 5]} {b [$ a +]} [3 b .] [[3] b] [8 .]", None),
+    ("{f ([$] [$ -] [1 +] [$ g])} {g [$ f]} [0 4 f] [1 .]", None),
+    ("{v [$ +]} [0 2] [[0] v v] [2 .] [0 [1 v]] [0 .]", None),
+    ("[0 [1 +] 4 .] [0 + .] [1 .]", None),
+    ("[0 34 :] [1 92 :] [2 10 :] [3 63 : : :] [4 , :] [4 .] [1 .]", "x"),
+    ("[0 72 :] [1 -3] (1 [1 +] [0 + :]) [1 .]", None),
+    # The index is read again before each application, so writing to the
+    # byte it is read from moves the applications that follow.
+    ("[1 1] [[1] + +] [1 .] [2 .] [3 .]", None),
+    ("[1 1] [[1] 5 +] [1 .] [5 .] [6 .]", None),
+]
+
+
+def _tree(src):
+    return stercus.build_tree(stercus.parse(stercus.lex(src)))
+
+
+def _run(src, input=None, **kwargs):
+    app_table = stercus.parse(stercus.lex(stercus.preprocess(src)))
+    return _compile_and_run(app_table, input=input, **kwargs).stdout
+
+
+def test_fold_increments():
+    program = optimize(_tree("[3 + + + + +]"))
+    assert program["main"] == [Applicator(Literal(3), [Add(5)])]
+
+
+def test_fold_decrements_cancel():
+    program = optimize(_tree("[3 + + - - .]"))
+    assert program["main"] == [Applicator(Literal(3), [Builtin(".")])]
+
+
+def test_fold_assignment_and_increments():
+    program = optimize(_tree("[3 127 + + .]"))
+    assert program["main"] == [
+        Applicator(Literal(3), [Literal(-127), Builtin(".")])
+    ]
+
+
+def test_fold_dead_stores():
+    program = optimize(_tree("[3 + 5 . 6 7 , :]"))
+    assert program["main"] == [
+        Applicator(Literal(3), [Literal(5), Builtin("."), Builtin(","), Builtin(":")])
+    ]
+
+
+def test_fold_merges_applicators():
+    program = optimize(_tree("[3 5] [3 + +] [4 +]"))
+    assert program["main"] == [
+        Applicator(Literal(3), [Literal(7)]),
+        Applicator(Literal(4), [Add(1)]),
+    ]
+
+
+def test_fold_keeps_nested_effects_in_order():
+    # [1 +] runs before [0 4], so the applicators must not be merged.
+    program = optimize(_tree("[0 4] [0 [1 +]]"))
+    assert len(program["main"]) == 2
+
+
+def test_fold_keeps_writes_through_dynamic_index():
+    program = optimize(_tree("[1 1] [[1] + + 3 4]"))
+    assert program["main"][1] == Applicator(
+        Applicator(Literal(1), []), [Add(1), Add(1), Literal(3), Literal(4)]
+    )
+    assert _run("[1 1] [[1] + +] [1 .] [2 .] [3 .]", optimize=1) == "210"
+
+
+def test_level_zero_does_nothing():
+    program = optimize(_tree("[3 + +]"), level=0)
+    assert program["main"] == _tree("[3 + +]")["main"]
+
+
+def test_counted_loop_move():
+    program = optimize(_tree("(0 [1 +] [0 -])"), level=2)
+    assert program["main"] == [CountedLoop(Literal(0), -1, [(1, 1)])]
+
+
+def test_counted_loop_multiply_accumulate():
+    program = optimize(_tree("(0 [0 +] [1 + + +] [2 -] [1 +])"), level=2)
+    assert program["main"] == [CountedLoop(Literal(0), 1, [(1, 4), (2, -1)])]
+
+
+def test_counted_loop_clear():
+    program = _tree("{a ($ [$ -])} ([0] [[0] -])")
+    body = replace_loop_idioms(fold_statements(program["a"]))
+    assert body == [CountedLoop(Arg(), -1, [])]
+    main = replace_loop_idioms(fold_statements(program["main"]))
+    assert type(main[0]) is Conditional
+
+
+def test_counted_loop_nested():
+    # multiply.cus: the inner loop becomes arithmetic, the outer one stays
+    program = optimize(_tree("(0 [2 [1]] (2 [3 +] [2 -]) [0 -])"), level=2)
+    outer = program["main"][0]
+    assert type(outer) is Conditional
+    assert outer.body[1] == CountedLoop(Literal(2), -1, [(3, 1)])
+
+
+def test_counted_loop_rejects_other_steps():
+    program = optimize(_tree("(0 [1 +] [0 - -])"), level=2)
+    assert type(program["main"][0]) is Conditional
+
+
+def test_inline_specializes_literal_index():
+    program = optimize(_tree("{a [$ 5]} {b [$ a +]} [3 b .]"), level=2)
+    assert list(program) == ["main"]
+    assert program["main"] == [
+        Applicator(Literal(3), [Literal(6), Builtin(".")])
+    ]
+
+
+def test_inline_dynamic_index():
+    program = optimize(_tree("{a [$ +]} [[0] a] [[1] a]"), level=2)
+    inlined = program["main"][0].applications[0]
+    assert inlined.variable is not None
+    assert inlined.body == [Applicator(Local(inlined.variable), [Add(1)])]
+
+
+def test_inline_size_budget():
+    big = "{big " + "[$ +] [0 .] " * 20 + "}"
+    program = optimize(_tree(big + "[1 big] [2 big]"), level=2)
+    assert "big" in program
+    assert program["main"][0].applications == [Call("big")]
+
+
+def test_inline_skips_recursion():
+    src = "{f ([$] [$ -] [1 +] [$ g])} {g [$ f]} {h [$ +]} [0 3 f h]"
+    program = optimize(_tree(src), level=2)
+    assert set(program) == {"main", "f", "g"}
+    calls = program["main"][0].applications
+    assert calls[1] == Call("f")
+    # h is inlined and folded back into the applicator.
+    assert calls[2] == Add(1)
+
+
+def test_strongly_connected_components():
+    graph = {"main": ["a", "b"], "a": ["b"], "b": ["c"], "c": ["b"]}
+    components = strongly_connected_components(graph)
+    assert [sorted(c) for c in components] == [["b", "c"], ["a"], ["main"]]
+
+
+@pytest.mark.parametrize("level", [1, 2, 3])
+@pytest.mark.parametrize("src,input", PROGRAMS)
+def test_optimize_preserves_output(src, input, level):
+    assert _run(src, input, optimize=level) == _run(src, input)
+
+
+@pytest.mark.parametrize(
+    "path,input",
+    [
+        ("math/add.cus", "\x05\x07"),
+        ("math/divide.cus", None),
+        ("math/multiply.cus", "\x05\x07"),
+        ("simple/application.cus", None),
+        ("simple/hello_world.cus", None),
+        ("simple/variable.cus", None),
+    ],
+)
+@pytest.mark.parametrize("level", [1, 2, 3])
+def test_optimize_preserves_example_output(path, input, level):
+    src = (EXAMPLES / path).read_text()
+    expected = _run(src, input)
+    assert _run(src, input, optimize=level) == expected
+    assert (
+        _run(src, input, optimize=level, elide_bounds_checks=True) == expected
+    )
+
+
+def test_output_run():
+    applications = [
+        Builtin(INPUT),
+        Literal(72),
+        Builtin(OUTPUT_CHAR),
+        Add(-3),
+        Builtin(INCREMENT),
+        Builtin(OUTPUT_INT),
+        Builtin(OUTPUT_CHAR),
+        Literal(-1),
+        Builtin(INPUT),
+    ]
+    assert output_run(applications, 0) is None
+    assert output_run(applications, 1) == (8, 255, b"H70F")
+    # A run without output is left alone.
+    assert output_run([Literal(1), Add(2)], 0) is None
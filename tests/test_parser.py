@@ -1,5 +1,6 @@
 import pytest
 import stercus
+from stercus.nodes import *
 
 
 def test_parse_applicator():
@@ -77,3 +78,92 @@ def test_parse_custom_application_nested():
     ]
     with pytest.raises(stercus.UnbalancedBracketsError):
         stercus.parse(tokens)
+
+
+def test_parse_multiple_custom_applications():
+    # [0 a] {a [$ +]} [1 b] {b [$ -]} [2]
+    tokens = stercus.lex("[0 a] {a [$ +]} [1 b] {b [$ -]} [2]")
+    expected = {
+        "a": ["[", "s0", "+", "]"],
+        "b": ["[", "s0", "-", "]"],
+        "main": ["[", "0", "a", "]", "[", "1", "b", "]", "[", "2", "]"],
+    }
+    assert stercus.parse(tokens) == expected
+
+
+def test_parse_custom_application_duplicate():
+    tokens = stercus.lex("{a [$ +]} {a [$ -]}")
+    with pytest.raises(stercus.ApplicationNameError):
+        stercus.parse(tokens)
+
+
+def test_parse_unclosed_brackets():
+    tokens = ["(", "0", "[", "1", "+", "]"]
+    with pytest.raises(stercus.UnbalancedBracketsError):
+        stercus.parse(tokens)
+
+
+def test_parse_mismatched_brackets():
+    tokens = ["(", "0", "[", "1", "+", ")", "]"]
+    with pytest.raises(stercus.UnbalancedBracketsError):
+        stercus.parse(tokens)
+
+
+def test_parse_keeps_token_positions():
+    applications = stercus.parse(stercus.tokenize("{a\n  [$ +]}"))
+    assert applications["a"][1] == (stercus.C_FUNC_ARG_NAME, 2, 4)
+
+
+def test_build_tree_applicator():
+    # [0 + 5 [1]]
+    tree = stercus.build_tree({"main": ["[", "0", "+", "5", "[", "1", "]", "]"]})
+    expected = {
+        "main": [
+            Applicator(
+                Literal(0),
+                [Builtin("+"), Literal(5), Applicator(Literal(1), [])],
+            )
+        ]
+    }
+    assert tree == expected
+
+
+def test_build_tree_conditional():
+    # ([0] (1) [$ a])
+    tokens = ["(", "[", "0", "]", "(", "1", ")", "[", "s0", "a", "]", ")"]
+    tree = stercus.build_tree({"main": tokens})
+    expected = {
+        "main": [
+            Conditional(
+                Applicator(Literal(0), []),
+                [
+                    Conditional(Literal(1), []),
+                    Applicator(Arg(), [Call("a")]),
+                ],
+            )
+        ]
+    }
+    assert tree == expected
+
+
+def test_build_tree_positions():
+    tree = stercus.build_tree(stercus.parse(stercus.tokenize("\n  (0 [1 +])")))
+    conditional = tree["main"][0]
+    assert (conditional.line, conditional.column) == (2, 3)
+    applicator = conditional.body[0]
+    assert (applicator.line, applicator.column) == (2, 6)
+
+
+def test_build_tree_missing_index():
+    with pytest.raises(stercus.ExpressionError):
+        stercus.build_tree({"main": ["[", "]"]})
+
+
+def test_build_tree_bare_token():
+    with pytest.raises(stercus.ExpressionError):
+        stercus.build_tree({"main": ["(", "0", "5", ")"]})
+
+
+def test_build_tree_conditional_in_applicator():
+    with pytest.raises(stercus.ExpressionError):
+        stercus.build_tree({"main": ["[", "0", "(", "1", ")", "]"]})
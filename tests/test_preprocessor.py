@@ -1,3 +1,5 @@
+import pytest
+
 import stercus
 
 
@@ -11,3 +13,29 @@ def test_preprocess_comment_end_of_line():
     program = "[0 1] # Comment following code."
     expected = "[0 1]"
     assert stercus.preprocess(program) == expected
+
+
+def test_preprocess_multi_line_comment():
+    program = "[0 +] ## A comment\nover [1 +]\nlines ## [2 +]"
+    expected = "[0 +] \n\n  [2 +]"
+    assert stercus.preprocess(program) == expected
+
+
+def test_preprocess_multi_line_comment_inline():
+    program = "[0 ## one ## 1] # rest"
+    assert stercus.lex(stercus.preprocess(program)) == ["[", "0", "1", "]"]
+
+
+def test_preprocess_unterminated_comment():
+    with pytest.raises(stercus.UnterminatedCommentError):
+        stercus.preprocess("[0 +] ## never closed\n[1 +]")
+
+
+def test_preprocess_stream_keeps_lines():
+    lines = ["# header\n", "##\n", "[0 +]\n", "##[1 +] # one\n", "[2 +]"]
+    src = "".join(stercus.preprocess_stream(lines))
+    tokens = list(stercus.tokenize(src))
+    assert [(text, line) for text, line, _ in tokens if text.isdigit()] == [
+        ("1", 4),
+        ("2", 5),
+    ]
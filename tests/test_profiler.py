@@ -0,0 +1,42 @@
+import io
+
+import stercus
+
+
+SRC = "# add\n{inc [$ +]} [0 inc inc .]"
+
+
+def test_profile_stages():
+    profile = stercus.Profile()
+    c_src = stercus.compile_string(SRC, 100, profile=profile)
+    assert c_src == stercus.compile_string(SRC, 100)
+
+    stages = profile.as_dict()["stages"]
+    assert list(stages) == ["preprocess", "lex", "parse", "compile"]
+    assert stages["lex"]["tokens"] == 13
+    assert stages["parse"]["applications"] == 1
+    assert stages["compile"]["c_bytes"] == len(c_src)
+    for record in stages.values():
+        assert record["seconds"] >= 0
+        assert record["peak_memory"] >= 0
+
+
+def test_profile_without_memory():
+    profile = stercus.Profile(memory=False)
+    stercus.compile_string(SRC, 100, profile=profile)
+    assert all(r["peak_memory"] is None for r in profile.stages.values())
+
+
+def test_profile_hooks():
+    calls = []
+    profile = stercus.Profile(hooks=[lambda name, record: calls.append(name)])
+    stercus.compile_stream(io.StringIO(SRC), io.StringIO(), 100, profile=profile)
+    assert calls == ["stream"]
+
+
+def test_profile_format():
+    profile = stercus.Profile()
+    stercus.compile_string(SRC, 100, profile=profile)
+    report = profile.format()
+    assert "tokens=13" in report
+    assert report.splitlines()[-1].startswith("total")
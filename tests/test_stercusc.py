@@ -0,0 +1,114 @@
+import sys
+
+import pytest
+
+from stercus import stercusc
+
+
+def _main(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["stercusc", "--no-cache", *args])
+    return stercusc.main()
+
+
+@pytest.fixture
+def sources(tmp_path):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.cus").write_text("[0 + .]")
+    (src / "sub" / "b.cus").write_text("{b [$ -]} [0 b .]")
+    return src
+
+
+def test_stercusc_single_file(monkeypatch, sources, tmp_path):
+    output = tmp_path / "out"
+    assert _main(monkeypatch, str(sources / "a.cus"), "-o", str(output)) == 0
+    assert "int main" in (tmp_path / "out.c").read_text()
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_stercusc_directory(monkeypatch, sources, tmp_path, jobs):
+    out = tmp_path / "out"
+    assert _main(monkeypatch, str(sources), "-o", str(out), "-j", jobs) == 0
+    assert (out / "a.c").exists()
+    assert (out / "sub" / "b.c").exists()
+
+
+def test_stercusc_reports_all_errors(monkeypatch, sources, tmp_path, capsys):
+    (sources / "bad_index.cus").write_text("[100 +]")
+    (sources / "bad_brackets.cus").write_text("[0 +")
+    out = tmp_path / "out"
+    args = [str(sources), "-o", str(out), "-m", "100", "-j", "2"]
+    assert _main(monkeypatch, *args) == 1
+
+    err = capsys.readouterr().err
+    assert "2 of 4 files failed" in err
+    assert "bad_index.cus: IndexOutOfRangeError" in err
+    assert "bad_brackets.cus: UnbalancedBracketsError" in err
+    assert (out / "a.c").exists()
+
+
+def test_stercusc_stream(monkeypatch, sources, tmp_path):
+    out = tmp_path / "out"
+    assert _main(monkeypatch, str(sources), "-o", str(out), "--stream") == 0
+    assert "_stercus_main_0();" in (out / "sub" / "b.c").read_text()
+
+
+def test_stercusc_memory_file(monkeypatch, sources, tmp_path):
+    output = tmp_path / "out"
+    args = [str(sources / "a.cus"), "-o", str(output), "--memory-file", "mem"]
+    assert _main(monkeypatch, *args) == 0
+    assert "MAP_SHARED" in (tmp_path / "out.c").read_text()
+
+
+def test_stercusc_duplicate_outputs(monkeypatch, sources, tmp_path, capsys):
+    other = tmp_path / "other"
+    (other / "sub").mkdir(parents=True)
+    (other / "a.cus").write_text("[0 -]")
+    (other / "sub" / "b.cus").write_text("[0 -]")
+    out = tmp_path / "out"
+    files = [str(sources / "a.cus"), str(other / "a.cus")]
+    for args in (files, [str(sources), str(other)]):
+        with pytest.raises(SystemExit):
+            _main(monkeypatch, *args, "-o", str(out), "-j", "4")
+        assert "would both be compiled to" in capsys.readouterr().err
+    assert not out.exists()
+
+
+def test_stercusc_negative_jobs(monkeypatch, sources, capsys):
+    with pytest.raises(SystemExit):
+        _main(monkeypatch, str(sources), "-j", "-1")
+    assert "must be at least 0" in capsys.readouterr().err
+
+
+def test_stercusc_backing_store_file_needs_memory_file(monkeypatch, sources):
+    with pytest.raises(SystemExit):
+        _main(monkeypatch, str(sources / "a.cus"), "--backing-store", "file")
+
+
+def test_stercusc_profile(monkeypatch, sources, tmp_path, capsys):
+    out = tmp_path / "out"
+    args = [str(sources), "-o", str(out), "--profile", "-j", "2"]
+    assert _main(monkeypatch, *args) == 0
+    err = capsys.readouterr().err
+    assert "a.cus:" in err and "b.cus:" in err
+    assert err.count("c_bytes=") == 2
+
+
+def test_stercusc_units(monkeypatch, sources, tmp_path):
+    out = tmp_path / "out"
+    args = [str(sources / "sub" / "b.cus"), "-o", str(out), "--units", "-c", "gcc"]
+    assert _main(monkeypatch, *args) == 0
+    assert (out / "app_b.c").exists()
+    assert (out / "program").exists()
+
+
+def test_stercusc_units_instrument(monkeypatch, sources):
+    with pytest.raises(SystemExit):
+        _main(monkeypatch, str(sources / "a.cus"), "--units", "--instrument")
+
+
+def test_stercusc_single_file_jobs(monkeypatch, sources, tmp_path):
+    output = tmp_path / "out"
+    args = [str(sources / "sub" / "b.cus"), "-o", str(output), "-j", "2"]
+    assert _main(monkeypatch, *args) == 0
+    assert "void b(char s0)" in (tmp_path / "out.c").read_text()
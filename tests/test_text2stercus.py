@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+import stercus
+from stercus import vm
+from stercus.constants import C_PUT_CHAR_NAME, C_WRITE_NAME
+from stercus.text2stercus import parse as text2stercus
+
+from test_compiler import _compile_and_run
+
+TEXTS = ["Hello, world!", "====  banner  ====\n", "héllo\tzz", ""]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("encoding", ["literal", "delta"])
+@pytest.mark.parametrize("optimize", [0, 2])
+def test_text2stercus_outputs_text(text, encoding, optimize):
+    src = text2stercus(text, encoding)
+    app_table = stercus.parse(stercus.lex(src))
+    assert _compile_and_run(app_table, optimize=optimize).stdout == text
+
+    stdout = io.BytesIO()
+    vm.run_string(src, memory_size=10, stdout=stdout)
+    assert stdout.getvalue() == text.encode()
+
+
+def test_text2stercus_delta_is_shorter():
+    text = "=" * 40 + "\n" + "ab" * 20
+    assert text2stercus(text, "delta") == (
+        "[0 61 :" + " :" * 39 + " 10 : 97 :" + " + : - :" * 19 + " + :]"
+    )
+    assert len(text2stercus(text, "delta")) < len(text2stercus(text)) * 2 / 3
+
+
+def test_text2stercus_unknown_encoding():
+    with pytest.raises(ValueError):
+        text2stercus("a", "base64")
+
+
+@pytest.mark.parametrize("encoding", ["literal", "delta"])
+def test_text2stercus_compiles_to_one_write(encoding):
+    src = text2stercus("The quick brown fox jumps over the lazy dog.", encoding)
+    c_src = stercus.compile(stercus.parse(stercus.lex(src)), 10)
+    main = c_src[c_src.index("int main") :]
+    assert main.count(C_WRITE_NAME + "(") == 1
+    assert C_PUT_CHAR_NAME not in main
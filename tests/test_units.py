@@ -0,0 +1,121 @@
+import json
+import subprocess
+
+import pytest
+
+import stercus
+from stercus import units
+
+
+MEMORY_SIZE = 100
+
+SRC = """# units
+{inc [$ +]}
+[0 inc inc .]
+{dec [$ -]}
+[1 5] (1 [0 inc] [1 dec]) [0 .]
+"""
+
+
+def _compile_units(src, out_dir, **kwargs):
+    tokens = stercus.lex(stercus.preprocess(src))
+    return stercus.compile_units(
+        stercus.parse_stream(tokens), out_dir, MEMORY_SIZE, **kwargs
+    )
+
+
+def _build_and_run(out_dir, input=None):
+    subprocess.run(["make", "-s", "-C", str(out_dir), "CC=gcc"], check=True)
+    return subprocess.run(
+        [str(out_dir / "program")],
+        input=input,
+        capture_output=True,
+        encoding="utf-8",
+    ).stdout
+
+
+@pytest.mark.parametrize("optimize", [0, 2, 3])
+@pytest.mark.parametrize("buffered_io", [False, True])
+def test_compile_units(tmp_path, optimize, buffered_io):
+    result = _compile_units(SRC, tmp_path, optimize=optimize, buffered_io=buffered_io)
+    assert "app_inc.c" in result["compiled"]
+    assert "app_dec.c" in result["compiled"]
+    assert _build_and_run(tmp_path) == "27"
+
+
+def test_compile_units_static(tmp_path):
+    _compile_units("[0 ,] [0 + .]", tmp_path, backing_store="static")
+    assert _build_and_run(tmp_path, input="a") == "98"
+
+
+def test_compile_units_unchanged(tmp_path):
+    _compile_units(SRC, tmp_path)
+    result = _compile_units(SRC, tmp_path)
+    assert result["compiled"] == []
+    assert result["removed"] == []
+    assert "app_inc.c" in result["unchanged"]
+
+
+def test_compile_units_only_changed(tmp_path):
+    _compile_units(SRC, tmp_path)
+    assert _build_and_run(tmp_path) == "27"
+    objects = {path.name: path.stat().st_mtime_ns for path in tmp_path.glob("*.o")}
+
+    result = _compile_units(SRC.replace("{dec [$ -]}", "{dec [$ 0]}"), tmp_path)
+    assert result["compiled"] == ["app_dec.c"]
+    assert _build_and_run(tmp_path) == "23"
+    for path in tmp_path.glob("*.o"):
+        rebuilt = path.stat().st_mtime_ns != objects[path.name]
+        assert rebuilt == (path.name == "app_dec.o")
+
+
+def test_compile_units_options_change(tmp_path):
+    _compile_units(SRC, tmp_path)
+    result = _compile_units(SRC, tmp_path, elide_bounds_checks=True)
+    assert "app_inc.c" in result["compiled"]
+
+
+def test_compile_units_compiler_change(tmp_path, monkeypatch):
+    _compile_units(SRC, tmp_path)
+    monkeypatch.setattr(units, "compiler_revision", lambda: "another build")
+    result = _compile_units(SRC, tmp_path)
+    # Every unit is compiled again; the shared files depend on their content.
+    unchanged = result["unchanged"]
+    assert not [name for name in unchanged if name.startswith(("app_", "main_"))]
+    assert "app_inc.c" in result["compiled"]
+    manifest = json.loads((tmp_path / units.MANIFEST_NAME).read_text())
+    assert manifest["compiler"] == "another build"
+
+
+def test_compile_units_removed(tmp_path):
+    _compile_units(SRC, tmp_path)
+    result = _compile_units("{inc [$ +]} [0 inc .]", tmp_path)
+    assert "app_dec.c" in result["removed"]
+    assert not (tmp_path / "app_dec.c").exists()
+    manifest = json.loads((tmp_path / units.MANIFEST_NAME).read_text())
+    assert "app_dec.c" not in manifest["units"]
+    assert _build_and_run(tmp_path) == "1"
+
+
+def test_compile_units_main_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(units, "MAIN_BLOCK_SIZE", 4)
+    src = "".join(f"[{i} + .]\n" for i in range(40))
+    _compile_units(src, tmp_path)
+    blocks = sorted(tmp_path.glob("main_*.c"))
+    assert len(blocks) > 1
+    expected = _build_and_run(tmp_path)
+
+    # Changing one statement only changes the block it is in.
+    result = _compile_units(src.replace("[17 + .]", "[17 - .]"), tmp_path)
+    assert len(result["compiled"]) == 2  # the block and main.c
+    assert "main.c" in result["compiled"]
+    assert len(result["removed"]) == 1
+    assert _build_and_run(tmp_path) != expected
+
+
+def test_main_blocks_limits(monkeypatch):
+    monkeypatch.setattr(units, "MAIN_BLOCK_SIZE", 4)
+    statements = [["[", "0", "+", "]"]] * 40
+    blocks = list(units.main_blocks(statements))
+    assert sum(len(block) for block in blocks) == 4 * 40
+    assert all(len(block) <= 4 * 4 * 4 for block in blocks)
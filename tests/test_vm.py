@@ -0,0 +1,176 @@
+import io
+from pathlib import Path
+
+import pytest
+
+import stercus
+from stercus import vm
+from stercus.text2stercus import parse as text2stercus
+
+from test_compiler import _compile_and_run, MEMORY_SIZE
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+
+def _run(src, input=b"", args=()):
+    stdout = io.BytesIO()
+    stderr = io.StringIO()
+    memory = vm.run_string(
+        src,
+        memory_size=MEMORY_SIZE,
+        args=args,
+        stdin=io.BytesIO(input),
+        stdout=stdout,
+        stderr=stderr,
+    )
+    return stdout.getvalue().decode(), memory, stderr.getvalue()
+
+
+def test_vm_increment():
+    assert _run("[0 + .]")[0] == "1"
+
+
+def test_vm_decrement_wraps():
+    out, memory, _ = _run("[0 - .]")
+    assert out == "-1"
+    assert memory[0] == 255
+
+
+def test_vm_input():
+    assert _run("[0 , :] [1 , .]", input=b"a")[0] == "a-1"
+
+
+def test_vm_cli_args():
+    assert _run("[0 :] [1 :] [2 :]", args=["ab", "c"])[0] == "ab "
+
+
+def test_vm_out_of_bounds():
+    out, _, err = _run("[0 -] [[0] + .]")
+    assert out == "0"
+    assert "out of bounds" in err
+
+
+def test_vm_writes_output_while_running():
+    class Stop(Exception):
+        pass
+
+    class Output(io.BytesIO):
+        def write(self, data):
+            super().write(data)
+            if self.tell() > 2 * vm.OUTPUT_BUFFER_SIZE:
+                raise Stop
+
+    stdout = Output()
+    with pytest.raises(Stop):
+        vm.run_string("[0 1] (0 [1 :])", stdout=stdout)
+    assert stdout.tell() <= 3 * vm.OUTPUT_BUFFER_SIZE
+
+
+def test_vm_writes_output_when_interrupted():
+    class Stderr:
+        def write(self, text):
+            raise KeyboardInterrupt
+
+    stdout = io.BytesIO()
+    with pytest.raises(KeyboardInterrupt):
+        vm.run_string("[0 72 :] [-1 +]", stdout=stdout, stderr=Stderr())
+    assert stdout.getvalue() == b"H"
+
+
+def test_vm_call_arg_is_char():
+    # the index is converted to a char when passed to the application
+    stdout = io.BytesIO()
+    vm.run_string("{a [0 $ .]} [1 a] [200 a]", memory_size=300, stdout=stdout)
+    assert stdout.getvalue() == b"1-56"
+
+
+def test_vm_undefined_application():
+    with pytest.raises(stercus.ApplicationNameError):
+        _run("[0 foo]")
+
+
+@pytest.mark.parametrize(
+    "src,input",
+    [
+        ("[0 5 . [1 +] [1] .] [1 .]", ""),
+        ("[0 3] (0 [1 + + +] [0 -]) [1 .]", ""),
+        ("{inc [$ +]} {foo [$ inc inc]} [0 foo . 7 foo .]", ""),
+        ("[0 4] ([0] [[0] 2] [[0] :] [0 -])", ""),
+        ("[0 ,] [1 ,] (1 [0 -] [1 -]) [0 .]", "\x09\x04"),
+        ("[1 1] [[1] + +] [1 .] [2 .] [3 .]", ""),
+        ("[1 1] [[1] 5 +] [1 .] [5 .] [6 .]", ""),
+    ],
+)
+def test_vm_matches_compiled(src, input):
+    app_table = stercus.parse(stercus.lex(src))
+    expected = _compile_and_run(app_table, input=input)
+    assert _run(src, input=input.encode())[0] == expected.stdout
+
+
+@pytest.mark.parametrize(
+    "path,input",
+    [
+        ("math/add.cus", "\x05\x07"),
+        ("math/divide.cus", ""),
+        ("math/multiply.cus", "\x05\x07"),
+        ("simple/application.cus", ""),
+        ("simple/hello_world.cus", ""),
+        ("simple/variable.cus", ""),
+    ],
+)
+def test_vm_matches_compiled_examples(path, input):
+    src = (EXAMPLES / path).read_text()
+    app_table = stercus.parse(stercus.lex(stercus.preprocess(src)))
+    expected = _compile_and_run(app_table, input=input)
+    assert _run(src, input=input.encode())[0] == expected.stdout
+
+
+def _run_assembled(src, fuse, memory_size=MEMORY_SIZE, input=b""):
+    code = vm.load_string(src, fuse=fuse)
+    memory = bytearray(memory_size)
+    stdout = io.BytesIO()
+    stderr = io.StringIO()
+    vm.execute(code, memory, stdin=io.BytesIO(input), stdout=stdout, stderr=stderr)
+    return code, stdout.getvalue(), memory, stderr.getvalue()
+
+
+@pytest.mark.parametrize(
+    "src",
+    [
+        "[0 3] (0 [1 + + +] [0 -]) [1 .]",
+        "[0 5] [1 [0]] [1 . :] [0 -] (0 [2 [0]] [0 -] [2 .])",
+        "[0 72 : 105 : 10 :] [1 -7 . 3] [1 .]",
+        "[0 72 : + : - - . +] [20 5 : + + . - 7]",
+        "[0 3] (0 [0 -] [1 +]) [0 2] (0 [1 +] [0 - -] [0 +])",
+        "{inc [$ +]} [0 4] (0 [1 inc] [0 -]) [1 inc .]",
+        "[0 2] (0 [1 3] (1 [2 : +] [1 -]) [0 -]) [2 .]",
+        # Out of bounds literal indices, in every kind of superinstruction.
+        "[20 + 5 : . 7 :] [0 [20]] [20 [0]] [0 .] (20 [0 +]) [-1 -]",
+        "[0 1] (0 [0 -] (20 [20 -]))",
+    ],
+)
+def test_vm_superinstructions_match_unfused(src):
+    _, *unfused = _run_assembled(src, fuse=False, memory_size=20)
+    _, *fused = _run_assembled(src, fuse=True, memory_size=20)
+    assert fused == unfused
+
+
+def test_vm_superinstructions_used():
+    src = "[0 10] (0 [1 5 +] [2 [1]] [3 72 :] [0 -])"
+    unfused_code, *unfused = _run_assembled(src, fuse=False)
+    fused_code, *fused = _run_assembled(src, fuse=True)
+    assert fused == unfused
+    opcodes = [op for op, _, _ in vm.decode(fused_code)]
+    assert vm.DEC_JNZ in opcodes
+    assert vm.PRINT in opcodes
+    assert vm.COPY in opcodes
+    assert len(opcodes) < len(vm.decode(unfused_code))
+
+
+@pytest.mark.parametrize("encoding", ["literal", "delta"])
+def test_vm_superinstructions_text(encoding):
+    src = text2stercus("Threaded dispatch!!", encoding)
+    code, *fused = _run_assembled(src, fuse=True)
+    assert fused == list(_run_assembled(src, fuse=False)[1:])
+    assert fused[0] == b"Threaded dispatch!!"
+    assert [op for op, _, _ in vm.decode(code)] == [vm.PRINT, vm.HALT]